@@ -1,12 +1,20 @@
-from typing import Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 import unicodedata
-import spacy
+import threading
+import hashlib
 import re
 
 
-NLP = spacy.load("pt_core_news_sm", disable=["parser", "tagger", "lemmatizer"])
+# spaCy é carregado sob demanda (ver _get_nlp); importar este módulo não custa nada.
+_NLP = None
+_NLP_LOCK = threading.Lock()
+
+NER_N_PROCESS  = 1     # processos usados por nlp.pipe
+NER_BATCH_SIZE = 32    # textos por lote em nlp.pipe
+NER_CACHE_SIZE = 4096  # amostras (por hash) mantidas no cache de NER
 
 BR_NAMES = {
     "João", "Gabriel", "Lucas", "Pedro", "Mateus", "José", "Gustavo", "Guilherme", "Carlos",
@@ -60,42 +68,102 @@ def _clean(s: str) -> str:
     return re.sub(r"[^A-Za-z ]+", "", s).strip()
 
 
-def score_series(s: pd.Series) -> float:
+def _get_nlp():
+    """Carrega o pt_core_news_sm uma única vez por processo, no primeiro uso."""
+    global _NLP
+    if _NLP is None:
+        with _NLP_LOCK:
+            if _NLP is None:
+                import spacy
+                _NLP = spacy.load("pt_core_news_sm", disable=["parser", "tagger", "lemmatizer"])
+    return _NLP
+
+
+_NER_CACHE: "OrderedDict[str, float]" = OrderedDict()
+_NER_CACHE_LOCK = threading.Lock()
+
+
+def _person_ratios(texts: List[str], *, n_process: int = NER_N_PROCESS,
+                   batch_size: int = NER_BATCH_SIZE) -> List[float]:
+    """
+    Fração de entidades PER em cada texto. Os textos ainda não vistos passam
+    juntos por nlp.pipe; o resultado fica em cache pelo hash do conteúdo.
+    """
+    keys = [hashlib.sha1(t.encode("utf-8")).hexdigest() for t in texts]
+    found: Dict[str, float] = {}
+    with _NER_CACHE_LOCK:
+        for k in keys:
+            if k in _NER_CACHE:
+                _NER_CACHE.move_to_end(k)
+                found[k] = _NER_CACHE[k]
+    missing = {k: t for k, t in zip(keys, texts) if k not in found}
+    if missing:
+        docs = _get_nlp().pipe(missing.values(), batch_size=batch_size, n_process=n_process)
+        for k, doc in zip(missing, docs):
+            person_hits = sum(1 for ent in doc.ents if ent.label_ == "PER")
+            found[k] = person_hits / max(1, len(doc.ents))
+        with _NER_CACHE_LOCK:
+            for k in missing:
+                _NER_CACHE[k] = found[k]
+            while len(_NER_CACHE) > NER_CACHE_SIZE:
+                _NER_CACHE.popitem(last=False)
+    return [found[k] for k in keys]
+
+
+def _name_features(s: pd.Series) -> Tuple[Optional[Dict[str, float]], str]:
+    """Sinais baratos da coluna + o texto da amostra que vai para o NER."""
     n = len(s)
     sample = s.dropna().astype(str).head(500)
     if sample.empty:
-        return 0.0
-    non_null = sample.size / n
-    alpha_pct = np.mean(sample.apply(lambda x: _clean(x).replace(" ", "").isalpha()))
-    istitle_pct = np.mean(sample.apply(lambda x: x.istitle()))
-    tok2_pct   = np.mean(sample.apply(lambda x: len(x.split()) >= 2))
-    len_ok     = np.mean(sample.str.len().between(8, 40))
-    dict_pct   = np.mean(sample.apply(lambda x: _clean(x.split()[0]).lower() in BR_NAMES))
-    ner_sample = " ".join(sample.sample(min(100, len(sample))))
-    doc = NLP(ner_sample)
-    person_hits = sum(1 for ent in doc.ents if ent.label_ == "PER")
-    ner_pct = person_hits / max(1, len(doc.ents))
+        return None, ""
+    feats = dict(
+        non_null = sample.size / n,
+        alpha    = np.mean(sample.apply(lambda x: _clean(x).replace(" ", "").isalpha())),
+        title    = np.mean(sample.apply(lambda x: x.istitle())),
+        tok2     = np.mean(sample.apply(lambda x: len(x.split()) >= 2)),
+        len_ok   = np.mean(sample.str.len().between(8, 40)),
+        dict     = np.mean(sample.apply(lambda x: _clean(x.split()[0]).lower() in BR_NAMES)),
+    )
+    # amostra fixa (random_state) para o hash do cache ser estável entre reruns
+    ner_sample = " ".join(sample.sample(min(100, len(sample)), random_state=0))
+    return feats, ner_sample
+
+
+def _name_score(feats: Dict[str, float], ner_pct: float) -> float:
     weights = dict(non_null=0.1, alpha=0.15, title=0.15, tok2=0.15,
                    len_ok=0.1, dict=0.15, ner=0.2)
     score = (
-        weights["non_null"] * non_null +
-        weights["alpha"]    * alpha_pct +
-        weights["title"]    * istitle_pct +
-        weights["tok2"]     * tok2_pct +
-        weights["len_ok"]   * len_ok +
-        weights["dict"]     * dict_pct +
+        weights["non_null"] * feats["non_null"] +
+        weights["alpha"]    * feats["alpha"] +
+        weights["title"]    * feats["title"] +
+        weights["tok2"]     * feats["tok2"] +
+        weights["len_ok"]   * feats["len_ok"] +
+        weights["dict"]     * feats["dict"] +
         weights["ner"]      * ner_pct
     )
     return score
 
 
-def detect_name_column(df: pd.DataFrame) -> tuple[str, pd.Series]:
-    obj_cols = df.select_dtypes(include="object").columns
-    if not len(obj_cols):
-        raise ValueError("DataFrame não tem colunas do tipo string.")
-    scores = {col: score_series(df[col]) for col in obj_cols}
-    best = max(scores, key=scores.get)
-    return best, pd.Series(scores, name="score").sort_values(ascending=False)
+def score_series(s: pd.Series, n_process: int = NER_N_PROCESS) -> float:
+    feats, ner_sample = _name_features(s)
+    if feats is None:
+        return 0.0
+    return _name_score(feats, _person_ratios([ner_sample], n_process=n_process)[0])
+
+
+def _score_name_columns(sample: pd.DataFrame, cols: pd.Index, n_process: int = NER_N_PROCESS) -> Dict[str, float]:
+    """score_series para várias colunas, com o NER de todas num único nlp.pipe."""
+    feats = {col: _name_features(sample[col]) for col in cols}
+    texts = {col: text for col, (f, text) in feats.items() if f is not None}
+    ratios = dict(zip(texts, _person_ratios(list(texts.values()), n_process=n_process)))
+    return {
+        col: _name_score(f, ratios[col]) if f is not None else 0.0
+        for col, (f, _) in feats.items()
+    }
+
+
+def detect_name_column(df: pd.DataFrame, n_process: int = NER_N_PROCESS) -> tuple[str, pd.Series]:
+    return detect_columns(df, kinds=("name",), n_process=n_process)["name"]
 
 
 def _score_phone_series(s: pd.Series) -> float:
@@ -117,12 +185,7 @@ def _score_phone_series(s: pd.Series) -> float:
 
 
 def detect_brazil_phone_column(df: pd.DataFrame) -> tuple[str, pd.Series]:
-    cols = df.select_dtypes(include=["object", "string"]).columns
-    if not len(cols):
-        raise ValueError("DataFrame não tem colunas textuais (object/string).")
-    scores = {col: _score_phone_series(df[col]) for col in cols}
-    best = max(scores, key=scores.get)
-    return best, pd.Series(scores, name="score").sort_values(ascending=False)
+    return detect_columns(df, kinds=("phone",))["phone"]
 
 
 # ----------------- Utils básicos -----------------
@@ -176,8 +239,79 @@ CPF_REGEX  = re.compile(r"\b\d{3}\.?\d{3}\.?\d{3}-?\d{2}\b")
 CNPJ_REGEX = re.compile(r"\b\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}\b")
 PHONE_LIKE = re.compile(r"^\s*\(?\d{2}\)?\s*\d{4,5}-?\d{4}\s*$")  # para penalizar falsos positivos (telefone)
 
+# ----------------- Validação vetorizada -----------------
+_CPF_W1  = np.arange(10, 1, -1)                                    # 10..2
+_CPF_W2  = np.arange(11, 1, -1)                                    # 11..2
+_CNPJ_W1 = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+_CNPJ_W2 = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+
+
+def _digits_matrix(digits: pd.Series, width: int) -> np.ndarray:
+    """Converte strings de `width` dígitos ASCII numa matriz uint8 (linhas x width)."""
+    if digits.empty:
+        return np.empty((0, width), dtype=np.uint8)
+    raw = "".join(digits.tolist()).encode("ascii")
+    return (np.frombuffer(raw, dtype=np.uint8) - ord("0")).reshape(-1, width)
+
+
+def _cpf_mask(m: np.ndarray) -> np.ndarray:
+    if not len(m):
+        return np.zeros(0, dtype=bool)
+    m = m.astype(np.int64)
+    r1 = (m[:, :9] @ _CPF_W1 * 10) % 11
+    r1[r1 == 10] = 0
+    r2 = (m[:, :10] @ _CPF_W2 * 10) % 11
+    r2[r2 == 10] = 0
+    repeated = (m == m[:, :1]).all(axis=1)
+    return (r1 == m[:, 9]) & (r2 == m[:, 10]) & ~repeated
+
+
+def _cnpj_mask(m: np.ndarray) -> np.ndarray:
+    if not len(m):
+        return np.zeros(0, dtype=bool)
+    m = m.astype(np.int64)
+    r1 = (m[:, :12] @ _CNPJ_W1) % 11
+    dv1 = np.where(r1 < 2, 0, 11 - r1)
+    r2 = (m[:, :13] @ _CNPJ_W2) % 11
+    dv2 = np.where(r2 < 2, 0, 11 - r2)
+    repeated = (m == m[:, :1]).all(axis=1)
+    return (dv1 == m[:, 12]) & (dv2 == m[:, 13]) & ~repeated
+
+
+def validate_documents(s: pd.Series) -> pd.DataFrame:
+    """
+    Valida CPF/CNPJ de uma coluna inteira de uma vez.
+    Retorna um DataFrame com o mesmo índice de `s` e as máscaras booleanas:
+      - cpf_valid / cnpj_valid: dígitos verificadores conferem
+      - cpf_fmt / cnpj_fmt: valor contém algo com formato de CPF/CNPJ
+      - phone_like: valor parece um telefone
+    Células nulas ficam com todas as máscaras False.
+    """
+    text = s.astype("string").str.strip()
+    notnull = text.notna().to_numpy()
+    digits = text.str.replace(r"[^0-9]", "", regex=True).fillna("")
+    lengths = digits.str.len().to_numpy()
+
+    cpf_valid = np.zeros(len(s), dtype=bool)
+    cnpj_valid = np.zeros(len(s), dtype=bool)
+    is11 = lengths == 11
+    is14 = lengths == 14
+    cpf_valid[is11] = _cpf_mask(_digits_matrix(digits[is11], 11))
+    cnpj_valid[is14] = _cnpj_mask(_digits_matrix(digits[is14], 14))
+
+    return pd.DataFrame(
+        {
+            "cpf_valid": cpf_valid,
+            "cnpj_valid": cnpj_valid,
+            "cpf_fmt": text.str.contains(CPF_REGEX, na=False).to_numpy(dtype=bool) & notnull,
+            "cnpj_fmt": text.str.contains(CNPJ_REGEX, na=False).to_numpy(dtype=bool) & notnull,
+            "phone_like": text.str.match(PHONE_LIKE, na=False).to_numpy(dtype=bool) & notnull,
+        },
+        index=s.index,
+    )
+
 # ----------------- Scoring de uma série -----------------
-def _score_polo_passivo_doc_series(s: pd.Series, col_name: str) -> float:
+def _score_polo_passivo_doc_series(s: pd.Series, col_name: str, head: Optional[pd.Series] = None) -> float:
     # 1) Sinal por nome da coluna / rótulo no topo
     name = _strip_accents_lower(col_name)
     name_bonus = 0.0
@@ -187,7 +321,8 @@ def _score_polo_passivo_doc_series(s: pd.Series, col_name: str) -> float:
         name_bonus += 20.0
 
     # tenta usar o(s) primeiro(s) valor(es) como possível rótulo (caso o header esteja nos dados)
-    first_vals = [str(v) for v in s.head(3).dropna().astype(str)]
+    # (`head` permite passar o topo da coluna original quando `s` é uma amostra)
+    first_vals = [str(v) for v in (s if head is None else head).head(3).dropna().astype(str)]
     top_label = _strip_accents_lower(" ".join(first_vals[:1]))  # usa só o 1º por padrão
     if "polo passivo" in top_label:
         name_bonus += 15.0
@@ -200,41 +335,17 @@ def _score_polo_passivo_doc_series(s: pd.Series, col_name: str) -> float:
     if n == 0:
         return name_bonus  # só o nome vai contar
 
-    # contagens
-    cpf_valid = cnpj_valid = cpf_fmt = cnpj_fmt = phone_like = 0
-
-    for v in notnull:
-        vv = str(v).strip()
-        digits = _only_digits(vv)
-        # formatos (regex)
-        if CPF_REGEX.search(vv):
-            cpf_fmt += 1
-        if CNPJ_REGEX.search(vv):
-            cnpj_fmt += 1
-        # validação por dígitos
-        if len(digits) == 11 and _is_valid_cpf(digits):
-            cpf_valid += 1
-        elif len(digits) == 14 and _is_valid_cnpj(digits):
-            cnpj_valid += 1
-        # telefone-like (para evitar confusão com celulares)
-        if PHONE_LIKE.match(vv):
-            phone_like += 1
-
-    # taxas
-    cpf_rate      = cpf_valid / n
-    cnpj_rate     = cnpj_valid / n
-    cpf_fmt_rate  = cpf_fmt / n
-    cnpj_fmt_rate = cnpj_fmt / n
-    phone_rate    = phone_like / n
+    # taxas (máscaras calculadas de uma vez para a coluna toda)
+    rates = validate_documents(notnull).mean()
 
     # score composto
     score = 0.0
-    score += 100.0 * (cpf_rate + cnpj_rate)           # válidos têm peso maior
-    score += 25.0  * (cpf_fmt_rate + cnpj_fmt_rate)   # formato ajuda quando não há DV
-    score -= 60.0  * phone_rate                       # penaliza coluna que parece telefone
-    score += name_bonus                               # bônus por "polo passivo"/"passivo"
+    score += 100.0 * (rates["cpf_valid"] + rates["cnpj_valid"])  # válidos têm peso maior
+    score += 25.0  * (rates["cpf_fmt"] + rates["cnpj_fmt"])      # formato ajuda quando não há DV
+    score -= 60.0  * rates["phone_like"]                         # penaliza coluna que parece telefone
+    score += name_bonus                                          # bônus por "polo passivo"/"passivo"
 
-    return score
+    return float(score)
 
 # ----------------- Função principal -----------------
 def detect_polo_passivo_doc_column(df: pd.DataFrame) -> Tuple[str, pd.Series]:
@@ -242,10 +353,152 @@ def detect_polo_passivo_doc_column(df: pd.DataFrame) -> Tuple[str, pd.Series]:
     Detecta a coluna que contém CPF/CNPJ do POLO PASSIVO.
     Retorna: (nome_da_coluna, serie_de_scores_decrescente)
     """
-    cols = df.select_dtypes(include=["object", "string"]).columns
-    if not len(cols):
-        raise ValueError("DataFrame não tem colunas textuais (object/string).")
+    return detect_columns(df, kinds=("doc",))["doc"]
+
+# ----------------- Detecção por amostragem -----------------
+# Tamanhos crescentes de amostra; a varredura completa só acontece se nenhum deles decidir.
+SAMPLE_SIZES = (256, 1024, 4096)
+
+# kind -> (dtypes candidatos, mensagem se não houver colunas,
+#          scorer(amostra, colunas, df, n_process) -> {coluna: score}, margem de confiança)
+_DETECTORS: Dict[str, Tuple[Tuple[str, ...], str, Callable[..., Dict[str, float]], float]] = {
+    "name": (
+        ("object",),
+        "DataFrame não tem colunas do tipo string.",
+        lambda sample, cols, df, n_process: _score_name_columns(sample, cols, n_process=n_process),
+        0.15,
+    ),
+    "phone": (
+        ("object", "string"),
+        "DataFrame não tem colunas textuais (object/string).",
+        lambda sample, cols, df, n_process: {col: _score_phone_series(sample[col]) for col in cols},
+        0.25,
+    ),
+    "doc": (
+        ("object", "string"),
+        "DataFrame não tem colunas textuais (object/string).",
+        lambda sample, cols, df, n_process: {
+            col: _score_polo_passivo_doc_series(sample[col], col, head=df[col].head(3)) for col in cols
+        },
+        25.0,
+    ),
+}
+
+
+def _stratified_positions(n: int, size: int, seed: int = 0) -> np.ndarray:
+    """Uma linha sorteada em cada uma de `size` faixas iguais do arquivo (em ordem)."""
+    if size >= n:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    edges = np.linspace(0, n, size + 1)
+    pos = (edges[:-1] + rng.random(size) * np.diff(edges)).astype(np.int64)
+    return np.minimum(pos, n - 1)
+
+
+def _is_decided(scores: pd.Series, margin: float) -> bool:
+    return len(scores) < 2 or scores.iloc[0] - scores.iloc[1] >= margin
+
+
+def detect_columns(df: pd.DataFrame, kinds: Iterable[str] = ("name", "phone", "doc"),
+                   sizes: Tuple[int, ...] = SAMPLE_SIZES,
+                   n_process: int = NER_N_PROCESS) -> Dict[str, Tuple[str, pd.Series]]:
+    """
+    Detecta várias colunas de uma vez ("name", "phone" e/ou "doc") sobre uma
+    única amostra estratificada, compartilhada entre os detectores e crescente
+    (256 -> 1k -> 4k linhas). Cada detector para assim que a melhor coluna
+    abre a margem de confiança sobre a segunda; se continuar empatado após a
+    maior amostra, pontua a coluna inteira.
+    Retorna: {kind: (nome_da_coluna, serie_de_scores_decrescente)}
+    """
+    pending: Dict[str, pd.Index] = {}
+    for kind in kinds:
+        dtypes, empty_msg, _, _ = _DETECTORS[kind]
+        cols = df.select_dtypes(include=list(dtypes)).columns
+        if not len(cols):
+            raise ValueError(empty_msg)
+        pending[kind] = cols
+
+    used = pd.Index([]).append(list(pending.values())).unique()
+    n = len(df)
+    results: Dict[str, Tuple[str, pd.Series]] = {}
+    for size in [sz for sz in sizes if sz < n] + [n]:
+        sample = df[used].iloc[_stratified_positions(n, size)]
+        full = size >= n
+        for kind, cols in list(pending.items()):
+            _, _, scorer, margin = _DETECTORS[kind]
+            scores = pd.Series(
+                scorer(sample, cols, df, n_process), name="score"
+            ).sort_values(ascending=False, kind="stable")  # empate: mantém a ordem das colunas
+            if full or _is_decided(scores, margin):
+                results[kind] = (scores.index[0], scores)
+                del pending[kind]
+        if not pending:
+            break
+    return results
+
+
+# ----------------- Cache de detecção -----------------
+_DETECTION_CACHE = None
+_DETECTION_CACHE_LOCK = threading.Lock()
+
+
+def _detection_cache():
+    global _DETECTION_CACHE
+    if _DETECTION_CACHE is None:
+        with _DETECTION_CACHE_LOCK:
+            if _DETECTION_CACHE is None:
+                from utils.detection_cache import DetectionCache
+                _DETECTION_CACHE = DetectionCache()
+    return _DETECTION_CACHE
+
+
+def dataframe_fingerprint(df: pd.DataFrame) -> str:
+    """
+    Impressão digital do conteúdo: forma, nomes e tipos das colunas e o hash
+    vetorizado de cada linha (sem o índice, então reindexar não muda o valor).
+    """
+    h = hashlib.sha1()
+    h.update(repr((df.shape, [str(c) for c in df.columns], [str(t) for t in df.dtypes])).encode("utf-8"))
+    try:
+        rows = pd.util.hash_pandas_object(df, index=False)
+    except TypeError:
+        # células não hasheáveis (listas, dicts...): usa o texto
+        rows = pd.util.hash_pandas_object(df.astype(str), index=False)
+    h.update(rows.to_numpy().tobytes())
+    return h.hexdigest()
 
-    scores = {col: _score_polo_passivo_doc_series(df[col], col) for col in cols}
-    best = max(scores, key=scores.get)
-    return best, pd.Series(scores, name="score").sort_values(ascending=False)
\ No newline at end of file
+
+def detect_columns_cached(df: pd.DataFrame, kinds: Iterable[str] = ("name", "phone", "doc"), *,
+                          fingerprint: Optional[str] = None,
+                          memo: Optional[Dict[Tuple[str, str], Dict[str, Tuple[str, pd.Series]]]] = None,
+                          persist: bool = True,
+                          n_process: int = NER_N_PROCESS) -> Dict[str, Tuple[str, pd.Series]]:
+    """
+    detect_columns memoizado pela impressão digital do DataFrame: primeiro em
+    `memo` (ex.: um dict no st.session_state), depois, com `persist`, no cache
+    local em disco. Só roda a detecção de novo quando o conteúdo muda.
+    Passe `fingerprint` se já a tiver calculado para este DataFrame.
+    """
+    kinds = tuple(kinds)
+    key = (fingerprint or dataframe_fingerprint(df), ",".join(kinds))
+    if memo is not None and key in memo:
+        return memo[key]
+    results = None
+    if persist:
+        stored = _detection_cache().get(*key)
+        by_name = {str(c): c for c in df.columns}
+        if stored is not None and all(col in by_name for col, _ in stored.values()):
+            results = {
+                kind: (by_name[col], pd.Series({by_name[c]: v for c, v in scores.items()}, name="score", dtype=float))
+                for kind, (col, scores) in stored.items()
+            }
+    if results is None:
+        results = detect_columns(df, kinds=kinds, n_process=n_process)
+        if persist:
+            _detection_cache().put(*key, {
+                kind: (str(col), {str(c): float(v) for c, v in scores.items()})
+                for kind, (col, scores) in results.items()
+            })
+    if memo is not None:
+        memo[key] = results
+    return results
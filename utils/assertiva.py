@@ -1,8 +1,15 @@
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.assertiva_cache import AssertivaCache
+from utils.algorithms import validate_documents
+from utils.token_provider import TokenProvider, TokenStore
+from utils.ratelimit import TokenBucket
+from utils import http_client
 import time, base64, requests
 from typing import Optional
 import datetime as dt
 import streamlit as st
+import pandas as pd
 import requests
 import time
 import re
@@ -18,28 +25,49 @@ ENDPOINT_CPF  = f"{PRODUCT_BASE}/localize/v3/cpf"
 ENDPOINT_CNPJ = f"{PRODUCT_BASE}/localize/v3/cnpj"
 
 
-_token_cache: dict = {"access_token": None, "exp": 0}
+# Cache local das respostas (consultas são pagas). Configurável em [assertiva] no secrets.toml.
+CACHE_TTL_DAYS    = float(st.secrets["assertiva"].get("CACHE_TTL_DAYS", 30))
+CACHE_MAX_ENTRIES = int(st.secrets["assertiva"].get("CACHE_MAX_ENTRIES", 50_000))
 
+_lookup_cache = AssertivaCache(ttl=CACHE_TTL_DAYS * 86400, max_entries=CACHE_MAX_ENTRIES)
 
-def _get_access_token() -> str:
-    if _token_cache["access_token"] and _token_cache["exp"] > time.time():
-        return _token_cache["access_token"]
+# Consultas em lote: threads simultâneas e teto de requisições/s (cota da Assertiva).
+MAX_CONCURRENCY = int(st.secrets["assertiva"].get("MAX_CONCURRENCY", 8))
+RATE_PER_SEC    = float(st.secrets["assertiva"].get("RATE_PER_SEC", 5))
+
+# Pool de conexões do host comporta todas as threads; limitador único para o processo todo.
+http_client.configure_host("api.assertivasolucoes.com.br", pool_maxsize=max(MAX_CONCURRENCY, 1))
+_rate_limiter = TokenBucket(RATE_PER_SEC)
+
+
+def _fetch_access_token() -> Tuple[str, float]:
     basic = base64.b64encode(f"{ASSERTIVA_CLIENT_ID}:{ASSERTIVA_SECRET}".encode()).decode()
     headers = {
         "Authorization": f"Basic {basic}",
         "Content-Type": "application/x-www-form-urlencoded"
     }
     data = {"grant_type": "client_credentials"}
-    resp = requests.post(AUTH_URL, headers=headers, data=data, timeout=10)
+    resp = http_client.post(AUTH_URL, headers=headers, data=data, timeout=10)
     resp.raise_for_status()
     payload = resp.json()
-    _token_cache["access_token"] = payload["access_token"]
     TOKEN_EXPIRES_MINS = 30
     ERROR_MARGIN_MINS = 1
     expires_in = int(payload.get("expires_in", TOKEN_EXPIRES_MINS * 60))
     expires_in = max(0, expires_in - ERROR_MARGIN_MINS * 60)
-    _token_cache["exp"] = time.time() + expires_in
-    return _token_cache["access_token"]
+    return payload["access_token"], time.time() + expires_in
+
+
+# Token único por processo (ou entre processos, com SHARE_TOKEN), renovado antes de vencer.
+_token_provider = TokenProvider(
+    _fetch_access_token,
+    name="assertiva",
+    refresh_margin=float(st.secrets["assertiva"].get("TOKEN_REFRESH_MARGIN_SECS", 300)),
+    store=TokenStore() if st.secrets["assertiva"].get("SHARE_TOKEN", True) else None,
+)
+
+
+def _get_access_token() -> str:
+    return _token_provider.get()
 
 
 _only_digits = lambda s: re.sub(r"\D", "", s or "")
@@ -251,10 +279,65 @@ def _choose_best(candidates: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
     return best
 
 
+# --- Consulta (com cache) ---
+def _fetch_resposta(kind: str, digits: str, *, finalidade: int, timeout: int, use_cache: bool = True,
+                    limiter: Optional[TokenBucket] = None) -> Dict[str, Any]:
+    """
+    Retorna o `resposta` bruto da Assertiva, do cache local quando possível.
+    Só as chamadas que de fato vão à API passam pelo limitador de taxa do
+    processo e, se dado, também por `limiter` (um teto a mais, nunca no lugar dele).
+    """
+    if use_cache:
+        cached = _lookup_cache.get(kind, digits, finalidade)
+        if cached is not None:
+            return cached
+
+    url = ENDPOINT_CPF if kind == "cpf" else ENDPOINT_CNPJ
+    params = {"idFinalidade": finalidade}
+    params[kind] = digits  # 'cpf' ou 'cnpj'
+
+    for attempt in range(2):
+        token = _get_access_token()
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json",
+        }
+        _rate_limiter.acquire()
+        if limiter is not None:
+            limiter.acquire()
+        resp = http_client.get(url, headers=headers, params=params, timeout=timeout)
+        if resp.status_code != 401 or attempt:
+            break
+        # token recusado (revogado/expirado antes da hora): descarta e tenta uma vez com outro
+        _token_provider.invalidate(token)
+    try:
+        resp.raise_for_status()
+    except requests.HTTPError as e:
+        # se possível, exponha texto da API para log
+        raise RuntimeError(f"Erro Assertiva {resp.status_code}: {resp.text}") from e
+
+    payload = resp.json() or {}
+    resposta = (payload.get("resposta") or {})
+    # respostas vazias também são cacheadas: a consulta foi cobrada do mesmo jeito
+    _lookup_cache.put(kind, digits, finalidade, resposta)
+    return resposta
+
+
+def _best_from_resposta(resposta: Dict[str, Any], kind: str) -> Optional[Dict[str, Any]]:
+    if not resposta:
+        return None
+    is_cnpj = (kind == "cnpj")
+    candidates = _collect_candidates(resposta, is_cnpj=is_cnpj)
+    return _choose_best(candidates)
+
+
 # --- Função principal ---
-def get_best_whatsapp_phone(documento: str, *, finalidade: int = 1, timeout: int = 15) -> Optional[Dict[str, Any]]:
+def get_best_whatsapp_phone(documento: str, *, finalidade: int = 1, timeout: int = 15,
+                            use_cache: bool = True) -> Optional[Dict[str, Any]]:
     """
     Consulta CPF/CNPJ na Assertiva e retorna o melhor telefone para WhatsApp.
+    A resposta bruta é guardada no cache local; com use_cache=False a API é
+    consultada de novo (e o cache, atualizado).
 
     Retorno (dict) (ou None se não houver telefones):
       {
@@ -276,31 +359,132 @@ def get_best_whatsapp_phone(documento: str, *, finalidade: int = 1, timeout: int
       }
     """
     kind, digits = _doc_kind(documento)
-    url = ENDPOINT_CPF if kind == "cpf" else ENDPOINT_CNPJ
-    params = {"idFinalidade": finalidade}
-    params[kind] = digits  # 'cpf' ou 'cnpj'
+    resposta = _fetch_resposta(kind, digits, finalidade=finalidade, timeout=timeout, use_cache=use_cache)
+    return _best_from_resposta(resposta, kind)
+
+
+def get_best_whatsapp_phones(
+    documentos: Sequence[str],
+    *,
+    max_concurrency: Optional[int] = None,
+    rate_per_sec: Optional[float] = None,
+    finalidade: int = 1,
+    timeout: int = 15,
+    use_cache: bool = True,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Versão em lote de get_best_whatsapp_phone: as consultas rodam em paralelo
+    (até `max_concurrency` threads, com conexões reaproveitadas). Toda consulta à
+    API passa pelo limitador do processo (RATE_PER_SEC do secrets.toml, dividido
+    entre todas as sessões); `rate_per_sec` só limita este lote a menos que isso.
+    Omitido, `max_concurrency` vale MAX_CONCURRENCY.
+
+    Retorna uma lista na mesma ordem de `documentos`, com um dict por linha:
+      {'documento': ..., 'result': <retorno de get_best_whatsapp_phone> | None, 'error': Exception | None}
+    Erros de uma linha não interrompem as demais. `on_progress(concluidos, total)`
+    é chamado na thread de quem chamou, à medida que cada consulta termina.
+    """
+    total = len(documentos)
+    limiter = None if rate_per_sec is None else TokenBucket(rate_per_sec)
+    results: List[Dict[str, Any]] = [
+        {"documento": doc, "result": None, "error": None} for doc in documentos
+    ]
+
+    def lookup(doc: str) -> Optional[Dict[str, Any]]:
+        kind, digits = _doc_kind(doc)
+        resposta = _fetch_resposta(kind, digits, finalidade=finalidade, timeout=timeout,
+                                   use_cache=use_cache, limiter=limiter)
+        return _best_from_resposta(resposta, kind)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency or MAX_CONCURRENCY)) as pool:
+        futures = {pool.submit(lookup, doc): i for i, doc in enumerate(documentos)}
+        for done, fut in enumerate(as_completed(futures), start=1):
+            i = futures[fut]
+            try:
+                results[i]["result"] = fut.result()
+            except Exception as e:
+                results[i]["error"] = e
+            if on_progress:
+                on_progress(done, total)
+    return results
+
+
+def _normalize_document(valor: Any) -> Optional[Tuple[str, str]]:
+    """(tipo, dígitos) do valor de uma célula; None se vazio. Lança ValueError se inválido."""
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)  # CPF/CNPJ lido como número pelo pandas
+    texto = str(valor).strip()
+    if not texto:
+        return None
+    return _doc_kind(texto)
 
-    headers = {
-        "Authorization": f"Bearer {_get_access_token()}",
-        "Accept": "application/json",
-    }
 
-    resp = requests.get(url, headers=headers, params=params, timeout=timeout)
-    try:
-        resp.raise_for_status()
-    except requests.HTTPError as e:
-        # se possível, exponha texto da API para log
-        raise RuntimeError(f"Erro Assertiva {resp.status_code}: {resp.text}") from e
+def enrich_documents(valores: Sequence[Any], **kwargs) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Busca o melhor telefone para cada linha de uma coluna de CPF/CNPJ, pagando
+    uma única consulta por documento: normaliza os valores (_doc_kind), descarta
+    vazios e inválidos (tamanho ou dígito verificador) antes de qualquer chamada,
+    consulta só os documentos únicos (get_best_whatsapp_phones, que recebe os
+    `kwargs`) e replica o resultado para todas as linhas de origem.
+
+    Retorna (resultados por linha, resumo), com os resultados no formato de
+    get_best_whatsapp_phones e o resumo:
+      {'total', 'unique', 'duplicates', 'invalid', 'empty'}
+    """
+    keys: List[Optional[str]] = []
+    results: List[Dict[str, Any]] = []
+    invalid = empty = 0
+    for valor in valores:
+        row = {"documento": valor, "result": None, "error": None}
+        key = None
+        try:
+            norm = _normalize_document(valor)
+        except ValueError as e:
+            row["error"] = e
+            invalid += 1
+        else:
+            if norm is None:
+                empty += 1
+            else:
+                key = norm[1]
+        keys.append(key)
+        results.append(row)
+
+    candidatos = pd.Series(sorted({k for k in keys if k is not None}), dtype="string")
+    masks = validate_documents(candidatos)
+    ok = (masks["cpf_valid"] | masks["cnpj_valid"]).to_numpy()
+    unicos = candidatos[ok].tolist()
+    invalidos = set(candidatos[~ok].tolist())
+
+    lookups = dict(zip(unicos, get_best_whatsapp_phones(unicos, **kwargs)))
+    validos = 0
+    for i, key in enumerate(keys):
+        if key is None:
+            continue
+        if key in invalidos:
+            results[i]["error"] = ValueError(f"Dígito verificador inválido: {key}")
+            invalid += 1
+        else:
+            results[i]["result"] = lookups[key]["result"]
+            results[i]["error"] = lookups[key]["error"]
+            validos += 1
+
+    summary = {
+        "total": len(keys),
+        "unique": len(unicos),
+        "duplicates": validos - len(unicos),
+        "invalid": invalid,
+        "empty": empty,
+    }
+    return results, summary
 
-    payload = resp.json() or {}
-    resposta = (payload.get("resposta") or {})
-    if not resposta:
-        return None
 
-    is_cnpj = (kind == "cnpj")
-    candidates = _collect_candidates(resposta, is_cnpj=is_cnpj)
-    best = _choose_best(candidates)
-    return best
+def lookup_cache_stats() -> Dict[str, Any]:
+    """Acertos, erros, taxa de acerto e nº de entradas do cache de consultas."""
+    return _lookup_cache.stats()
 
 
 def check_assertiva_access() -> tuple[bool, str]:
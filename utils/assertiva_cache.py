@@ -0,0 +1,93 @@
+from typing import Any, Dict, Optional
+from utils.local_store import SqliteStore
+import json
+import time
+
+
+class AssertivaCache(SqliteStore):
+    """
+    Cache persistente (SQLite) das respostas brutas da Assertiva.
+
+    Guarda o `resposta` de cada consulta por (tipo, dígitos, idFinalidade), para
+    não pagar de novo por documentos já consultados e para poder re-ranquear os
+    telefones (_choose_best) sem chamar a API. Entradas vencem após `ttl`
+    segundos e, acima de `max_entries`, as menos usadas recentemente são
+    removidas. Acertos/erros ficam contados na tabela `counters`.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS lookups (
+        kind        TEXT    NOT NULL,
+        digits      TEXT    NOT NULL,
+        finalidade  INTEGER NOT NULL,
+        resposta    TEXT    NOT NULL,
+        fetched_at  REAL    NOT NULL,
+        last_access REAL    NOT NULL,
+        PRIMARY KEY (kind, digits, finalidade)
+    );
+    CREATE INDEX IF NOT EXISTS lookups_last_access ON lookups(last_access);
+    CREATE TABLE IF NOT EXISTS counters (
+        name  TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    """
+
+    def __init__(self, ttl: float, max_entries: int, name: str = "assertiva"):
+        super().__init__(name)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _count(self, counter: str):
+        self.execute(
+            "INSERT INTO counters(name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (counter,),
+        )
+
+    def get(self, kind: str, digits: str, finalidade: int) -> Optional[Dict[str, Any]]:
+        key = (kind, digits, finalidade)
+        rows = self.query(
+            "SELECT resposta, fetched_at FROM lookups WHERE kind = ? AND digits = ? AND finalidade = ?",
+            key,
+        )
+        now = time.time()
+        if not rows or rows[0]["fetched_at"] + self.ttl < now:
+            if rows:
+                self.execute("DELETE FROM lookups WHERE kind = ? AND digits = ? AND finalidade = ?", key)
+            self._count("misses")
+            return None
+        self.execute(
+            "UPDATE lookups SET last_access = ? WHERE kind = ? AND digits = ? AND finalidade = ?",
+            (now, *key),
+        )
+        self._count("hits")
+        return json.loads(rows[0]["resposta"])
+
+    def put(self, kind: str, digits: str, finalidade: int, resposta: Dict[str, Any]):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO lookups(kind, digits, finalidade, resposta, fetched_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, digits, finalidade, json.dumps(resposta, ensure_ascii=False), now, now),
+            )
+            conn.execute(
+                "DELETE FROM lookups WHERE rowid IN ("
+                "  SELECT rowid FROM lookups ORDER BY last_access DESC LIMIT -1 OFFSET ?"
+                ")",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        counters = {r["name"]: r["value"] for r in self.query("SELECT name, value FROM counters")}
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        entries = self.query("SELECT COUNT(*) AS n FROM lookups")[0]["n"]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": entries,
+        }
+
+    def clear(self):
+        self.execute("DELETE FROM lookups")
@@ -0,0 +1,540 @@
+from typing import Any, Dict, List, Optional, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from utils.templates import MessageTemplate, cached_template
+from utils.local_store import SqliteStore
+from utils import whatsapp as wpp
+import threading
+import logging
+import socket
+import random
+import json
+import time
+import uuid
+import os
+
+
+logger = logging.getLogger(__name__)
+
+POLL_SECS   = 1.0     # intervalo do laço do worker
+MAX_WORKERS = 8       # envios simultâneos (no máximo um por remetente de cada campanha)
+STALE_SECS  = 120.0   # envio "sending" sem retorno (e sem worker dono) há mais que isso é considerado interrompido
+WORKER_STALE_SECS = 30.0  # worker sem heartbeat há mais que isso é considerado morto
+
+# Com TOLEDO_CAMPAIGN_WORKER=external o app não sobe o worker; rode `python -m utils.campaigns`.
+IN_PROCESS_WORKER = os.getenv("TOLEDO_CAMPAIGN_WORKER", "inprocess") != "external"
+
+STATUS_LABELS = {
+    "running": "▶️ Enviando",
+    "paused": "⏸️ Pausada",
+    "interrupted": "⚠️ Interrompida",
+    "cancelled": "❌ Cancelada",
+    "done": "✅ Concluída",
+}
+
+
+class CampaignStore(SqliteStore):
+    """
+    Fila persistente das campanhas de WhatsApp.
+
+    `campaigns` guarda o estado de cada campanha (status e contadores);
+    `campaign_messages` é a fila compartilhada, uma linha por mensagem na ordem
+    de envio; `campaign_lanes` tem uma "faixa" por remetente (instância
+    UltraMsg), com janela de atraso, limite de mensagens/hora e horário do
+    próximo envio próprios. Cada faixa envia uma mensagem por vez, então N
+    remetentes rendem ~N vezes mais mensagens por hora. O intervalo entre
+    mensagens de uma faixa é agendado: ao fim de cada envio, complete sorteia o
+    atraso entre `delay_min` e `delay_max` da faixa (respeitando `rate_per_hour`)
+    e grava o `campaign_lanes.next_send_at`; ninguém fica parado num sleep.
+
+    Cada worker se registra em `workers` com um heartbeat. Uma campanha em
+    andamento pertence ao worker que a pegou (`campaigns.worker_id`) e só ele
+    reserva mensagens dela; cada mensagem reservada guarda o worker que a
+    reservou. Um worker só recupera mensagens e interrompe campanhas de outro
+    worker cujo heartbeat passou de WORKER_STALE_SECS.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS campaigns (
+        id           TEXT PRIMARY KEY,
+        sheet        TEXT NOT NULL,
+        status       TEXT NOT NULL,
+        total        INTEGER NOT NULL,
+        sent         INTEGER NOT NULL DEFAULT 0,
+        failed       INTEGER NOT NULL DEFAULT 0,
+        created_at   REAL NOT NULL,
+        updated_at   REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS campaign_messages (
+        campaign_id TEXT    NOT NULL,
+        seq         INTEGER NOT NULL,
+        row_id      INTEGER NOT NULL,
+        to_number   TEXT    NOT NULL,
+        body        TEXT    NOT NULL,
+        profile     TEXT,
+        status      TEXT    NOT NULL DEFAULT 'pending',
+        attempts    INTEGER NOT NULL DEFAULT 0,
+        claimed_at  REAL,
+        sent_at     REAL,
+        response    TEXT,
+        error       TEXT,
+        PRIMARY KEY (campaign_id, seq)
+    );
+    CREATE INDEX IF NOT EXISTS campaign_messages_status ON campaign_messages(campaign_id, status);
+    CREATE TABLE IF NOT EXISTS campaign_lanes (
+        campaign_id   TEXT    NOT NULL,
+        profile       TEXT    NOT NULL,
+        weight        REAL    NOT NULL DEFAULT 1,
+        delay_min     REAL    NOT NULL,
+        delay_max     REAL    NOT NULL,
+        rate_per_hour REAL,
+        next_send_at  REAL    NOT NULL DEFAULT 0,
+        sent          INTEGER NOT NULL DEFAULT 0,
+        failed        INTEGER NOT NULL DEFAULT 0,
+        first_sent_at REAL,
+        last_sent_at  REAL,
+        PRIMARY KEY (campaign_id, profile)
+    );
+    CREATE TABLE IF NOT EXISTS workers (
+        id         TEXT PRIMARY KEY,
+        heartbeat  REAL NOT NULL,
+        started_at REAL NOT NULL
+    );
+    """
+    # remetente preferencial da mensagem (o `profile` é quem de fato enviou)
+    MIGRATIONS = (
+        ("campaign_messages", "assigned", "TEXT"),
+        # renderização tardia: modelo na campanha, valores formatados das colunas em cada mensagem
+        ("campaigns", "template", "TEXT"),
+        ("campaigns", "template_fields", "TEXT"),
+        ("campaign_messages", "fields", "TEXT"),
+        # checkpoint: última linha da planilha até onde tudo já foi processado
+        ("campaigns", "checkpoint_row", "INTEGER"),
+        # dono: worker que reservou a mensagem / que está enviando a campanha
+        ("campaign_messages", "worker_id", "TEXT"),
+        ("campaigns", "worker_id", "TEXT"),
+        ("campaigns", "heartbeat", "REAL"),
+    )
+
+    def __init__(self, name: str = "campaigns"):
+        super().__init__(name)
+
+    # --- criação e controle (UI) ---
+    def create(self, sheet: str, messages: Sequence[Dict[str, Any]], lanes: Sequence[Dict[str, Any]],
+               delay_min: float, delay_max: float, template: Optional[MessageTemplate] = None) -> str:
+        """
+        `messages`: dicts com row_id, to e body, na ordem de envio. Com `template`,
+        cada mensagem traz `fields` (um registro de template.field_values) no lugar
+        de `body`, e o texto só é montado na hora do envio.
+        `lanes`: um dict por remetente com `profile` e, opcionalmente, `weight`,
+        `delay_min`, `delay_max` (padrão: os da campanha) e `rate_per_hour`.
+        As linhas são distribuídas entre as faixas proporcionalmente ao peso
+        (pesos iguais = alternado). Retorna o id da campanha.
+        """
+        if not lanes:
+            raise ValueError("Selecione ao menos um remetente.")
+        campaign_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        lanes = [
+            {
+                "profile": lane["profile"],
+                "weight": float(lane.get("weight") or 1),
+                "delay_min": float(lane.get("delay_min", delay_min)),
+                "delay_max": float(lane.get("delay_max", delay_max)),
+                "rate_per_hour": lane.get("rate_per_hour"),
+            }
+            for lane in lanes
+        ]
+        assigned = _weighted_round_robin([lane["weight"] for lane in lanes], len(messages))
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO campaigns(id, sheet, status, total, created_at, updated_at, template, template_fields) "
+                "VALUES (?, ?, 'running', ?, ?, ?, ?, ?)",
+                (campaign_id, sheet, len(messages), now, now,
+                 template.text if template else None,
+                 json.dumps([str(c) for c in template.fields]) if template else None),
+            )
+            conn.executemany(
+                "INSERT INTO campaign_lanes(campaign_id, profile, weight, delay_min, delay_max, rate_per_hour, "
+                "next_send_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(campaign_id, lane["profile"], lane["weight"], lane["delay_min"], lane["delay_max"],
+                  lane["rate_per_hour"], now) for lane in lanes],
+            )
+            conn.executemany(
+                "INSERT INTO campaign_messages(campaign_id, seq, row_id, to_number, body, assigned, fields) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(campaign_id, seq, m["row_id"], m["to"], m.get("body", ""), lanes[assigned[seq]]["profile"],
+                  json.dumps(m["fields"], ensure_ascii=False) if "fields" in m else None)
+                 for seq, m in enumerate(messages)],
+            )
+        return campaign_id
+
+    def pause(self, campaign_id: str):
+        self.execute(
+            "UPDATE campaigns SET status = 'paused', updated_at = ? WHERE id = ? AND status = 'running'",
+            (time.time(), campaign_id),
+        )
+
+    def resume(self, campaign_id: str):
+        """Continua uma campanha pausada ou interrompida a partir do checkpoint, com o mesmo modelo e faixas."""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE campaigns SET status = 'running', worker_id = NULL, updated_at = ? "
+                "WHERE id = ? AND status IN ('paused', 'interrupted')",
+                (now, campaign_id),
+            )
+            conn.execute("UPDATE campaign_lanes SET next_send_at = ? WHERE campaign_id = ?", (now, campaign_id))
+
+    def cancel(self, campaign_id: str):
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE campaigns SET status = 'cancelled', updated_at = ? "
+                "WHERE id = ? AND status IN ('running', 'paused', 'interrupted')",
+                (time.time(), campaign_id),
+            )
+            conn.execute(
+                "UPDATE campaign_messages SET status = 'cancelled' WHERE campaign_id = ? AND status = 'pending'",
+                (campaign_id,),
+            )
+
+    def retry_failed(self, campaign_id: str) -> int:
+        """
+        Volta as mensagens com falha para a fila e reabre a campanha. As que já
+        constam como enviadas no ledger não são reenviadas (ver _send).
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            n = conn.execute(
+                "UPDATE campaign_messages SET status = 'pending', error = NULL "
+                "WHERE campaign_id = ? AND status = 'failed'",
+                (campaign_id,),
+            ).rowcount
+            if n:
+                conn.execute(
+                    "UPDATE campaigns SET status = 'running', worker_id = NULL, failed = failed - ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (n, now, campaign_id),
+                )
+                conn.execute(
+                    "UPDATE campaign_lanes SET failed = 0, next_send_at = ? WHERE campaign_id = ?",
+                    (now, campaign_id),
+                )
+        return n
+
+    def list(self, sheet: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT * FROM campaigns"
+        params: tuple = ()
+        if sheet is not None:
+            sql += " WHERE sheet = ?"
+            params = (sheet,)
+        return [dict(r) for r in self.query(sql + " ORDER BY created_at DESC", params)]
+
+    def lanes(self, campaign_id: str) -> List[Dict[str, Any]]:
+        """Estatísticas por remetente: enviadas, falhas e mensagens/hora."""
+        out = []
+        for r in self.query("SELECT * FROM campaign_lanes WHERE campaign_id = ? ORDER BY profile", (campaign_id,)):
+            lane = dict(r)
+            span = (lane["last_sent_at"] or 0) - (lane["first_sent_at"] or 0)
+            done = lane["sent"] + lane["failed"]
+            lane["per_hour"] = (done - 1) * 3600 / span if done > 1 and span > 0 else None
+            out.append(lane)
+        return out
+
+    def delivery(self, campaign_id: str) -> Dict[str, Any]:
+        """Vazão e latência dos envios da campanha, pelo ledger (ver SendLedger.throughput)."""
+        return wpp.get_ledger().throughput(campaign_id)
+
+    # --- workers ---
+    def heartbeat(self, worker_id: str):
+        """Registra que o worker está vivo (e as campanhas dele também)."""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO workers(id, heartbeat, started_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (worker_id, now, now),
+            )
+            conn.execute(
+                "UPDATE campaigns SET heartbeat = ? WHERE worker_id = ? AND status = 'running'",
+                (now, worker_id),
+            )
+            # registros de workers mortos há muito tempo
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - 86400,))
+
+    # --- agendamento (worker) ---
+    def claim_due(self, limit: int, worker_id: str) -> List[Dict[str, Any]]:
+        """
+        Reserva uma mensagem para cada faixa (até `limit`) cujo próximo envio já
+        venceu, que não tem envio em andamento e cuja campanha ainda tem mensagens
+        pendentes, só em campanhas sem dono ou do próprio `worker_id` (que passa a
+        ser o dono). A faixa pega primeiro as linhas atribuídas a ela e, quando
+        acabam, ajuda as outras com o que restou da fila.
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        claimed = []
+        with self.transaction() as conn:
+            # campanhas sem nada pendente nem em andamento (ex.: retomadas já no fim) terminam aqui
+            conn.execute(
+                "UPDATE campaigns SET status = 'done', updated_at = ? "
+                "WHERE status = 'running' AND (worker_id IS NULL OR worker_id = ?) "
+                "AND NOT EXISTS (SELECT 1 FROM campaign_messages m WHERE m.campaign_id = campaigns.id "
+                "                AND m.status IN ('pending', 'sending'))",
+                (now, worker_id),
+            )
+            due = conn.execute(
+                "SELECT l.*, c.template, c.template_fields FROM campaign_lanes l "
+                "JOIN campaigns c ON c.id = l.campaign_id "
+                "WHERE c.status = 'running' AND l.next_send_at <= ? "
+                "AND (c.worker_id IS NULL OR c.worker_id = ?) "
+                "AND NOT EXISTS (SELECT 1 FROM campaign_messages m WHERE m.campaign_id = l.campaign_id "
+                "                AND m.profile = l.profile AND m.status = 'sending') "
+                "AND EXISTS (SELECT 1 FROM campaign_messages m WHERE m.campaign_id = l.campaign_id "
+                "            AND m.status = 'pending') "
+                "ORDER BY l.next_send_at",
+                (now, worker_id),
+            ).fetchall()
+            for lane in due:
+                if len(claimed) >= limit:
+                    break
+                msg = conn.execute(
+                    "SELECT * FROM campaign_messages WHERE campaign_id = ? AND status = 'pending' "
+                    "ORDER BY assigned = ? DESC, seq LIMIT 1",
+                    (lane["campaign_id"], lane["profile"]),
+                ).fetchone()
+                if msg is None:  # outra faixa da mesma campanha levou a última pendente
+                    continue
+                conn.execute(
+                    "UPDATE campaign_messages SET status = 'sending', profile = ?, attempts = attempts + 1, "
+                    "claimed_at = ?, worker_id = ? WHERE campaign_id = ? AND seq = ?",
+                    (lane["profile"], now, worker_id, lane["campaign_id"], msg["seq"]),
+                )
+                conn.execute(
+                    "UPDATE campaigns SET worker_id = ?, heartbeat = ? WHERE id = ?",
+                    (worker_id, now, lane["campaign_id"]),
+                )
+                claimed.append({
+                    **dict(msg),
+                    "profile": lane["profile"],
+                    "body": _message_body(msg, lane["template"], lane["template_fields"]),
+                })
+        return claimed
+
+    def complete(self, msg: Dict[str, Any], ok: bool, response: Any = None, error: Optional[str] = None):
+        """Registra o resultado de um envio e agenda o próximo envio da faixa."""
+        now = time.time()
+        counter = "sent" if ok else "failed"
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE campaign_messages SET status = ?, sent_at = ?, response = ?, error = ? "
+                "WHERE campaign_id = ? AND seq = ?",
+                (counter, now, json.dumps(response, ensure_ascii=False, default=str),
+                 error, msg["campaign_id"], msg["seq"]),
+            )
+            conn.execute(
+                f"UPDATE campaigns SET {counter} = {counter} + 1, updated_at = ? WHERE id = ?",
+                (now, msg["campaign_id"]),
+            )
+            lane = conn.execute(
+                "SELECT * FROM campaign_lanes WHERE campaign_id = ? AND profile = ?",
+                (msg["campaign_id"], msg["profile"]),
+            ).fetchone()
+            if lane is not None:
+                wait = random.uniform(lane["delay_min"], lane["delay_max"])
+                if lane["rate_per_hour"]:
+                    wait = max(wait, 3600.0 / lane["rate_per_hour"])
+                conn.execute(
+                    f"UPDATE campaign_lanes SET {counter} = {counter} + 1, next_send_at = ?, "
+                    "first_sent_at = COALESCE(first_sent_at, ?), last_sent_at = ? "
+                    "WHERE campaign_id = ? AND profile = ?",
+                    (now + wait, now, now, msg["campaign_id"], msg["profile"]),
+                )
+            pending, first_open = conn.execute(
+                "SELECT COUNT(*), MIN(seq) FROM campaign_messages "
+                "WHERE campaign_id = ? AND status IN ('pending', 'sending')",
+                (msg["campaign_id"],),
+            ).fetchone()
+            # checkpoint: linha da última mensagem antes da primeira ainda em aberto
+            conn.execute(
+                "UPDATE campaigns SET checkpoint_row = (SELECT row_id FROM campaign_messages "
+                "  WHERE campaign_id = ? AND seq < COALESCE(?, 1e18) ORDER BY seq DESC LIMIT 1) "
+                "WHERE id = ?",
+                (msg["campaign_id"], first_open, msg["campaign_id"]),
+            )
+            if not pending:
+                conn.execute(
+                    "UPDATE campaigns SET status = 'done' WHERE id = ? AND status = 'running'",
+                    (msg["campaign_id"],),
+                )
+
+    def mark_interrupted(self, worker_id: Optional[str] = None) -> int:
+        """
+        Campanhas 'running' cujo worker dono parou de dar sinal de vida (processo
+        reiniciado ou morto). As que já tinham começado a enviar ficam
+        'interrupted' até alguém clicar em "Retomar", em vez de voltarem a
+        disparar sozinhas; as que ainda não enviaram nada só perdem o dono e
+        seguem com outro worker. Campanhas de workers vivos não são tocadas.
+        """
+        now = time.time()
+        dead = _dead_owner("worker_id")
+        params = (worker_id, now - WORKER_STALE_SECS)
+        with self.transaction() as conn:
+            n = conn.execute(
+                "UPDATE campaigns SET status = 'interrupted', worker_id = NULL, updated_at = ? "
+                f"WHERE status = 'running' AND worker_id IS NOT NULL AND sent + failed > 0 AND {dead}",
+                (now, *params),
+            ).rowcount
+            conn.execute(
+                f"UPDATE campaigns SET worker_id = NULL WHERE status = 'running' AND worker_id IS NOT NULL AND {dead}",
+                params,
+            )
+        return n
+
+    def recover_stale(self, worker_id: Optional[str] = None):
+        """
+        Mensagens presas em 'sending' cujo worker parou de dar sinal de vida (ou,
+        sem worker registrado, reservadas há mais de STALE_SECS): se o ledger
+        registrou o envio, contam como enviadas; senão viram falha e podem ser
+        reenviadas com "Reenviar falhas". As do próprio `worker_id` nunca entram.
+        """
+        now = time.time()
+        stale = self.query(
+            "SELECT * FROM campaign_messages WHERE status = 'sending' AND ("
+            "  (worker_id IS NULL AND claimed_at < ?) OR "
+            f"  (worker_id IS NOT NULL AND {_dead_owner('worker_id')}))",
+            (now - STALE_SECS, worker_id, now - WORKER_STALE_SECS),
+        )
+        ledger = wpp.get_ledger()
+        for msg in stale:
+            entry = ledger.get(msg["campaign_id"], msg["seq"])
+            if entry is not None and entry["status"] == "sent":
+                self.complete(dict(msg), ok=True, response=json.loads(entry["response"] or "null"))
+            else:
+                self.complete(dict(msg), ok=False, error="Envio interrompido (servidor reiniciado).")
+
+
+def _dead_owner(column: str) -> str:
+    """
+    Condição SQL (parâmetros: worker atual, limite do heartbeat): o worker em
+    `column` não é o atual e não deu sinal de vida desde o limite.
+    """
+    return (
+        f"{column} IS NOT ? AND NOT EXISTS (SELECT 1 FROM workers w "
+        f"WHERE w.id = {column} AND w.heartbeat >= ?)"
+    )
+
+
+def _weighted_round_robin(weights: Sequence[float], n: int) -> List[int]:
+    """Índice da faixa de cada uma das n linhas (round-robin ponderado "suave", como no nginx)."""
+    current = [0.0] * len(weights)
+    total = sum(weights)
+    out = []
+    for _ in range(n):
+        for i, w in enumerate(weights):
+            current[i] += w
+        best = max(range(len(weights)), key=current.__getitem__)
+        current[best] -= total
+        out.append(best)
+    return out
+
+
+def _message_body(msg, template: Optional[str], template_fields: Optional[str]) -> str:
+    if template is None or msg["fields"] is None:
+        return msg["body"]
+    tpl = cached_template(template, tuple(json.loads(template_fields)))
+    return tpl.render_row(json.loads(msg["fields"]))
+
+
+def _send(msg: Dict[str, Any]) -> Dict[str, Any]:
+    # lote = campanha e linha = seq: uma mensagem já enviada nunca sai de novo (ledger)
+    return wpp.send_job(
+        {"row_id": msg["seq"], "to": msg["to_number"], "body": msg["body"], "profile": msg["profile"]},
+        batch_id=msg["campaign_id"],
+    )
+
+
+class CampaignWorker(threading.Thread):
+    """Laço que, fora do script do Streamlit, envia as mensagens vencidas de todas as campanhas."""
+
+    def __init__(self, store: CampaignStore, max_workers: int = MAX_WORKERS, poll: float = POLL_SECS):
+        super().__init__(name="campaign-worker", daemon=True)
+        self.store = store
+        # identifica este worker nas reservas e campanhas (vários podem rodar ao mesmo tempo)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.max_workers = max_workers
+        self.poll = poll
+        self._stop_event = threading.Event()
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _process(self, msg: Dict[str, Any]):
+        try:
+            result = _send(msg)
+            self.store.complete(msg, result["ok"], result["response"], result["error"])
+        except Exception as e:
+            logger.exception("Falha ao enviar mensagem %s/%s", msg["campaign_id"], msg["seq"])
+            self.store.complete(msg, False, error=str(e))
+        finally:
+            with self._inflight_lock:
+                self._inflight -= 1
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="campaign-send") as pool:
+            while not self._stop_event.is_set():
+                try:
+                    # o que ficou 'sending' ou 'running' com um worker morto é recuperado aqui;
+                    # o que é de outro worker vivo (ex.: `python -m utils.campaigns`) não é tocado
+                    self.store.heartbeat(self.worker_id)
+                    self.store.recover_stale(self.worker_id)
+                    self.store.mark_interrupted(self.worker_id)
+                    with self._inflight_lock:
+                        free = self.max_workers - self._inflight
+                    for msg in self.store.claim_due(free, self.worker_id):
+                        with self._inflight_lock:
+                            self._inflight += 1
+                        pool.submit(self._process, msg)
+                except Exception:
+                    logger.exception("Erro no laço do worker de campanhas")
+                self._stop_event.wait(self.poll)
+
+
+_store: Optional[CampaignStore] = None
+_worker: Optional[CampaignWorker] = None
+_lock = threading.Lock()
+
+
+def get_store() -> CampaignStore:
+    global _store
+    with _lock:
+        if _store is None:
+            _store = CampaignStore()
+        return _store
+
+
+def ensure_worker() -> Optional[CampaignWorker]:
+    """Sobe (uma vez por processo) o worker em segundo plano, se ele roda dentro do app."""
+    global _worker
+    if not IN_PROCESS_WORKER:
+        return None
+    store = get_store()
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = CampaignWorker(store)
+            _worker.start()
+        return _worker
+
+
+if __name__ == "__main__":
+    # Worker dedicado: `python -m utils.campaigns` na raiz do projeto (lê .streamlit/secrets.toml).
+    logging.basicConfig(level=logging.INFO)
+    worker = CampaignWorker(get_store())
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(1.0)
+    except KeyboardInterrupt:
+        worker.stop()
@@ -0,0 +1,58 @@
+from typing import Any, Dict, Optional
+from utils.local_store import SqliteStore
+import json
+import time
+
+
+class DetectionCache(SqliteStore):
+    """
+    Resultados da detecção de colunas (algorithms.detect_columns) por impressão
+    digital do DataFrame (algorithms.dataframe_fingerprint) e conjunto de tipos
+    pedidos. Como a chave depende do conteúdo, não há o que invalidar: dados
+    diferentes geram outra chave. Acima de `max_entries`, as menos usadas
+    recentemente são removidas.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS detections (
+        fingerprint TEXT NOT NULL,
+        kinds       TEXT NOT NULL,
+        result      TEXT NOT NULL,
+        last_access REAL NOT NULL,
+        PRIMARY KEY (fingerprint, kinds)
+    );
+    CREATE INDEX IF NOT EXISTS detections_last_access ON detections(last_access);
+    """
+
+    def __init__(self, max_entries: int = 1000, name: str = "detections"):
+        super().__init__(name)
+        self.max_entries = max_entries
+
+    def get(self, fingerprint: str, kinds: str) -> Optional[Dict[str, Any]]:
+        rows = self.query(
+            "SELECT result FROM detections WHERE fingerprint = ? AND kinds = ?",
+            (fingerprint, kinds),
+        )
+        if not rows:
+            return None
+        self.execute(
+            "UPDATE detections SET last_access = ? WHERE fingerprint = ? AND kinds = ?",
+            (time.time(), fingerprint, kinds),
+        )
+        return json.loads(rows[0]["result"])
+
+    def put(self, fingerprint: str, kinds: str, result: Dict[str, Any]):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO detections(fingerprint, kinds, result, last_access) VALUES (?, ?, ?, ?)",
+                (fingerprint, kinds, json.dumps(result, ensure_ascii=False), time.time()),
+            )
+            conn.execute(
+                "DELETE FROM detections WHERE rowid IN ("
+                "  SELECT rowid FROM detections ORDER BY last_access DESC LIMIT -1 OFFSET ?"
+                ")",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        self.execute("DELETE FROM detections")
@@ -0,0 +1,200 @@
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from tempfile import NamedTemporaryFile
+from io import BytesIO
+import threading
+import os
+
+
+# Extração local de PDF/DOCX antes de mandar ao Gemini: texto por página e se a
+# página é só imagem (digitalizada, precisa de OCR). As funções de página ficam
+# no nível do módulo para poderem rodar num ProcessPoolExecutor. As tarefas
+# recebem o caminho de um arquivo temporário (e não os bytes) e o intervalo de
+# páginas, então um PDF grande não é copiado para cada tarefa.
+
+PAGES_PER_TASK = 25      # páginas de PDF por tarefa do pool
+MIN_TEXT_CHARS = 40      # abaixo disso a camada de texto não conta (carimbo, número de página)
+TOKENS_PER_PAGE = 258    # custo do Gemini por página de PDF/imagem
+CHARS_PER_TOKEN = 4      # estimativa grosseira para texto em português
+
+
+# ----------------- Páginas -----------------
+
+def _has_images(resources: Any, depth: int = 0) -> bool:
+    """Se os recursos da página desenham alguma imagem (inclusive dentro de Form XObjects)."""
+    try:
+        xobjects = (resources or {}).get("/XObject")
+        xobjects = xobjects.get_object() if xobjects is not None else {}
+        for ref in xobjects.values():
+            obj = ref.get_object()
+            subtype = obj.get("/Subtype")
+            if subtype == "/Image":
+                return True
+            if subtype == "/Form" and depth < 2 and _has_images(obj.get("/Resources"), depth + 1):
+                return True
+    except Exception:
+        pass
+    return False
+
+
+def _kind(text: str, has_images: bool) -> str:
+    if len(text) >= MIN_TEXT_CHARS:
+        return "texto"
+    return "imagem" if has_images else "vazia"
+
+
+def extract_pdf_pages(path: str, start: int, stop: int) -> List[Dict[str, Any]]:
+    """
+    Páginas [start, stop) do PDF em `path`: {'page' (1-based), 'text', 'kind'}, com
+    kind 'texto' (tem camada de texto), 'imagem' (só imagem: precisa de OCR) ou 'vazia'.
+    """
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    pages = []
+    for n in range(start, min(stop, len(reader.pages))):
+        page = reader.pages[n]
+        try:
+            text = " ".join((page.extract_text() or "").split())
+        except Exception:
+            text = ""
+        pages.append({"page": n + 1, "text": text, "kind": _kind(text, _has_images(page.get("/Resources")))})
+    return pages
+
+
+def extract_docx(path: str) -> List[Dict[str, Any]]:
+    """DOCX (em `path`) não tem páginas: devolve uma só 'página' com parágrafos e tabelas."""
+    import docx
+
+    document = docx.Document(path)
+    lines = [p.text.strip() for p in document.paragraphs if p.text.strip()]
+    for table in document.tables:
+        for row in table.rows:
+            cells = [c.text.strip() for c in row.cells if c.text.strip()]
+            if cells:
+                lines.append(" | ".join(cells))
+    text = "\n".join(lines)
+    return [{"page": 1, "text": text, "kind": _kind(text, len(document.inline_shapes) > 0)}]
+
+
+def pdf_page_count(data: bytes) -> int:
+    from PyPDF2 import PdfReader
+
+    return len(PdfReader(BytesIO(data)).pages)
+
+
+def pdf_subset(data: bytes, pages: List[int]) -> bytes:
+    """Novo PDF só com as páginas pedidas (1-based), na ordem."""
+    from PyPDF2 import PdfReader, PdfWriter
+
+    reader = PdfReader(BytesIO(data))
+    writer = PdfWriter()
+    for n in pages:
+        writer.add_page(reader.pages[n - 1])
+    out = BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+# ----------------- Documentos -----------------
+
+def _doc_kind(name: str) -> Optional[str]:
+    ext = os.path.splitext(name)[1].lower()
+    return {".pdf": "pdf", ".docx": "docx"}.get(ext)
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(max_workers: Optional[int]) -> ProcessPoolExecutor:
+    """
+    Pool de processos do módulo, criado uma vez. Usa "spawn": um fork do servidor
+    do Streamlit copiaria um processo cheio de threads (worker de campanhas,
+    conexões SQLite) e o filho pode travar num lock herdado.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn"))
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    # um processo filho morreu (BrokenProcessPool): o próximo pedido cria outro pool
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _spill(data: bytes) -> str:
+    with NamedTemporaryFile(prefix="toledo-doc-", delete=False) as tmp:
+        tmp.write(data)
+    return tmp.name
+
+
+def extract_documents(docs: List[Dict[str, Any]], max_workers: Optional[int] = None) -> List[Optional[List[Dict[str, Any]]]]:
+    """
+    Páginas de cada documento {'name', 'data'} (ver extract_pdf_pages), na ordem
+    de `docs`. PDFs grandes são divididos em blocos de PAGES_PER_TASK páginas
+    para que um único arquivo também use vários processos. None para o que não
+    é PDF/DOCX ou não pôde ser lido. `max_workers` vale na criação do pool.
+    """
+    results: List[Optional[List[Dict[str, Any]]]] = [None] * len(docs)
+    tasks = []  # (índice do documento, future)
+    paths = []
+    pool = _get_pool(max_workers)
+    try:
+        for i, doc in enumerate(docs):
+            kind = _doc_kind(doc["name"])
+            try:
+                if kind == "pdf":
+                    total = pdf_page_count(doc["data"])
+                    path = _spill(doc["data"])
+                    paths.append(path)
+                    for start in range(0, total, PAGES_PER_TASK):
+                        tasks.append((i, pool.submit(extract_pdf_pages, path, start, start + PAGES_PER_TASK)))
+                    results[i] = []
+                elif kind == "docx":
+                    path = _spill(doc["data"])
+                    paths.append(path)
+                    tasks.append((i, pool.submit(extract_docx, path)))
+                    results[i] = []
+            except BrokenProcessPool:
+                _discard_pool(pool)
+                raise
+            except Exception:
+                results[i] = None
+        failed = set()
+        broken = False
+        for i, fut in tasks:  # na ordem de envio: as páginas saem em ordem
+            try:
+                pages = fut.result()
+            except BrokenProcessPool:
+                broken = True
+                failed.add(i)
+                continue
+            except Exception:
+                failed.add(i)
+                continue
+            if results[i] is not None:
+                results[i].extend(pages)
+        if broken:
+            _discard_pool(pool)
+    finally:
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    for i in failed:
+        results[i] = None
+    return results
+
+
+def estimate_tokens(text: str, image_pages: int) -> int:
+    return len(text) // CHARS_PER_TOKEN + image_pages * TOKENS_PER_PAGE
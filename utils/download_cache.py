@@ -0,0 +1,173 @@
+from typing import Any, Dict, IO, Iterable, Optional, Tuple
+from utils.local_store import DATA_DIR, SqliteStore
+from tempfile import NamedTemporaryFile
+from pathlib import Path
+import time
+import os
+
+
+SWEEP_SECS = 600          # intervalo mínimo entre varreduras completas do diretório
+TMP_STALE_SECS = 3600     # temporários mais velhos que isso são de downloads que morreram no meio
+
+
+class DownloadCache(SqliteStore):
+    """
+    Cache em disco dos arquivos baixados do bucket, endereçado por conteúdo.
+
+    Cada objeto (nome) aponta para a versão que foi baixada (ETag ou updated_at
+    do storage) e para o sha256 do conteúdo; o arquivo fica em `<DATA_DIR>/<name>/
+    <sha256>`, então nomes com o mesmo conteúdo dividem o mesmo arquivo. Uma versão
+    diferente no storage é um miss e substitui a anterior. Acima de `max_bytes`, os
+    objetos usados há mais tempo são descartados.
+
+    Mover o arquivo para o lugar, registrar a entrada e apagar os arquivos que
+    deixaram de ser usados acontecem dentro de transações do banco (BEGIN
+    IMMEDIATE), que servem de trava também entre processos. get e put devolvem o
+    arquivo já aberto, dentro da mesma trava: se a entrada for descartada logo
+    depois, quem está lendo não perde o arquivo (no Windows, a remoção falha e
+    fica para a próxima varredura).
+
+    put e invalidate apagam só os arquivos das entradas que eles mesmos
+    descartaram. A varredura completa do diretório (órfãos de um processo que
+    morreu e temporários com mais de TMP_STALE_SECS) roda ao abrir o cache e
+    depois no máximo a cada SWEEP_SECS.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS objects (
+        name        TEXT    PRIMARY KEY,
+        version     TEXT    NOT NULL,
+        sha256      TEXT    NOT NULL,
+        size        INTEGER NOT NULL,
+        encoding    TEXT    NOT NULL,
+        last_access REAL    NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS objects_last_access ON objects(last_access);
+    CREATE TABLE IF NOT EXISTS counters (
+        name  TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    """
+
+    def __init__(self, max_bytes: int, name: str = "downloads"):
+        super().__init__(name)
+        self.max_bytes = max_bytes
+        self.blob_dir = DATA_DIR / name
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self._swept_at = 0.0
+        self._maybe_sweep()
+
+    @staticmethod
+    def _count(conn, counter: str):
+        conn.execute(
+            "INSERT INTO counters(name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (counter,),
+        )
+
+    def _blob(self, sha256: str) -> Path:
+        return self.blob_dir / sha256
+
+    def get(self, name: str, version: str) -> Optional[Tuple[IO[bytes], str, str]]:
+        """(arquivo aberto, encoding, sha256) se `name` estiver em cache nesta versão; feche o arquivo."""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT version, sha256, encoding FROM objects WHERE name = ?", (name,)).fetchone()
+            fh = None
+            if row is not None and row["version"] == version:
+                try:
+                    fh = open(self._blob(row["sha256"]), "rb")
+                except FileNotFoundError:
+                    pass
+            if fh is None:
+                self._count(conn, "misses")
+                return None
+            conn.execute("UPDATE objects SET last_access = ? WHERE name = ?", (time.time(), name))
+            self._count(conn, "hits")
+        return fh, row["encoding"], row["sha256"]
+
+    def new_blob(self) -> IO[bytes]:
+        """Arquivo temporário no diretório do cache, para baixar direto nele (ver put)."""
+        return NamedTemporaryFile(dir=self.blob_dir, prefix=".tmp-", delete=False)
+
+    def put(self, name: str, version: str, tmp_path: Path, sha256: str, encoding: str) -> IO[bytes]:
+        """
+        Move o arquivo baixado para o seu endereço (sha256), registra `name` nesta
+        versão e devolve o arquivo aberto (feche-o).
+        """
+        path = self._blob(sha256)
+        with self.transaction() as conn:
+            previous = conn.execute("SELECT sha256 FROM objects WHERE name = ?", (name,)).fetchone()
+            os.replace(tmp_path, path)
+            conn.execute(
+                "INSERT OR REPLACE INTO objects(name, version, sha256, size, encoding, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, version, sha256, path.stat().st_size, encoding, time.time()),
+            )
+            # mantém sempre o que acabou de entrar, mesmo que sozinho passe do limite
+            stale = conn.execute(
+                "SELECT name, sha256 FROM ("
+                "  SELECT name, sha256, SUM(size) OVER (ORDER BY last_access DESC, name) AS running"
+                "  FROM objects WHERE name != ?"
+                ") WHERE running > ?",
+                (name, max(self.max_bytes - path.stat().st_size, 0)),
+            ).fetchall()
+            conn.executemany("DELETE FROM objects WHERE name = ?", [(r["name"],) for r in stale])
+            self._unlink_unused(conn, [r["sha256"] for r in stale] + ([previous["sha256"]] if previous else []))
+            fh = open(path, "rb")
+        self._maybe_sweep()
+        return fh
+
+    def invalidate(self, *names: str):
+        placeholders = ", ".join("?" * len(names))
+        with self.transaction() as conn:
+            shas = [r["sha256"] for r in conn.execute(f"SELECT sha256 FROM objects WHERE name IN ({placeholders})", names)]
+            conn.execute(f"DELETE FROM objects WHERE name IN ({placeholders})", names)
+            self._unlink_unused(conn, shas)
+        self._maybe_sweep()
+
+    def _unlink_unused(self, conn, shas: Iterable[str]):
+        # dentro da transação de quem descartou as entradas: só apaga o que nenhuma outra usa
+        for sha in set(shas):
+            if conn.execute("SELECT 1 FROM objects WHERE sha256 = ? LIMIT 1", (sha,)).fetchone() is None:
+                try:
+                    self._blob(sha).unlink()
+                except OSError:
+                    pass
+
+    def _maybe_sweep(self):
+        if time.time() - self._swept_at >= SWEEP_SECS:
+            self.sweep()
+
+    def sweep(self):
+        """Apaga arquivos sem entrada no banco e temporários abandonados (mais de TMP_STALE_SECS)."""
+        self._swept_at = time.time()
+        # com o banco travado: nenhum put pode mover um arquivo para cá no meio da varredura
+        with self.transaction() as conn:
+            used = {r["sha256"] for r in conn.execute("SELECT DISTINCT sha256 FROM objects")}
+            for path in self.blob_dir.iterdir():
+                try:
+                    if path.name.startswith(".tmp-"):
+                        # pode ser um download em andamento: só os velhos
+                        if time.time() - path.stat().st_mtime < TMP_STALE_SECS:
+                            continue
+                    elif path.name in used:
+                        continue
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        counters = {r["name"]: r["value"] for r in self.query("SELECT name, value FROM counters")}
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        row = self.query("SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS size FROM objects")[0]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": row["n"],
+            "bytes": row["size"],
+        }
+
+    def clear(self):
+        self.execute("DELETE FROM objects")
+        self.sweep()
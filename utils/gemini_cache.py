@@ -0,0 +1,79 @@
+from typing import Any, Dict, Iterable, Optional
+from utils.local_store import SqliteStore
+import json
+import time
+
+
+class GeminiCache(SqliteStore):
+    """
+    Cache local da análise de documentos no Gemini, por SHA-256 dos bytes do arquivo.
+
+    `handles`: arquivo já enviado à Files API (name, uri, mime_type) e quando ele
+    expira lá; reaproveitado enquanto faltar mais que `margin` para expirar.
+    `analyses`: a entrada de `files[]` (detected_type, key_fields, confidence...)
+    de cada arquivo, por modelo e versão do prompt (`prompt_key`), para que só
+    arquivos novos ou alterados voltem a ser classificados.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS handles (
+        sha256     TEXT PRIMARY KEY,
+        name       TEXT NOT NULL,
+        uri        TEXT NOT NULL,
+        mime_type  TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS analyses (
+        sha256     TEXT NOT NULL,
+        prompt_key TEXT NOT NULL,
+        entry      TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (sha256, prompt_key)
+    );
+    """
+
+    def __init__(self, margin: float = 3600, name: str = "gemini"):
+        super().__init__(name)
+        self.margin = margin
+
+    def get_handle(self, sha256: str) -> Optional[Dict[str, Any]]:
+        rows = self.query(
+            "SELECT name, uri, mime_type, expires_at FROM handles WHERE sha256 = ? AND expires_at > ?",
+            (sha256, time.time() + self.margin),
+        )
+        return dict(rows[0]) if rows else None
+
+    def put_handle(self, sha256: str, name: str, uri: str, mime_type: str, expires_at: float):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO handles(sha256, name, uri, mime_type, expires_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (sha256, name, uri, mime_type, expires_at, now),
+            )
+            conn.execute("DELETE FROM handles WHERE expires_at <= ?", (now,))
+
+    def drop_handle(self, sha256: str):
+        self.execute("DELETE FROM handles WHERE sha256 = ?", (sha256,))
+
+    def get_analyses(self, shas: Iterable[str], prompt_key: str) -> Dict[str, Dict[str, Any]]:
+        shas = list(dict.fromkeys(shas))
+        if not shas:
+            return {}
+        rows = self.query(
+            f"SELECT sha256, entry FROM analyses WHERE prompt_key = ? AND sha256 IN ({', '.join('?' * len(shas))})",
+            (prompt_key, *shas),
+        )
+        return {r["sha256"]: json.loads(r["entry"]) for r in rows}
+
+    def put_analysis(self, sha256: str, prompt_key: str, entry: Dict[str, Any]):
+        self.execute(
+            "INSERT OR REPLACE INTO analyses(sha256, prompt_key, entry, created_at) VALUES (?, ?, ?, ?)",
+            (sha256, prompt_key, json.dumps(entry, ensure_ascii=False), time.time()),
+        )
+
+    def clear(self):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM handles")
+            conn.execute("DELETE FROM analyses")
@@ -0,0 +1,136 @@
+from typing import Any, Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
+import threading
+import requests
+import time
+
+
+# Configuração padrão de cada host; HOSTS sobrescreve por host.
+DEFAULTS: Dict[str, Any] = {
+    "pool_maxsize": 10,                        # conexões keep-alive mantidas por host
+    "timeout": (5, 30),                        # (conexão, leitura) em segundos
+    "retries": 3,                              # tentativas extras em falha de conexão/429/5xx
+    "backoff": 0.5,                            # 0.5s, 1s, 2s... (respeita Retry-After)
+    "retry_methods": ("GET", "HEAD", "OPTIONS"),
+}
+
+HOSTS: Dict[str, Dict[str, Any]] = {
+    # o POST é só o /oauth2 (idempotente), então pode repetir
+    "api.assertivasolucoes.com.br": {"pool_maxsize": 16, "timeout": (5, 15), "retry_methods": ("GET", "POST")},
+    # envio de mensagem não é repetido automaticamente (evita mensagem duplicada);
+    # falhas de conexão, que acontecem antes do envio, continuam sendo repetidas
+    "api.ultramsg.com": {"pool_maxsize": 8, "timeout": (5, 20), "retry_methods": ()},
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class _HostClient:
+    def __init__(self, host: str, settings: Dict[str, Any]):
+        self.host = host
+        self.settings = settings
+        self.session = requests.Session()
+        retry = Retry(
+            total=settings["retries"],
+            backoff_factor=settings["backoff"],
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(settings["retry_methods"]),
+            raise_on_status=False,  # devolve a última resposta; quem chama decide (raise_for_status)
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings["pool_maxsize"],
+            max_retries=retry,
+        )
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.settings["timeout"])
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            with self.lock:
+                self.errors += 1
+            raise
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.requests += 1
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+            if resp.status_code >= 400:
+                self.errors += 1
+        return resp
+
+    def stats(self) -> Dict[str, Any]:
+        # contadores do próprio urllib3: conexões abertas x requisições feitas
+        opened = sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "connections_opened": opened,
+                "connections_reused": max(0, sent - opened),
+                "avg_latency_ms": round(1000 * self.latency_total / self.requests, 1) if self.requests else 0.0,
+                "max_latency_ms": round(1000 * self.latency_max, 1),
+            }
+
+
+_clients: Dict[str, _HostClient] = {}
+_clients_lock = threading.Lock()
+
+
+def configure_host(host: str, **settings):
+    """Ajusta a configuração de um host (ex.: pool_maxsize) antes do primeiro uso."""
+    with _clients_lock:
+        HOSTS[host] = {**HOSTS.get(host, {}), **settings}
+        _clients.pop(host, None)
+
+
+def _client(url: str) -> _HostClient:
+    host = urlsplit(url).hostname or ""
+    client = _clients.get(host)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(host)
+            if client is None:
+                client = _HostClient(host, {**DEFAULTS, **HOSTS.get(host, {})})
+                _clients[host] = client
+    return client
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    requests.request com sessão keep-alive por host, retentativas com backoff
+    exponencial em 429/5xx e timeout padrão do host (se `timeout` não vier).
+    """
+    return _client(url).request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def stats(host: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Métricas por host: requisições, erros, conexões abertas/reaproveitadas e latência."""
+    with _clients_lock:
+        clients = dict(_clients)
+    return {h: c.stats() for h, c in clients.items() if host is None or h == host}
@@ -0,0 +1,75 @@
+from typing import Any, List, Optional
+import json
+
+
+class JsonArrayStream:
+    """
+    Parser incremental de JSON para respostas em streaming: recebe o texto em
+    pedaços (feed) e devolve cada item do array `key` do objeto raiz assim que
+    ele fecha, sem esperar o resto da resposta. Ex.: para {"files": [{...}, {...}]}
+    com key="files", cada {...} sai no feed em que o seu '}' chegar.
+
+    Só acompanha a estrutura (aspas, escapes, {}/[]); quem precisa do objeto
+    inteiro continua fazendo json.loads da resposta completa no final.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.buf = ""
+        self.pos = 0
+        self.stack: List[str] = []     # '{' / '['
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.last_string: Optional[str] = None
+        self.current_key: Optional[str] = None
+        self.target_depth: Optional[int] = None  # profundidade do array `key`, quando aberto
+        self.item_start: Optional[int] = None
+
+    def feed(self, text: str) -> List[Any]:
+        items = []
+        self.buf += text
+        buf = self.buf
+        for i in range(self.pos, len(buf)):
+            ch = buf[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if len(self.stack) == 1 and self.stack[0] == "{":
+                        try:
+                            self.last_string = json.loads(buf[self.string_start:i + 1])
+                        except ValueError:
+                            self.last_string = None
+                continue
+            if ch == '"':
+                self.in_string = True
+                self.string_start = i
+            elif ch == ":" and len(self.stack) == 1:
+                self.current_key = self.last_string
+            elif ch == "," and len(self.stack) == 1:
+                self.current_key = None
+            elif ch in "{[":
+                if self.target_depth is not None and len(self.stack) == self.target_depth:
+                    self.item_start = i
+                self.stack.append(ch)
+                if ch == "[" and len(self.stack) == 2 and self.current_key == self.key:
+                    self.target_depth = 2
+            elif ch in "}]":
+                if not self.stack:
+                    continue
+                self.stack.pop()
+                if self.target_depth is not None:
+                    if len(self.stack) == self.target_depth and self.item_start is not None:
+                        try:
+                            items.append(json.loads(buf[self.item_start:i + 1]))
+                        except ValueError:
+                            pass
+                        self.item_start = None
+                    elif len(self.stack) < self.target_depth:
+                        self.target_depth = None
+        self.pos = len(buf)
+        return items
@@ -0,0 +1,81 @@
+from pathlib import Path
+import threading
+import sqlite3
+import os
+
+
+# Diretório dos bancos SQLite locais (caches, filas, ledgers). Fora do git.
+DATA_DIR = Path(os.getenv("TOLEDO_DATA_DIR", ".toledo"))
+
+
+def db_path(name: str) -> Path:
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    return DATA_DIR / f"{name}.sqlite3"
+
+
+def connect(name: str) -> sqlite3.Connection:
+    """
+    Abre (ou cria) o banco `name` em DATA_DIR em modo autocommit e WAL, para
+    que várias threads/processos do Streamlit possam ler e escrever ao mesmo
+    tempo. A conexão pode ser usada por mais de uma thread: quem a compartilha
+    deve serializar o acesso (ver SqliteStore).
+    """
+    conn = sqlite3.connect(
+        db_path(name),
+        timeout=30,
+        isolation_level=None,
+        check_same_thread=False,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SqliteStore:
+    """Base para os stores locais: uma conexão por instância, protegida por lock."""
+
+    SCHEMA = ""
+    # colunas acrescentadas depois da criação da tabela: (tabela, coluna, definição)
+    MIGRATIONS: tuple = ()
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.RLock()
+        self._conn = connect(name)
+        with self._lock:
+            if self.SCHEMA:
+                self._conn.executescript(self.SCHEMA)
+            for table, column, ddl in self.MIGRATIONS:
+                existing = {r["name"] for r in self._conn.execute(f"PRAGMA table_info({table})")}
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def transaction(self):
+        """Bloco `with store.transaction():` com BEGIN IMMEDIATE / COMMIT / ROLLBACK."""
+        return _Transaction(self)
+
+
+class _Transaction:
+    def __init__(self, store: SqliteStore):
+        self.store = store
+
+    def __enter__(self):
+        self.store._lock.acquire()
+        self.store._conn.execute("BEGIN IMMEDIATE")
+        return self.store._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.store._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.store._lock.release()
+        return False
@@ -0,0 +1,33 @@
+from typing import Optional
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Limitador de taxa (token bucket) seguro entre threads.
+    `rate` tokens por segundo, acumulando no máximo `capacity` (rajada).
+    Com rate <= 0 não limita nada.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """Bloqueia até haver `tokens` disponíveis e os consome."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
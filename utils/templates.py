@@ -0,0 +1,124 @@
+from typing import Any, List, Mapping, Optional, Sequence, Tuple
+from functools import lru_cache
+import pandas as pd
+import numpy as np
+import string
+
+
+class TemplateError(ValueError):
+    pass
+
+
+# (texto literal, coluna | None, conversão | None, format_spec)
+_Part = Tuple[str, Optional[Any], Optional[str], str]
+
+_CONVERSIONS = {"s": str, "r": repr, "a": ascii}
+
+
+class MessageTemplate:
+    """
+    Modelo de mensagem no formato "Olá {Nome}, ..." interpretado uma única vez.
+
+    O texto é quebrado em partes literais e referências a colunas, e as colunas
+    são conferidas já na criação (TemplateError lista as que não existem). Com
+    `sample`, os formatos ({Valor:.2f}, {Nome!r}...) também: a primeira linha é
+    renderizada e um formato que não serve para o valor vira TemplateError. Depois
+    é possível renderizar um recorte inteiro do DataFrame de uma vez, coluna a
+    coluna (render), ou uma linha por vez a partir dos valores já formatados
+    (field_values + render_row), como faz o worker de campanhas.
+    O resultado é o mesmo de `template.format(**row)` para cada registro de
+    `df.to_dict(orient="records")` (nulos de dtypes de extensão viram None).
+    """
+
+    def __init__(self, text: str, columns: Sequence[Any], sample: Optional[pd.DataFrame] = None):
+        self.text = text
+        by_name = {str(c): c for c in columns}
+        parts: List[_Part] = []
+        unknown: List[str] = []
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as e:
+            raise TemplateError(f"Modelo de mensagem inválido: {e}. Use {{{{ e }}}} para chaves literais.") from e
+        for literal, field, spec, conversion in parsed:
+            if field is None:
+                parts.append((literal, None, None, ""))
+                continue
+            if field == "" or field.isdigit():
+                raise TemplateError("Use o nome da coluna entre chaves, por exemplo {Nome}.")
+            if field not in by_name:
+                unknown.append(field)
+            if spec and ("{" in spec):
+                raise TemplateError(f"Formato aninhado não suportado em {{{field}:{spec}}}.")
+            parts.append((literal, by_name.get(field), conversion, spec or ""))
+        if unknown:
+            raise TemplateError(
+                "Coluna(s) inexistente(s) no modelo: "
+                + ", ".join(f"{{{u}}}" for u in dict.fromkeys(unknown))
+            )
+        self.parts = parts
+        self.fields: List[Any] = list(dict.fromkeys(c for _, c, _, _ in parts if c is not None))
+        self._formats = {(c, conv, spec) for _, c, conv, spec in parts if c is not None}
+        if sample is not None:
+            self.field_values(sample.head(1))
+
+    @staticmethod
+    def _format_series(values: pd.Series, conversion: Optional[str], spec: str) -> pd.Series:
+        if conversion is None and not spec:
+            if (
+                isinstance(values.dtype, np.dtype) and values.dtype.kind in "iufb"
+                and not values.hasnans
+            ):
+                # numéricos NumPy sem nulos: conversão em lote, mesma saída de str(valor);
+                # dtypes de extensão (Int64, boolean...) e nulos vão valor a valor
+                return pd.Series(values.to_numpy().astype(str), index=values.index, dtype=object)
+        conv = _CONVERSIONS.get(conversion, lambda v: v)
+        # como objeto: o map de um Int64 com nulos passaria por float ("1.0")
+        items = values.astype(object)
+        return items.map(lambda v: format(conv(None if v is pd.NA else v), spec))
+
+    def field_values(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Valores já formatados (texto) de cada referência do modelo, linha a linha.
+        TemplateError se um formato não servir para algum valor.
+        """
+        out = {}
+        for col, conv, spec in self._formats:
+            key = self._key(col, conv, spec)
+            try:
+                out[key] = self._format_series(df[col], conv, spec)
+            except (TypeError, ValueError) as e:
+                raise TemplateError(f"Formato inválido em {{{key}}} para os valores da coluna: {e}.") from e
+        return pd.DataFrame(out, index=df.index)
+
+    def render(self, df: pd.DataFrame) -> pd.Series:
+        """Renderiza todas as linhas de `df` (passe só o recorte que será enviado)."""
+        values = self.field_values(df)
+        acc = np.full(len(df), "", dtype=object)
+        for literal, col, conv, spec in self.parts:
+            if literal:
+                acc = acc + literal
+            if col is not None:
+                acc = acc + values[self._key(col, conv, spec)].to_numpy(dtype=object)
+        return pd.Series(acc, index=df.index, dtype=object, name="mensagem")
+
+    def render_row(self, values: Mapping[str, str]) -> str:
+        """Renderiza uma linha a partir de um registro de field_values(...)."""
+        return "".join(
+            literal + (values[self._key(col, conv, spec)] if col is not None else "")
+            for literal, col, conv, spec in self.parts
+        )
+
+    @staticmethod
+    def _key(col: Any, conversion: Optional[str], spec: str) -> str:
+        key = str(col)
+        if conversion:
+            key += f"!{conversion}"
+        if spec:
+            key += f":{spec}"
+        return key
+
+
+@lru_cache(maxsize=64)
+def cached_template(text: str, columns: Tuple[str, ...]) -> MessageTemplate:
+    """MessageTemplate interpretado uma vez por (texto, colunas); usado pelo worker de campanhas."""
+    return MessageTemplate(text, columns)
@@ -0,0 +1,137 @@
+from typing import Callable, Optional, Tuple
+from utils.local_store import SqliteStore
+import threading
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStore(SqliteStore):
+    """Tokens compartilhados entre os processos do servidor (SQLite em DATA_DIR)."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tokens (
+        name  TEXT PRIMARY KEY,
+        token TEXT NOT NULL,
+        exp   REAL NOT NULL
+    );
+    """
+
+    def __init__(self, name: str = "tokens"):
+        super().__init__(name)
+
+
+class TokenProvider:
+    """
+    Token OAuth com renovação "single-flight" e antecipada.
+
+    - Só uma thread busca um token novo por vez; as demais esperam e usam o
+      resultado dela.
+    - Um timer renova o token `refresh_margin` segundos antes de vencer, de modo
+      que nenhuma requisição espera pelo OAuth. A renovação só acontece se o
+      token foi usado desde a última busca (processo ocioso deixa vencer).
+    - Com `store`, o token é compartilhado entre processos. A busca acontece
+      fora de transação (não segura o lock de escrita do SQLite durante o HTTP);
+      antes de gravar, o banco é relido: se outro processo gravou um token
+      válido nesse meio-tempo, ele é usado e o buscado aqui é descartado.
+
+    `fetch()` deve retornar (token, instante_de_expiração_epoch).
+    """
+
+    RETRY_DELAY = 30.0       # espera após falha na renovação em segundo plano
+    MAX_RETRY_DELAY = 900.0
+
+    def __init__(self, fetch: Callable[[], Tuple[str, float]], *, name: str,
+                 refresh_margin: float = 300.0, store: Optional[TokenStore] = None):
+        self._fetch = fetch
+        self.name = name
+        self.refresh_margin = refresh_margin
+        self._store = store
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._exp = 0.0
+        self._used = False
+        self._timer: Optional[threading.Timer] = None
+        self._retry_delay = self.RETRY_DELAY
+
+    def get(self) -> str:
+        token, exp = self._token, self._exp
+        if token and exp > time.time():
+            self._used = True
+            return token
+        with self._lock:
+            if not (self._token and self._exp > time.time()):
+                self._load(min_valid=0.0)
+            self._used = True
+            return self._token
+
+    def invalidate(self, token: Optional[str] = None):
+        """
+        Descarta o token atual (ex.: após um 401), também no store compartilhado.
+        Com `token`, só descarta se ele ainda for o atual: outra thread pode já
+        ter buscado um novo depois da requisição recusada.
+        """
+        with self._lock:
+            rejected = token or self._token
+            if token is None or token == self._token:
+                self._token, self._exp = None, 0.0
+            if self._store is not None and rejected:
+                self._store.execute("DELETE FROM tokens WHERE name = ? AND token = ?", (self.name, rejected))
+
+    # --- internos (chamados com self._lock) ---
+    def _load(self, min_valid: float):
+        """Usa o token compartilhado se ele vale por mais `min_valid` s; senão busca outro."""
+        if self._store is None:
+            self._set(*self._fetch())
+            return
+        shared = self._shared(min_valid)
+        if shared:
+            self._set(*shared)
+            return
+        token, exp = self._fetch()  # fora da transação
+        with self._store.transaction() as conn:
+            # outro processo pode ter gravado um token enquanto buscávamos o nosso
+            shared = self._shared(min_valid, conn)
+            if shared:
+                token, exp = shared
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO tokens(name, token, exp) VALUES (?, ?, ?)",
+                    (self.name, token, exp),
+                )
+        self._set(token, exp)
+
+    def _shared(self, min_valid: float, conn=None) -> Optional[Tuple[str, float]]:
+        """Token do store se vale por mais `min_valid` s e é diferente do atual."""
+        sql, params = "SELECT token, exp FROM tokens WHERE name = ?", (self.name,)
+        rows = conn.execute(sql, params).fetchall() if conn is not None else self._store.query(sql, params)
+        row = rows[0] if rows else None
+        if row and row["exp"] - min_valid > time.time() and row["token"] != self._token:
+            return row["token"], row["exp"]
+        return None
+
+    def _set(self, token: str, exp: float):
+        self._token, self._exp = token, exp
+        self._used = False
+        self._retry_delay = self.RETRY_DELAY
+        self._schedule(max(0.0, exp - self.refresh_margin - time.time()))
+
+    def _schedule(self, delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh(self):
+        with self._lock:
+            if not self._used:
+                return
+            try:
+                self._load(min_valid=self.refresh_margin)
+            except Exception as e:
+                logger.warning("Falha ao renovar token %s: %s", self.name, e)
+                self._schedule(self._retry_delay)
+                self._retry_delay = min(self._retry_delay * 2, self.MAX_RETRY_DELAY)
@@ -1,18 +1,174 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.wpp_ledger import SendLedger
+from utils import http_client
 from urllib.parse import urlencode
 import streamlit as st
-import requests
+import threading
+import time
 
 
-SEND_WPP_MSG_URL = "https://api.ultramsg.com/instance134627/messages/chat"
+# {instance} vem do ID de cada perfil em st.secrets["ultramsg"]
+SEND_WPP_MSG_URL = "https://api.ultramsg.com/{instance}/messages/chat"
+MESSAGES_URL = "https://api.ultramsg.com/{instance}/messages"
 
 HEADERS = {
     'content-type': 'application/x-www-form-urlencoded'
 }
 
+MAX_CONCURRENCY = 4  # perfis enviando ao mesmo tempo em send_batch
 
-def send_wpp_msg(msg: str, to: str, token: str) -> dict:
+_ledger: Optional[SendLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> SendLedger:
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = SendLedger()
+        return _ledger
+
+
+def _instance(instance_id: Any) -> str:
+    instance = str(instance_id).strip()
+    return instance if instance.startswith("instance") else f"instance{instance}"
+
+
+def profile_credentials(profile: str) -> Dict[str, str]:
+    """(instância, token) do perfil UltraMsg em st.secrets["ultramsg"][profile]."""
+    creds = st.secrets["ultramsg"][profile]
+    return {"instance": _instance(creds["ID"]), "token": creds["TOKEN"]}
+
+
+def send_wpp_msg(msg: str, to: str, token: str, instance: str, reference_id: Optional[str] = None) -> dict:
     if not to.startswith("+"):
         to = "+" + to
-    payload = urlencode({"token": token, "to": to, "body": msg}, encoding="utf-8")
-    resp = requests.post(SEND_WPP_MSG_URL, data=payload, headers=HEADERS)
-    return resp.json()
\ No newline at end of file
+    fields = {"token": token, "to": to, "body": msg}
+    if reference_id:
+        fields["referenceId"] = reference_id
+    payload = urlencode(fields, encoding="utf-8")
+    # todas as instâncias ficam no mesmo host: o pool do http_client reaproveita as conexões entre elas
+    resp = http_client.post(SEND_WPP_MSG_URL.format(instance=_instance(instance)), data=payload, headers=HEADERS)
+    return resp.json()
+
+
+def is_sent(response: Any) -> bool:
+    return str((response or {}).get("sent", "")).lower() == "true"
+
+
+def find_by_reference(reference_id: str, token: str, instance: str) -> Optional[dict]:
+    """Mensagem já aceita pela instância com esse referenceId, ou None. Erros são propagados."""
+    resp = http_client.get(
+        MESSAGES_URL.format(instance=_instance(instance)),
+        params={"token": token, "referenceId": reference_id, "limit": 1},
+    )
+    resp.raise_for_status()
+    for message in resp.json().get("messages") or []:
+        if str(message.get("referenceId")) == reference_id:
+            return message
+    return None
+
+
+def _reference_id(batch_id: str, row_id: int) -> str:
+    return f"{batch_id}:{row_id}"
+
+
+def send_job(job: Dict[str, Any], batch_id: str, ledger: Optional[SendLedger] = None) -> Dict[str, Any]:
+    """
+    Envia um job {'row_id', 'to', 'body', 'profile'} registrando tudo no ledger.
+
+    Cada envio leva o referenceId "<lote>:<linha>". Se a linha já consta como
+    enviada neste lote, não envia de novo e devolve o registro anterior com
+    'skipped': True. Se uma tentativa anterior ficou sem resultado ('sending':
+    o processo caiu durante a chamada), primeiro procura esse referenceId na
+    instância: se a mensagem está lá, registra como enviada sem reenviar; se a
+    consulta falhar, não envia (falha, para tentar de novo depois). Retorna
+      {'row_id', 'ok', 'skipped', 'message_id', 'latency_ms', 'response', 'error'}
+    """
+    ledger = ledger or get_ledger()
+    row_id = job["row_id"]
+    reference_id = _reference_id(batch_id, row_id)
+    if not ledger.claim(batch_id, row_id, str(job["to"]), job["profile"]):
+        previous = ledger.get(batch_id, row_id)
+        if previous["status"] == "sent":
+            return {
+                "row_id": row_id, "ok": True, "skipped": True,
+                "message_id": previous["message_id"], "latency_ms": previous["latency_ms"],
+                "response": None, "error": None,
+            }
+        # tentativa anterior sem resultado: só reenvia se a instância não tem a mensagem
+        try:
+            creds = profile_credentials(previous["profile"])
+            found = find_by_reference(reference_id, creds["token"], creds["instance"])
+        except Exception as e:
+            return {
+                "row_id": row_id, "ok": False, "skipped": True, "message_id": None, "latency_ms": None,
+                "response": None, "error": f"Não foi possível confirmar a tentativa anterior: {e}",
+            }
+        if found is not None:
+            message_id = None if found.get("id") is None else str(found["id"])
+            ledger.record(batch_id, row_id, True, message_id=message_id, response=found)
+            return {
+                "row_id": row_id, "ok": True, "skipped": True, "message_id": message_id,
+                "latency_ms": None, "response": found, "error": None,
+            }
+        ledger.claim(batch_id, row_id, str(job["to"]), job["profile"], unconfirmed=True)
+    response, error, message_id = None, None, None
+    start = time.perf_counter()
+    try:
+        creds = profile_credentials(job["profile"])
+        response = send_wpp_msg(job["body"], str(job["to"]), creds["token"], creds["instance"], reference_id)
+        ok = is_sent(response)
+        message_id = None if response.get("id") is None else str(response["id"])
+        if not ok:
+            error = str(response.get("error") or response)
+    except Exception as e:
+        ok, error = False, str(e)
+    latency_ms = (time.perf_counter() - start) * 1000
+    ledger.record(batch_id, row_id, ok, message_id=message_id, latency_ms=latency_ms, response=response, error=error)
+    return {
+        "row_id": row_id, "ok": ok, "skipped": False, "message_id": message_id,
+        "latency_ms": latency_ms, "response": response, "error": error,
+    }
+
+
+def send_batch(
+    jobs: Iterable[Dict[str, Any]],
+    batch_id: str,
+    *,
+    max_concurrency: int = MAX_CONCURRENCY,
+    ledger: Optional[SendLedger] = None,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Envia vários jobs {'row_id', 'to', 'body', 'profile'} pelo send_job e devolve
+    os resultados na ordem dos jobs. Cada perfil tem a sua fila, enviada em ordem
+    e uma mensagem por vez (para não atropelar a instância); até
+    `max_concurrency` perfis enviam ao mesmo tempo. Rodar de novo com o mesmo
+    `batch_id` só reenvia as linhas que não foram enviadas com sucesso.
+    `on_result` recebe cada resultado assim que sai, na thread do perfil.
+    """
+    jobs = list(jobs)
+    ledger = ledger or get_ledger()
+    queues: Dict[str, List[int]] = {}
+    for i, job in enumerate(jobs):
+        queues.setdefault(job["profile"], []).append(i)
+
+    def drain(positions: List[int]) -> List[tuple]:
+        out = []
+        for i in positions:
+            result = send_job(jobs[i], batch_id, ledger)
+            if on_result:
+                on_result(result)
+            out.append((i, result))
+        return out
+
+    if not jobs:
+        return []
+    results: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(queues)))) as pool:
+        for fut in as_completed([pool.submit(drain, positions) for positions in queues.values()]):
+            for i, result in fut.result():
+                results[i] = result
+    return results
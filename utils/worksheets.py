@@ -1,57 +1,191 @@
 from supabase import create_client
+from utils.download_cache import DownloadCache
+from utils import http_client
+from tempfile import SpooledTemporaryFile
 from dotenv import load_dotenv
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import IO, Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from pathlib import Path
 import streamlit as st
 from io import BytesIO
+from datetime import datetime
 import pandas as pd
-import requests
+import numpy as np
+import hashlib
+import codecs
 import httpx
+import json
 import time
+import uuid
 
 
 load_dotenv()
 
 BUCKET = "planilhas"
 
+# leitura em streaming: blocos do download, linhas por pedaço e limite em memória do arquivo temporário
+DOWNLOAD_BLOCK_BYTES = 1 << 20
+CHUNK_ROWS = 50_000
+SPOOL_MAX_BYTES = 32 << 20
+
+# cópias colunares (Parquet) de cada planilha, numa pasta oculta do próprio bucket
+SHADOW_DIR = ".colunar"
+# alterações salvas como patches sobre a cópia colunar; acima disso a cópia é regravada
+MAX_PATCHES = 20
+# trava de gravação do registro de cada planilha: espera máxima e idade a partir da qual é abandonada
+LOCK_WAIT_SECS = 15
+LOCK_STALE_SECS = 60
+
+# cache local dos downloads (ver DownloadCache)
+DOWNLOAD_CACHE_MAX_MB = int(st.secrets.get("storage", {}).get("DOWNLOAD_CACHE_MAX_MB", 512))
+_download_cache = DownloadCache(max_bytes=DOWNLOAD_CACHE_MAX_MB << 20)
+
+# listagem do bucket: validade do cache, tamanho das páginas do storage e colunas ordenáveis
+LIST_TTL_SECS = 30
+LIST_PAGE_SIZE = 1000
+LIST_SORT_COLUMNS = {"name": "Nome", "updated_at": "Atualização", "created_at": "Criação"}
+_HIDDEN = {".emptyFolderPlaceholder", ".", SHADOW_DIR}
+
 auth_ok = bool(st.secrets["connections"]["supabase"]["SUPABASE_URL"] and st.secrets["connections"]["supabase"]["SUPABASE_KEY"])
 client = create_client(st.secrets["connections"]["supabase"]["SUPABASE_URL"], st.secrets["connections"]["supabase"]["SUPABASE_KEY"]) if auth_ok else None
 
 
-def upload_to_cloud(file) -> bool:
+def upload_to_cloud(file, df: Optional[pd.DataFrame] = None) -> bool:
+    """
+    Envia o arquivo original e, em seguida, a sua cópia colunar. Se `df` já for o
+    conteúdo do arquivo (como no "Salvar Alterações"), ele é usado direto na cópia;
+    senão o arquivo é lido uma vez aqui, no envio, e não a cada abertura.
+    """
     if not client:
         return False
     try:
-        data = file.getvalue()
-        client.storage.from_(BUCKET).upload(file.name, data)
-        return True
+        with _meta_lock(file.name):
+            try:
+                # patches da versão anterior: a cópia nova os substitui
+                previous = _referenced(_load_meta(file.name))
+            except Exception:
+                previous = []
+            data = file.getvalue()
+            client.storage.from_(BUCKET).upload(file.name, data)
+            _download_cache.invalidate(file.name, *_shadow_paths(file.name))
+            _bucket_listing.clear()
+            try:
+                if df is None:
+                    df = _parse(file.name, BytesIO(data), _encoding_of(data))
+                _write_shadow(file.name, df, hashlib.sha256(data).hexdigest(), _object_info(file.name), previous)
+            except Exception:
+                # a cópia colunar é só um atalho: sem ela a planilha é lida do original
+                pass
     except Exception as e:
         st.error(f"Erro Supabase: {e}")
         return False
+    return True
+
+
+def _is_listed(obj: dict) -> bool:
+    return obj["name"] not in _HIDDEN and not obj["name"].endswith("/") and obj.get("id") is not None
+
+
+def _list_folder(folder: str) -> List[dict]:
+    """Todos os objetos de `folder`, paginando o storage em blocos de LIST_PAGE_SIZE."""
+    objs, offset = [], 0
+    while True:
+        page = client.storage.from_(BUCKET).list(folder, {"limit": LIST_PAGE_SIZE, "offset": offset})
+        objs.extend(page)
+        if len(page) < LIST_PAGE_SIZE:
+            return objs
+        offset += LIST_PAGE_SIZE
 
 
 def list_cloud_files() -> list[str]:
+    """Nomes de todas as planilhas."""
     if not client:
         return []
     try:
-        objs = client.storage.from_(BUCKET).list("")
+        return [obj["name"] for obj in _list_folder("") if _is_listed(obj)]
     except httpx.HTTPError as e:
         st.error(f"Erro de conexão com Supabase: {e}")
         return []
     except Exception as e:
         st.error(f"Erro Supabase: {e}")
         return []
-    return [
-        obj["name"] for obj in objs
-        if obj["name"] not in [".emptyFolderPlaceholder", "."]
-        and not obj["name"].endswith("/")
-    ]
+
+
+@st.cache_data(ttl=LIST_TTL_SECS, show_spinner=False)
+def _bucket_listing() -> Tuple[List[Dict[str, Any]], Dict[str, Optional[str]]]:
+    """
+    Listagem do bucket em cache por LIST_TTL_SECS (limpa por upload, gravação e
+    deleção): as planilhas da raiz, com os metadados do storage, e a versão do
+    registro da cópia colunar de cada uma ({nome: versão}), de uma listagem só da
+    pasta SHADOW_DIR. Erros são propagados (e não ficam em cache).
+    """
+    files = [obj for obj in _list_folder("") if _is_listed(obj)]
+    metas = {
+        obj["name"][:-len(".json")]: _version(obj)
+        for obj in _list_folder(SHADOW_DIR)
+        if obj.get("id") is not None and obj["name"].endswith(".json")
+    }
+    return files, metas
+
+
+def _listed_rows(obj: dict, meta_version: Optional[str]) -> Optional[int]:
+    # o registro vem do cache local pela versão da listagem: só os novos ou alterados são baixados
+    if meta_version is None:
+        return None
+    try:
+        meta = _fetch_meta(_shadow_paths(obj["name"])[1], meta_version)
+    except Exception:
+        return None  # só a contagem de linhas fica de fora da listagem
+    return meta.get("rows") if meta.get("source_etag") == _etag(obj) else None
+
+
+def list_cloud_page(
+    search: str = "",
+    sort_by: str = "name",
+    descending: bool = False,
+    page: int = 0,
+    page_size: int = 50
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Uma página da listagem em cache (_bucket_listing), filtrada por `search`
+    (trecho do nome, sem diferenciar maiúsculas) e ordenada por `sort_by` (ver
+    LIST_SORT_COLUMNS). Devolve (itens, há_mais), com nome, tamanho, atualização
+    e nº de linhas (da cópia colunar; None se ainda não houver). Erros são
+    propagados.
+    """
+    if not client:
+        return [], False
+    files, metas = _bucket_listing()
+    needle = search.strip().lower()
+    if needle:
+        files = [obj for obj in files if needle in obj["name"].lower()]
+    files = sorted(
+        files,
+        key=lambda obj: obj["name"].lower() if sort_by == "name" else (obj.get(sort_by) or ""),
+        reverse=descending,
+    )
+    objs = files[page * page_size:(page + 1) * page_size]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        rows = list(pool.map(lambda obj: _listed_rows(obj, metas.get(obj["name"])), objs))
+    items = []
+    for obj, n in zip(objs, rows):
+        items.append({
+            "name": obj["name"],
+            "size": (obj.get("metadata") or {}).get("size"),
+            "updated_at": obj.get("updated_at"),
+            "rows": n,
+        })
+    return items, len(files) > (page + 1) * page_size
 
 
 def delete_cloud_file(name: str) -> bool:
     if not client:
         return False
     try:
-        client.storage.from_(BUCKET).remove(name)
+        client.storage.from_(BUCKET).remove([name, *_shadow_paths(name), *_patch_objects(name)])
+        _download_cache.invalidate(name, *_shadow_paths(name))
+        _bucket_listing.clear()
         return True
     except Exception as e:
         st.error(f"Erro Supabase: {e}")
@@ -59,34 +193,732 @@ def delete_cloud_file(name: str) -> bool:
 
 
 def download_cloud_file(name: str) -> Optional[BytesIO]:
+    """
+    Arquivo original, para download. Se houver alterações salvas só como patches,
+    o arquivo é materializado (e regravado no bucket) neste momento.
+    """
     try:
-        signed = client.storage.from_(BUCKET).create_signed_url(name, 60)
-        url = signed["signedURL"]
-        url = f"{url}&v={int(time.time())}"
-        r = requests.get(url, headers={"Cache-Control": "no-cache"})
-        r.raise_for_status()
-        return BytesIO(r.content) if r.content else None
+        info = _require_info(name)
+        meta = _shadow_meta(name, _etag(info))
+        if meta is not None and meta.get("dirty"):
+            with _meta_lock(name):
+                # relido com a trava: materializa exatamente os patches que o registro aponta
+                info = _require_info(name)
+                meta = _shadow_meta(name, _etag(info))
+                if meta is not None and meta.get("dirty"):
+                    return BytesIO(_materialize(name, _read_shadow(name, info, meta), meta)[0])
+        fh, _, _ = _spool_cloud_file(name, _version(info))
+        with fh:
+            data = fh.read()
+        return BytesIO(data) if data else None
     except Exception as e:
         st.error(f"Erro ao baixar {name}: {e}")
         return None
 
 
-def worksheet_to_df(name: str) -> Optional[pd.DataFrame]:
-    if not client:
+def _signed_url(name: str) -> str:
+    signed = client.storage.from_(BUCKET).create_signed_url(name, 60)
+    return f"{signed['signedURL']}&v={int(time.time())}"
+
+
+def _download(name: str, out: IO[bytes]) -> Tuple[str, str]:
+    """
+    Baixa o arquivo em blocos para `out` e devolve (encoding, sha256). O encoding é
+    decidido pelos próprios blocos durante o download: utf-8 enquanto forem válidos,
+    latin1 a partir do primeiro erro, sem precisar reler o arquivo.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    digest = hashlib.sha256()
+    encoding = "utf-8"
+    with http_client.get(_signed_url(name), headers={"Cache-Control": "no-cache"}, stream=True) as r:
+        r.raise_for_status()
+        for block in r.iter_content(chunk_size=DOWNLOAD_BLOCK_BYTES):
+            if encoding == "utf-8":
+                try:
+                    decoder.decode(block)
+                except UnicodeDecodeError:
+                    encoding = "latin1"
+            digest.update(block)
+            out.write(block)
+    if encoding == "utf-8":
+        try:
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            encoding = "latin1"
+    return encoding, digest.hexdigest()
+
+
+def _spool_cloud_file(name: str, version: Optional[str] = None) -> Tuple[IO[bytes], str, str]:
+    """
+    Abre o arquivo do bucket e devolve (arquivo, encoding, sha256). Com `version`
+    (ETag/updated_at do storage) usa o cache local: um acerto não baixa nada, um
+    erro baixa direto para o cache. Sem versão, baixa para um SpooledTemporaryFile
+    (vai para o disco acima de SPOOL_MAX_BYTES).
+    """
+    if version is not None:
+        hit = _download_cache.get(name, version)
+        if hit is not None:
+            return hit
+        tmp = _download_cache.new_blob()
+        try:
+            with tmp:
+                encoding, sha256 = _download(name, tmp)
+            fh = _download_cache.put(name, version, Path(tmp.name), sha256, encoding)
+        except Exception:
+            Path(tmp.name).unlink(missing_ok=True)
+            raise
+        return fh, encoding, sha256
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        encoding, sha256 = _download(name, spool)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, encoding, sha256
+
+
+def _encoding_of(data: bytes) -> str:
+    try:
+        data.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin1"
+
+
+def _is_empty(fh: IO[bytes]) -> bool:
+    empty = not fh.read(1)
+    fh.seek(0)
+    return empty
+
+
+def _is_excel(name: str) -> bool:
+    return name.lower().endswith((".xlsx", ".xls"))
+
+
+def _excel_header(row: tuple) -> List[str]:
+    # mesmos nomes do pd.read_excel: vazios viram "Unnamed: i" e repetidos ganham ".1", ".2"...
+    names, seen = [], {}
+    for i, v in enumerate(row):
+        col = f"Unnamed: {i}" if v is None or (isinstance(v, str) and not v.strip()) else str(v)
+        if col in seen:
+            seen[col] += 1
+            col = f"{col}.{seen[col]}"
+        else:
+            seen[col] = 0
+        names.append(col)
+    return names
+
+
+def _trim_row(row: tuple) -> tuple:
+    # como o read_excel: células vazias no fim da linha não contam para a largura
+    end = len(row)
+    while end and (row[end - 1] is None or row[end - 1] == ""):
+        end -= 1
+    return tuple(row[:end])
+
+
+def _iter_xlsx(fh: IO[bytes], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """
+    XLSX em pedaços, com as colunas do pd.read_excel: a largura é a da linha mais
+    larga vista até ali (colunas sem cabeçalho viram "Unnamed: i", e os pedaços
+    seguintes podem ganhar colunas) e uma planilha só com cabeçalho dá um
+    DataFrame vazio com as colunas nomeadas.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(fh, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        rows = (_trim_row(row) for row in ws.iter_rows(values_only=True))
+        header = next(rows, None)
+        if header is None:
+            return
+        width = len(header)
+        columns = _excel_header(header)
+        batch: List[tuple] = []
+        blank = 0
+        yielded = False
+
+        def frame():
+            return pd.DataFrame.from_records(
+                [row + (None,) * (width - len(row)) for row in batch], columns=columns
+            )
+
+        for row in rows:
+            if not row:
+                # linhas vazias só entram se houver dados depois delas (como no read_excel)
+                blank += 1
+                continue
+            if len(row) > width:
+                width = len(row)
+                columns = _excel_header(header + (None,) * (width - len(header)))
+            batch.extend([()] * blank)
+            blank = 0
+            batch.append(row)
+            if len(batch) >= chunk_rows:
+                yield frame()
+                yielded = True
+                batch = []
+        if batch or not yielded:
+            yield frame()
+    finally:
+        wb.close()
+
+
+def _iter_csv(fh: IO[bytes], encoding: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    with pd.read_csv(fh, encoding=encoding, chunksize=chunk_rows) as reader:
+        yield from reader
+
+
+def _read_csv(fh: IO[bytes], encoding: str) -> pd.DataFrame:
+    # mesmo parser (o padrão, em C) da leitura em pedaços: os tipos inferidos, e
+    # portanto a cópia colunar e os patches, não dependem do caminho de leitura
+    return pd.read_csv(fh, encoding=encoding)
+
+
+# ----------------- Cópia colunar -----------------
+
+def _shadow_paths(name: str) -> Tuple[str, str]:
+    return f"{SHADOW_DIR}/{name}.parquet", f"{SHADOW_DIR}/{name}.json"
+
+
+def _patch_dir(name: str) -> str:
+    return f"{SHADOW_DIR}/{name}.patches"
+
+
+def _patch_objects(name: str) -> List[str]:
+    try:
+        objs = client.storage.from_(BUCKET).list(_patch_dir(name), {"limit": LIST_PAGE_SIZE})
+    except Exception:
+        return []
+    return [f"{_patch_dir(name)}/{o['name']}" for o in objs if o.get("id") is not None]
+
+
+def _stat(path: str) -> Optional[dict]:
+    """Metadados do objeto `path` (pasta/nome) numa chamada de list; None se ele não existe."""
+    folder, _, base = path.rpartition("/")
+    objs = client.storage.from_(BUCKET).list(folder, {"search": base, "limit": 100})
+    return next((o for o in objs if o.get("name") == base), None)
+
+
+def _object_info(name: str) -> Optional[dict]:
+    """Metadados do objeto no storage; None se não der para obter (uso best-effort)."""
+    try:
+        return _stat(name)
+    except Exception:
         return None
+
+
+def _require_info(name: str) -> dict:
+    """Metadados do objeto para leitura: erros são propagados e objeto ausente é erro."""
+    info = _stat(name)
+    if info is None:
+        raise FileNotFoundError(f"{name} não encontrado no bucket.")
+    return info
+
+
+def _current(name: str) -> Tuple[dict, Optional[dict]]:
+    """
+    (metadados do original, registro da cópia colunar desta versão) para leitura.
+    O original vem da listagem em cache (_bucket_listing, que a tela de planilhas
+    acabou de carregar), então abrir uma planilha em dia custa um list só, o do
+    registro. Sem registro para aquela versão, confere o original no storage
+    antes de concluir que não há cópia. Gravações usam sempre _require_info.
+    """
+    files, _ = _bucket_listing()
+    listed = next((obj for obj in files if obj["name"] == name), None)
+    info = listed or _require_info(name)
+    meta = _shadow_meta(name, _etag(info))
+    if meta is None and listed is not None:
+        fresh = _require_info(name)
+        if _etag(fresh) != _etag(info):
+            info, meta = fresh, _shadow_meta(name, _etag(fresh))
+    return info, meta
+
+
+def _etag(info: Optional[dict]) -> Optional[str]:
+    meta = (info or {}).get("metadata") or {}
+    return meta.get("eTag")
+
+
+def _version(info: Optional[dict]) -> Optional[str]:
+    """Identifica a versão do objeto: ETag, ou updated_at se o storage não informar."""
+    return _etag(info) or (info or {}).get("updated_at")
+
+
+def _to_parquet(df: pd.DataFrame) -> BytesIO:
+    buf = BytesIO()
     try:
-        buf = download_cloud_file(name)
-        if buf is None:
+        df.to_parquet(buf, index=False)
+    except (TypeError, ValueError):
+        # colunas com tipos misturados (ex.: números e textos após edição) vão como texto,
+        # como ficariam ao reler o CSV
+        mixed = df.select_dtypes(include="object").columns
+        df = df.assign(**{str(c): df[c].where(df[c].isna(), df[c].astype(str)) for c in mixed})
+        buf = BytesIO()
+        df.to_parquet(buf, index=False)
+    return buf
+
+
+def _write_shadow(name: str, df: pd.DataFrame, sha256: str, info: Optional[dict],
+                  replaces: Sequence[str] = (), same_as: Optional[str] = None) -> bool:
+    """
+    Grava `<SHADOW_DIR>/<nome>.parquet` e o registro com a identidade do original.
+    Depois apaga `replaces`: os objetos (patches, Parquet compactado) que `df` já
+    incorpora ou substitui, lidos do registro anterior por quem chama com a trava.
+    `same_as` é a revisão com o mesmo conteúdo de `df` (materialização), em que
+    quem abriu a planilha antes ainda pode salvar.
+    """
+    etag = _etag(info)
+    if etag is None:
+        return False
+    buf = _to_parquet(df)
+    parquet_path, meta_path = _shadow_paths(name)
+    meta = {
+        "source": name,
+        "source_etag": etag,
+        "sha256": sha256,
+        "rows": len(df),
+        "columns": [str(c) for c in df.columns],
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    if same_as:
+        meta["same_as"] = same_as
+    bucket = client.storage.from_(BUCKET)
+    bucket.upload(parquet_path, buf.getvalue(), {"content-type": "application/octet-stream", "upsert": "true"})
+    bucket.upload(meta_path, json.dumps(meta).encode("utf-8"), {"content-type": "application/json", "upsert": "true"})
+    _download_cache.invalidate(meta_path)
+    stale = [path for path in replaces if path != parquet_path]
+    if stale:
+        # o registro novo não aponta mais para eles; se falhar, ficam só objetos órfãos
+        try:
+            bucket.remove(stale)
+            _download_cache.invalidate(*stale)
+        except Exception:
+            pass
+    return True
+
+
+def _referenced(meta: Optional[dict]) -> List[str]:
+    """Objetos de patch a que o registro aponta: os patches e o Parquet compactado."""
+    if not meta:
+        return []
+    return list(meta.get("patches", [])) + ([meta["parquet"]] if meta.get("parquet") else [])
+
+
+def _revision(info: Optional[dict], meta: Optional[dict]) -> str:
+    """
+    Identifica o conteúdo que uma sessão carregou: versão do original, Parquet
+    compactado e patches. Muda a cada gravação; os patches endereçam linhas por
+    posição, então só valem sobre a mesma revisão em que foram calculados.
+    """
+    meta = meta or {}
+    key = json.dumps([_etag(info), meta.get("parquet"), meta.get("patches", [])])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+@contextmanager
+def _meta_lock(name: str):
+    """
+    Trava de gravação do registro da planilha, compartilhada entre processos: o
+    objeto `<SHADOW_DIR>/<nome>.lock`, criado sem upsert (só um consegue). Uma
+    trava mais velha que LOCK_STALE_SECS (processo que morreu) é removida.
+    """
+    bucket = client.storage.from_(BUCKET)
+    path = f"{SHADOW_DIR}/{name}.lock"
+    deadline = time.time() + LOCK_WAIT_SECS
+    while True:
+        try:
+            bucket.upload(path, json.dumps({"at": time.time()}).encode("utf-8"), {"content-type": "application/json"})
+            break
+        except Exception:
+            # já existe (ou falhou): confere se ainda vale
+            try:
+                held_at = json.loads(bucket.download(path)).get("at", 0)
+            except Exception:
+                held_at = None
+            if held_at is not None and time.time() - held_at > LOCK_STALE_SECS:
+                bucket.remove([path])
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"{name} está sendo gravada por outra sessão; tente de novo em instantes.")
+            time.sleep(0.5)
+    try:
+        yield
+    finally:
+        try:
+            bucket.remove([path])
+        except Exception:
+            pass
+
+
+def _shadow_meta(name: str, etag: Optional[str]) -> Optional[dict]:
+    """
+    Registro da cópia colunar, se ele for desta versão do original. None só quando
+    o registro não existe ou é de outra versão do original; falhas ao consultá-lo
+    são propagadas, porque ele pode apontar para patches pendentes.
+    """
+    if etag is None:
+        return None
+    meta = _load_meta(name)
+    if meta is None or meta.get("source_etag") != etag:
+        return None
+    return meta
+
+
+def _load_meta(name: str) -> Optional[dict]:
+    """
+    Registro da cópia colunar, de qualquer versão do original; None se não existe.
+    Fica no cache local pela versão do próprio registro (ETag/updated_at, conferida
+    a cada chamada com um list), então patches salvos por outro processo são vistos.
+    """
+    _, meta_path = _shadow_paths(name)
+    meta_info = _stat(meta_path)
+    if meta_info is None:
+        return None
+    return _fetch_meta(meta_path, _version(meta_info))
+
+
+def _fetch_meta(meta_path: str, meta_version: Optional[str]) -> dict:
+    """Registro na versão `meta_version`: do cache local se já baixado, senão do bucket."""
+    hit = _download_cache.get(meta_path, meta_version) if meta_version else None
+    if hit is not None:
+        with hit[0] as fh:
+            data = fh.read()
+    else:
+        data = client.storage.from_(BUCKET).download(meta_path)
+        if meta_version:
+            tmp = _download_cache.new_blob()
+            try:
+                with tmp:
+                    tmp.write(data)
+                _download_cache.put(meta_path, meta_version, Path(tmp.name), hashlib.sha256(data).hexdigest(), "utf-8").close()
+            except OSError:
+                Path(tmp.name).unlink(missing_ok=True)
+    return json.loads(data)
+
+
+def _open_shadow(name: str, info: Optional[dict], meta: Optional[dict] = None) -> Optional[Tuple[IO[bytes], dict]]:
+    """
+    (Parquet baixado, registro), se o registro bater com a versão atual do
+    original. `meta`, se dado, é o registro já lido por quem chama.
+    """
+    etag = _etag(info)
+    # o registro e o Parquet ficam no cache local: numa segunda abertura nada é baixado
+    if meta is None:
+        meta = _shadow_meta(name, etag)
+    if meta is None:
+        return None
+    parquet_path = meta.get("parquet") or _shadow_paths(name)[0]
+    try:
+        spool, _, _ = _spool_cloud_file(parquet_path, f"src:{etag}")
+    except Exception:
+        if meta.get("dirty"):
+            raise
+        return None
+    return spool, meta
+
+
+def _read_shadow(name: str, info: Optional[dict], meta: Optional[dict] = None) -> Optional[pd.DataFrame]:
+    """
+    Planilha a partir da cópia colunar com os patches aplicados; None se não houver
+    cópia válida. Com alterações pendentes (`dirty`) o original está desatualizado,
+    então qualquer erro aqui é propagado em vez de cair para o original.
+    """
+    opened = _open_shadow(name, info, meta)
+    if opened is None:
+        return None
+    fh, meta = opened
+    with fh:
+        try:
+            df = pd.read_parquet(fh)
+        except Exception:
+            if meta.get("dirty"):
+                raise
             return None
-        if name.lower().endswith((".xlsx", ".xls")):
-            df = pd.read_excel(buf)
+    for path in meta.get("patches", []):
+        patch_fh, _, _ = _spool_cloud_file(path, "patch")
+        with patch_fh:
+            df = _apply_patch(df, json.load(patch_fh))
+    return df
+
+
+# ----------------- Alterações incrementais -----------------
+
+def _jsonable(value: Any) -> Any:
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime, np.datetime64)):
+        # com marca de tipo, para voltar como data em _from_json (e não virar texto no arquivo)
+        return {"$ts": pd.Timestamp(value).isoformat()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _from_json(value: Any) -> Any:
+    if isinstance(value, dict) and "$ts" in value:
+        return pd.Timestamp(value["$ts"])
+    return value
+
+
+def _changed(old: pd.Series, new: pd.Series) -> np.ndarray:
+    both_na = old.isna().to_numpy() & new.isna().to_numpy()
+    try:
+        equal = old.eq(new).fillna(False).to_numpy(dtype=bool)
+    except TypeError:
+        equal = old.astype(object).to_numpy() == new.astype(object).to_numpy()
+    return ~(equal | both_na)
+
+
+def _diff_frames(old: pd.DataFrame, new: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Diferença entre a planilha salva (`old`, índice 0..n-1) e a editada (`new`, saída
+    do data_editor: linhas mantidas com o índice original, novas no fim). Posições
+    sempre relativas a `old`; só as células que mudaram entram no patch.
+    """
+    positions = pd.Series(np.arange(len(old)), index=old.index)
+    kept_mask = new.index.isin(old.index)
+    kept = new.index[kept_mask]
+    cells = {}
+    for col in new.columns:
+        values = new.loc[kept, col]
+        changed = _changed(old.loc[kept, col], values) if col in old.columns else np.ones(len(kept), dtype=bool)
+        if changed.any():
+            cells[str(col)] = {
+                "rows": positions[kept[changed]].tolist(),
+                "values": [_jsonable(v) for v in values[changed]],
+            }
+    return {
+        "columns": [str(c) for c in new.columns],
+        "deleted": positions[~old.index.isin(new.index)].tolist(),
+        "cells": cells,
+        "added": [[_jsonable(v) for v in row] for row in new.loc[~kept_mask].itertuples(index=False)],
+    }
+
+
+def _is_noop(patch: Dict[str, Any], old: pd.DataFrame) -> bool:
+    return (
+        not patch["cells"] and not patch["deleted"] and not patch["added"]
+        and patch["columns"] == [str(c) for c in old.columns]
+    )
+
+
+def _apply_patch(df: pd.DataFrame, patch: Dict[str, Any]) -> pd.DataFrame:
+    df = df.copy()
+    for col, change in patch["cells"].items():
+        if col not in df.columns:
+            df[col] = pd.Series([None] * len(df), index=df.index, dtype=object)
+        rows, loc = np.asarray(change["rows"], dtype=int), df.columns.get_loc(col)
+        values = [_from_json(v) for v in change["values"]]
+        try:
+            df.iloc[rows, loc] = values
+        except (TypeError, ValueError):
+            # valor de outro tipo (ex.: texto numa coluna numérica)
+            df[col] = df[col].astype(object)
+            df.iloc[rows, loc] = values
+        if df[col].dtype == object:
+            df[col] = df[col].infer_objects()
+    if patch["deleted"]:
+        df = df.drop(index=df.index[patch["deleted"]])
+    df = df[patch["columns"]]
+    if patch["added"]:
+        added = [[_from_json(v) for v in row] for row in patch["added"]]
+        df = pd.concat([df, pd.DataFrame(added, columns=patch["columns"])], ignore_index=True)
+    return df.reset_index(drop=True)
+
+
+def _serialize(name: str, df: pd.DataFrame) -> bytes:
+    buf = BytesIO()
+    if _is_excel(name):
+        df.to_excel(buf, index=False)
+    else:
+        df.to_csv(buf, index=False)
+    return buf.getvalue()
+
+
+def _materialize(name: str, df: pd.DataFrame, meta: Optional[dict]) -> Tuple[bytes, str]:
+    """
+    Regrava o arquivo original inteiro (upsert, sem apagar antes) e uma cópia
+    colunar limpa; só apaga os patches de `meta`, que `df` incorpora. Chamado com
+    a trava do registro. Devolve (conteúdo, revisão nova).
+    """
+    data = _serialize(name, df)
+    same_as = _revision(_object_info(name), meta) if meta is not None else None
+    client.storage.from_(BUCKET).upload(name, data, {"upsert": "true"})
+    _download_cache.invalidate(name, *_shadow_paths(name))
+    _bucket_listing.clear()
+    info = _object_info(name)
+    try:
+        _write_shadow(name, df, hashlib.sha256(data).hexdigest(), info, _referenced(meta), same_as)
+    except Exception:
+        # sem cópia nova, o registro antigo não bate mais com o original e ele passa a ser lido
+        pass
+    return data, _revision(info, None)
+
+
+def save_changes(name: str, base: pd.DataFrame, edited: pd.DataFrame, revision: str) -> Optional[str]:
+    """
+    Salva a edição de uma planilha enviando só a diferença para `base` (o que foi
+    carregado/salvo por último, na `revision` de load_worksheet): um patch novo e o
+    registro da cópia colunar atualizado por upsert, que é o que torna o patch
+    visível. O original só é regravado no download (ou aqui, se ainda não houver
+    cópia colunar). A cada MAX_PATCHES a cópia colunar é regravada por inteiro.
+
+    Tudo com a trava do registro. Se a planilha mudou desde `revision` (outra
+    sessão salvou antes), nada é gravado: o patch apontaria para as linhas
+    erradas. Devolve a revisão nova, ou None se não salvou.
+    """
+    if not client:
+        return None
+    try:
+        with _meta_lock(name):
+            return _save_locked(name, base, edited, revision)
+    except Exception as e:
+        st.error(f"Erro Supabase: {e}")
+        return None
+
+
+def _save_locked(name: str, base: pd.DataFrame, edited: pd.DataFrame, revision: str) -> Optional[str]:
+    info = _require_info(name)
+    etag = _etag(info)
+    meta = _shadow_meta(name, etag)
+    # o download materializa sem mudar o conteúdo: quem abriu antes dele continua valendo
+    materialized = meta is not None and meta.get("same_as") == revision and not _referenced(meta)
+    if _revision(info, meta) != revision and not materialized:
+        st.error(f"{name} foi alterada por outra sessão depois de aberta. Abra a planilha de novo e refaça as alterações.")
+        return None
+    if meta is None:
+        return _materialize(name, edited.reset_index(drop=True), None)[1]
+    patch = _diff_frames(base, edited)
+    if _is_noop(patch, base):
+        return revision
+    bucket = client.storage.from_(BUCKET)
+    meta = dict(meta)
+    patches = list(meta.get("patches", []))
+    replaced: List[str] = []
+    compacted = False
+    if len(patches) >= MAX_PATCHES:
+        try:
+            buf = _to_parquet(edited.reset_index(drop=True))
+            compacted = True
+        except Exception:
+            pass
+    if compacted:
+        # novo arquivo (nunca sobrescreve o atual): o registro passa a apontar para ele
+        path = f"{_patch_dir(name)}/{uuid.uuid4().hex}.parquet"
+        bucket.upload(path, buf.getvalue(), {"content-type": "application/octet-stream"})
+        # o que a cópia nova incorpora: patches e o Parquet compactado anterior
+        replaced = _referenced(meta)
+        meta["parquet"], meta["patches"] = path, []
+    else:
+        path = f"{_patch_dir(name)}/{uuid.uuid4().hex}.json"
+        bucket.upload(path, json.dumps(patch, ensure_ascii=False).encode("utf-8"), {"content-type": "application/json"})
+        meta["patches"] = patches + [path]
+    meta.update(
+        dirty=True,
+        rows=len(edited),
+        columns=patch["columns"],
+        updated_at=datetime.now().isoformat(timespec="seconds"),
+    )
+    _, meta_path = _shadow_paths(name)
+    bucket.upload(meta_path, json.dumps(meta).encode("utf-8"), {"content-type": "application/json", "upsert": "true"})
+    _download_cache.invalidate(meta_path)
+    _bucket_listing.clear()
+    if replaced:
+        # só depois que o registro novo foi gravado; se falhar, ficam só objetos órfãos
+        try:
+            bucket.remove(replaced)
+            _download_cache.invalidate(*replaced)
+        except Exception:
+            pass
+    return _revision(info, meta)
+
+
+# ----------------- Leitura -----------------
+
+def _parse(name: str, fh: IO[bytes], encoding: str) -> pd.DataFrame:
+    if name.lower().endswith(".xls"):
+        return pd.read_excel(fh)
+    if _is_excel(name):
+        chunks = list(_iter_xlsx(fh, CHUNK_ROWS))
+        if not chunks:
+            return pd.DataFrame()
+        return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+    return _read_csv(fh, encoding)
+
+
+def iter_worksheet_chunks(name: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Lê a planilha da nuvem em pedaços de até `chunk_rows` linhas, sem carregar o
+    arquivo inteiro em memória: da cópia colunar em lotes quando ela estiver em dia,
+    senão CSV em blocos pelo parser do pandas e XLSX linha a linha com o openpyxl
+    em modo somente leitura. Erros são propagados.
+    """
+    if not client:
+        return
+    info, meta = _current(name)
+    opened = _open_shadow(name, info, meta) if meta is not None else None
+    if opened is not None and opened[1].get("patches"):
+        # patches valem para a planilha inteira: aplica e entrega em fatias
+        opened[0].close()
+        df = _read_shadow(name, info, meta)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+        return
+    if opened is not None:
+        import pyarrow.parquet as pq
+
+        with opened[0] as shadow:
+            for batch in pq.ParquetFile(shadow).iter_batches(batch_size=chunk_rows):
+                yield batch.to_pandas()
+        return
+    spool, encoding, _ = _spool_cloud_file(name, _version(info))
+    with spool:
+        if _is_empty(spool):
+            return
+        if name.lower().endswith(".xls"):
+            # formato antigo não tem leitura em streaming
+            yield pd.read_excel(spool)
+        elif _is_excel(name):
+            yield from _iter_xlsx(spool, chunk_rows)
         else:
-            try:
-                df = pd.read_csv(buf, encoding="utf-8")
-            except UnicodeDecodeError:
-                buf.seek(0)
-                df = pd.read_csv(buf, encoding="latin1")
-        return df
+            yield from _iter_csv(spool, encoding, chunk_rows)
+
+
+def worksheet_to_df(name: str) -> Optional[pd.DataFrame]:
+    """Carrega a planilha inteira (ver load_worksheet)."""
+    return load_worksheet(name)[0]
+
+
+def load_worksheet(name: str) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """
+    Carrega a planilha inteira e a revisão lida, que save_changes confere. Usa a
+    cópia colunar quando ela corresponde à versão atual do original; caso
+    contrário lê o original e deixa a cópia pronta para a próxima abertura. Se não
+    for possível saber se há alterações pendentes (erro ao consultar o storage ou
+    o registro), mostra o erro em vez de ler o original.
+    """
+    if not client:
+        return None, None
+    try:
+        info, meta = _current(name)
+        df = _read_shadow(name, info, meta) if meta is not None else None
+        if df is not None:
+            return df, _revision(info, meta)
+        spool, encoding, sha256 = _spool_cloud_file(name, _version(info))
+        with spool:
+            if _is_empty(spool):
+                return None, None
+            df = _parse(name, spool, encoding)
     except Exception as e:
         st.error(f"Erro ao baixar {name}: {e}")
-        return None
\ No newline at end of file
+        return None, None
+    try:
+        # não há registro desta versão: a cópia nova não substitui nenhum patch
+        _write_shadow(name, df, sha256, info)
+    except Exception:
+        pass
+    return df, _revision(info, None)
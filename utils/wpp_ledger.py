@@ -0,0 +1,111 @@
+from typing import Any, Dict, List, Optional
+from utils.local_store import SqliteStore
+import json
+import time
+
+
+class SendLedger(SqliteStore):
+    """
+    Registro local (SQLite) de cada envio de WhatsApp, por (lote, linha).
+
+    Uma linha vira 'sending' antes da chamada à UltraMsg e 'sent'/'failed' com o
+    retorno (id da mensagem, latência, resposta). Serve para:
+      - idempotência: uma linha já 'sent' nunca é enviada de novo no mesmo lote
+        (claim devolve False), inclusive depois de um reinício; uma que ficou em
+        'sending' só é reenviada depois de conferida na instância (ver
+        whatsapp.send_job);
+      - reenvio só das falhas;
+      - relatório de vazão (throughput).
+    Para campanhas, o lote é o id da campanha e a linha é o `seq` da mensagem.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sends (
+        batch_id    TEXT    NOT NULL,
+        row_id      INTEGER NOT NULL,
+        to_number   TEXT    NOT NULL,
+        profile     TEXT    NOT NULL,
+        status      TEXT    NOT NULL,
+        attempts    INTEGER NOT NULL DEFAULT 0,
+        message_id  TEXT,
+        latency_ms  REAL,
+        response    TEXT,
+        error       TEXT,
+        started_at  REAL    NOT NULL,
+        finished_at REAL,
+        PRIMARY KEY (batch_id, row_id)
+    );
+    CREATE INDEX IF NOT EXISTS sends_finished_at ON sends(finished_at);
+    """
+
+    def __init__(self, name: str = "wpp_ledger"):
+        super().__init__(name)
+
+    def claim(self, batch_id: str, row_id: int, to_number: str, profile: str, *, unconfirmed: bool = False) -> bool:
+        """
+        Marca a linha como 'sending'. False se ela já foi enviada com sucesso neste
+        lote ou se uma tentativa anterior ficou sem resultado ('sending'), a não
+        ser com `unconfirmed` (quem chama já conferiu que ela não foi entregue).
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT status FROM sends WHERE batch_id = ? AND row_id = ?", (batch_id, row_id)
+            ).fetchone()
+            if row is not None and (row["status"] == "sent" or (row["status"] == "sending" and not unconfirmed)):
+                return False
+            conn.execute(
+                "INSERT INTO sends(batch_id, row_id, to_number, profile, status, attempts, started_at) "
+                "VALUES (?, ?, ?, ?, 'sending', 1, ?) "
+                "ON CONFLICT(batch_id, row_id) DO UPDATE SET to_number = excluded.to_number, "
+                "profile = excluded.profile, status = 'sending', attempts = attempts + 1, "
+                "started_at = excluded.started_at, finished_at = NULL, error = NULL",
+                (batch_id, row_id, to_number, profile, now),
+            )
+        return True
+
+    def record(self, batch_id: str, row_id: int, ok: bool, *, message_id: Optional[str] = None,
+               latency_ms: Optional[float] = None, response: Any = None, error: Optional[str] = None):
+        self.execute(
+            "UPDATE sends SET status = ?, message_id = ?, latency_ms = ?, response = ?, error = ?, "
+            "finished_at = ? WHERE batch_id = ? AND row_id = ?",
+            ("sent" if ok else "failed", message_id, latency_ms,
+             json.dumps(response, ensure_ascii=False, default=str), error, time.time(), batch_id, row_id),
+        )
+
+    def get(self, batch_id: str, row_id: int) -> Optional[Dict[str, Any]]:
+        rows = self.query("SELECT * FROM sends WHERE batch_id = ? AND row_id = ?", (batch_id, row_id))
+        return dict(rows[0]) if rows else None
+
+    def rows(self, batch_id: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        if status is None:
+            rows = self.query("SELECT * FROM sends WHERE batch_id = ? ORDER BY row_id", (batch_id,))
+        else:
+            rows = self.query(
+                "SELECT * FROM sends WHERE batch_id = ? AND status = ? ORDER BY row_id", (batch_id, status)
+            )
+        return [dict(r) for r in rows]
+
+    def throughput(self, batch_id: Optional[str] = None, since: Optional[float] = None) -> Dict[str, Any]:
+        """Enviadas, falhas, mensagens/minuto e latência média/p95 dos envios concluídos."""
+        where, params = ["finished_at IS NOT NULL"], []
+        if batch_id is not None:
+            where.append("batch_id = ?")
+            params.append(batch_id)
+        if since is not None:
+            where.append("finished_at >= ?")
+            params.append(since)
+        rows = self.query(
+            f"SELECT status, latency_ms, started_at, finished_at FROM sends WHERE {' AND '.join(where)}",
+            params,
+        )
+        sent = sum(r["status"] == "sent" for r in rows)
+        latencies = sorted(r["latency_ms"] for r in rows if r["latency_ms"] is not None)
+        span = (max(r["finished_at"] for r in rows) - min(r["started_at"] for r in rows)) if rows else 0
+        return {
+            "sent": sent,
+            "failed": len(rows) - sent,
+            "per_minute": len(rows) * 60 / span if span > 0 else None,
+            "latency_avg_ms": sum(latencies) / len(latencies) if latencies else None,
+            "latency_p95_ms": latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+        }
@@ -5,18 +5,25 @@
 #   export GEMINI_API_KEY="sua_chave"
 #   streamlit run app_reurb_gemini.py
 
+import io
 import os
+import hashlib
 import re
 import json
-import tempfile
-from pathlib import Path
+import time
+import mimetypes
+import queue
 from collections import Counter
-from typing import Dict, Any, List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Any, List, Optional, Tuple
 
 import pandas as pd
 import streamlit as st
 from google import genai  # SDK oficial google-genai (Developer API)
 from google.genai import types
+from utils.gemini_cache import GeminiCache
+from utils import doc_extract
+from utils.json_stream import JsonArrayStream
 # -----------------------------
 # Configuração inicial
 # -----------------------------
@@ -31,6 +38,31 @@ if not API_KEY:
 client = genai.Client(api_key=API_KEY)
 GEMINI_MODEL = "gemini-2.0-flash"  # rápido e multimodal
 
+# map-reduce: arquivos classificados em lotes de CLASSIFY_BATCH_SIZE, até
+# CLASSIFY_WORKERS lotes ao mesmo tempo (cada lote envia os seus arquivos, até
+# UPLOAD_WORKERS em paralelo, e faz uma chamada); depois uma única consolidação
+# sobre o resumo de cada arquivo
+CLASSIFY_BATCH_SIZE = max(1, int(st.secrets.get("google_gemini", {}).get("CLASSIFY_BATCH_SIZE", 5)))
+CLASSIFY_WORKERS = max(1, int(st.secrets.get("google_gemini", {}).get("CLASSIFY_WORKERS", 4)))
+UPLOAD_WORKERS = max(1, int(st.secrets.get("google_gemini", {}).get("UPLOAD_WORKERS", 4)))
+CLASSIFY_TOKENS_PER_FILE = 1024   # teto de saída por arquivo do lote
+MAX_OUTPUT_TOKENS = 8192
+SUMMARY_VALUE_CHARS = 120         # corte dos key_fields enviados à consolidação
+UPLOAD_RETRIES = 3
+
+# respostas em streaming (generate_content_stream): cada entrada de "files" e
+# cada documento faltante aparece na tela assim que o modelo termina de escrevê-lo
+STREAM_RESPONSES = bool(st.secrets.get("google_gemini", {}).get("STREAM_RESPONSES", True))
+
+# pré-extração local (utils/doc_extract): páginas com texto vão como texto puro;
+# só as digitalizadas (sem camada de texto) vão como PDF, para o OCR do modelo
+EXTRACT_WORKERS = max(1, int(st.secrets.get("google_gemini", {}).get("EXTRACT_WORKERS", os.cpu_count() or 2)))
+MAX_TEXT_CHARS = int(st.secrets.get("google_gemini", {}).get("MAX_TEXT_CHARS", 30_000))  # por arquivo
+OCR_MAX_PAGES = int(st.secrets.get("google_gemini", {}).get("OCR_MAX_PAGES", 5))         # por arquivo
+
+# handles da Files API e classificação de cada arquivo, por SHA-256 do conteúdo
+_cache = GeminiCache()
+
 # -----------------------------
 # Prompt do modelo (jurídico)
 # -----------------------------
@@ -184,42 +216,479 @@ REURB_SCHEMA = {
 }
 
 
-def _upload_files_to_gemini(uploaded_files) -> List[Any]:
-    """Faz upload de cada arquivo (PDF/DOCX) para a Files API e retorna os handles."""
-    refs = []
-    pb = st.progress(0, text="Enviando arquivos para o Gemini (Files API)…")
-    for i, f in enumerate(uploaded_files, start=1):
-        with tempfile.TemporaryDirectory() as td:
-            p = Path(td) / f.name
-            p.write_bytes(f.getvalue())
-            up = client.files.upload(file=p)  # Files API (armazenamento temporário)
-            refs.append(up)
-        pb.progress(int(i * 100 / len(uploaded_files)), text=f"Enviado: {f.name}")
-    pb.empty()
-    return refs
-
-def _call_gemini(files_refs) -> dict:
+FILES_SCHEMA = {
+  "type": "OBJECT",
+  "required": ["files"],
+  "properties": {"files": REURB_SCHEMA["properties"]["files"]},
+}
+
+REDUCE_SCHEMA = {
+  "type": "OBJECT",
+  "required": ["missing_documents"],
+  "properties": {
+    "likely_modality": REURB_SCHEMA["properties"]["likely_modality"],
+    "missing_documents": REURB_SCHEMA["properties"]["missing_documents"],
+  },
+}
+
+CLASSIFY_PROMPT = (
+    "Nesta etapa, faça apenas as tarefas 1 a 3 para cada arquivo enviado e retorne SOMENTE "
+    "o objeto JSON com a chave \"files\", usando exatamente estes nomes em file_name, na ordem:\n{names}"
+)
+
+REDUCE_PROMPT = (
+    "Os arquivos do dossiê já foram classificados (tarefas 1 a 3); segue o JSON de \"files\":\n{files}\n\n"
+    "Com base apenas nele, faça a tarefa 4 e retorne SOMENTE o JSON com \"likely_modality\" e \"missing_documents\"."
+)
+
+# muda junto com modelo/prompt/schema: análises antigas deixam de valer
+PROMPT_KEY = hashlib.sha256(
+    json.dumps(
+        [GEMINI_MODEL, SYSTEM_PROMPT, CLASSIFY_PROMPT, FILES_SCHEMA, MAX_TEXT_CHARS, OCR_MAX_PAGES],
+        ensure_ascii=False,
+    ).encode("utf-8")
+).hexdigest()[:16]
+
+
+def _sha256(f) -> str:
+    return hashlib.sha256(f.getvalue()).hexdigest()
+
+
+def _upload_one(name: str, data: bytes, mime: str, sha: str) -> Any:
+    """
+    Part do arquivo para o generate_content: reaproveita o handle da Files API
+    enquanto ele não expira; senão envia direto do buffer em memória (sem disco),
+    com até UPLOAD_RETRIES tentativas.
     """
-    Chama o modelo com Files API + system_instruction via config,
-    e força retorno em JSON usando response_schema.
+    cached = _cache.get_handle(sha)
+    if cached:
+        return types.Part.from_uri(file_uri=cached["uri"], mime_type=cached["mime_type"])
+    for attempt in range(UPLOAD_RETRIES):
+        try:
+            up = client.files.upload(  # Files API (armazenamento temporário)
+                file=io.BytesIO(data),
+                config=types.UploadFileConfig(mime_type=mime, display_name=name),
+            )
+            break
+        except Exception:
+            if attempt == UPLOAD_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)  # 1s, 2s, ...
+    # a Files API guarda os arquivos por 48h
+    expires = up.expiration_time.timestamp() if getattr(up, "expiration_time", None) else time.time() + 47 * 3600
+    _cache.put_handle(sha, up.name, up.uri, up.mime_type or mime, expires)
+    return up
+
+
+def _prepare_files(files: List[Any], shas: List[str]) -> List[Dict[str, Any]]:
     """
-    # Dica: inclua um prompt curto no contents (além do system_instruction) para “ancorar” a intenção do usuário
-    user_prompt = "Analise os arquivos conforme as instruções do sistema e retorne SOMENTE o JSON solicitado."
-
-    resp = client.models.generate_content(
-        model=GEMINI_MODEL,  # ex.: "gemini-2.0-flash" / "gemini-2.5-flash"
-        contents=[user_prompt, *files_refs],  # texto + arquivos (padrão do SDK)
-        config=types.GenerateContentConfig(
-            system_instruction=SYSTEM_PROMPT,                 # << aqui é o lugar certo
-            response_mime_type="application/json",           # força JSON puro
-            response_schema=REURB_SCHEMA,                    # estrutura esperada
-            temperature=0,                                   # (opcional) deixar mais determinístico
-            max_output_tokens=2048,                          # (opcional) se a saída for longa
-        ),
+    Extrai o texto de cada página localmente (em processos) e monta o que vai ao
+    modelo por arquivo: o texto das páginas que têm texto (até MAX_TEXT_CHARS,
+    sem páginas vazias ou repetidas) e um PDF só com as primeiras OCR_MAX_PAGES
+    páginas digitalizadas. O que não pôde ser extraído vai inteiro, como antes.
+    """
+    extracted = doc_extract.extract_documents(
+        [{"name": f.name, "data": f.getvalue()} for f in files], max_workers=EXTRACT_WORKERS
+    )
+    items = []
+    for f, sha, pages in zip(files, shas, extracted):
+        data = f.getvalue()
+        item = {"name": f.name, "sha": sha, "text": "", "upload": None, "bytes_in": len(data)}
+        image_pages = [p["page"] for p in (pages or []) if p["kind"] == "imagem"]
+        is_pdf = data[:5] == b"%PDF-"
+        if pages is None or (image_pages and not is_pdf):
+            # sem extração (ou DOCX só com imagens): manda o arquivo original
+            mime = getattr(f, "type", None) or mimetypes.guess_type(f.name)[0] or "application/octet-stream"
+            item["upload"] = {"data": data, "mime": mime, "sha": sha}
+            item.update(pages=None, text_pages=None, image_pages=None, sent_pages=None,
+                        bytes_out=len(data), tokens=None)
+            items.append(item)
+            continue
+        chunks, seen, used, text_pages = [], set(), 0, 0
+        for p in pages:
+            if p["kind"] != "texto" or p["text"] in seen or used >= MAX_TEXT_CHARS:
+                continue
+            seen.add(p["text"])
+            chunk = f"[p. {p['page']}] {p['text'][:MAX_TEXT_CHARS - used]}"
+            chunks.append(chunk)
+            used += len(chunk)
+            text_pages += 1
+        item["text"] = "\n".join(chunks)
+        ocr_pages = image_pages[:OCR_MAX_PAGES]
+        if ocr_pages:
+            pdf = doc_extract.pdf_subset(data, ocr_pages)
+            item["upload"] = {"data": pdf, "mime": "application/pdf", "sha": hashlib.sha256(pdf).hexdigest()}
+        item.update(
+            pages=len(pages), text_pages=text_pages, image_pages=len(image_pages),
+            sent_pages=text_pages + len(ocr_pages),
+            bytes_out=len(item["text"].encode("utf-8")) + (len(item["upload"]["data"]) if item["upload"] else 0),
+            tokens=doc_extract.estimate_tokens(item["text"], len(ocr_pages)),
+        )
+        items.append(item)
+    return items
+
+
+def _show_payload(items: List[Dict[str, Any]]):
+    """Tamanho e tokens estimados do que vai ser enviado, antes das chamadas."""
+    df = pd.DataFrame([
+        {
+            "Arquivo": it["name"],
+            "Páginas": it["pages"],
+            "Com texto": it["text_pages"],
+            "Só imagem": it["image_pages"],
+            "Enviadas": it["sent_pages"],
+            "Original (KB)": round(it["bytes_in"] / 1024, 1),
+            "Enviado (KB)": round(it["bytes_out"] / 1024, 1),
+            "Tokens (est.)": it["tokens"],
+        }
+        for it in items
+    ]).astype({"Páginas": "Int64", "Com texto": "Int64", "Só imagem": "Int64", "Enviadas": "Int64", "Tokens (est.)": "Int64"})
+    st.dataframe(df, use_container_width=True, hide_index=True)
+    known = [it["tokens"] for it in items if it["tokens"] is not None]
+    st.caption(
+        f"Envio: {sum(it['bytes_out'] for it in items) / 1024:.0f} KB de "
+        f"{sum(it['bytes_in'] for it in items) / 1024:.0f} KB originais · "
+        f"~{sum(known):,} tokens de entrada estimados".replace(",", ".")
+        + (f" (+{len(items) - len(known)} arquivo(s) enviado(s) inteiro(s))" if len(known) < len(items) else "")
     )
 
-    text = _resp_to_text(resp)      # seu helper de extração continua valendo
-    return _extract_json(text) 
+
+def _generate_json(
+    contents: List[Any],
+    schema: Dict[str, Any],
+    max_output_tokens: int = 2048,
+    key: Optional[str] = None,
+    on_item: Optional[Callable[[Any], None]] = None,
+) -> dict:
+    """
+    generate_content com system_instruction e retorno forçado em JSON (response_schema).
+    Com `key`/`on_item`, chama on_item para cada item do array `key` da resposta:
+    em streaming, assim que o item fecha; senão, no fim. O retorno é sempre o JSON completo.
+    """
+    config = types.GenerateContentConfig(
+        system_instruction=SYSTEM_PROMPT,                 # << aqui é o lugar certo
+        response_mime_type="application/json",           # força JSON puro
+        response_schema=schema,                          # estrutura esperada
+        temperature=0,                                   # (opcional) deixar mais determinístico
+        max_output_tokens=max_output_tokens,             # (opcional) se a saída for longa
+    )
+    if not STREAM_RESPONSES:
+        resp = client.models.generate_content(
+            model=GEMINI_MODEL,  # ex.: "gemini-2.0-flash" / "gemini-2.5-flash"
+            contents=contents,  # texto + arquivos (padrão do SDK)
+            config=config,
+        )
+        data = _extract_json(_resp_to_text(resp))      # seu helper de extração continua valendo
+        if key and on_item:
+            for item in data.get(key) or []:
+                on_item(item)
+        return data
+    parser = JsonArrayStream(key) if key and on_item else None
+    chunks = []
+    for chunk in client.models.generate_content_stream(model=GEMINI_MODEL, contents=contents, config=config):
+        text = getattr(chunk, "text", None) or ""
+        if not text:
+            continue
+        chunks.append(text)
+        if parser:
+            for item in parser.feed(text):
+                on_item(item)
+    if not "".join(chunks).strip():
+        raise ValueError("Modelo não retornou texto para análise.")
+    return _extract_json("".join(chunks))
+
+
+def _file_parts(item: Dict[str, Any], ref: Any) -> List[Any]:
+    """Conteúdo de um arquivo no lote: cabeçalho com o nome, texto extraído e o PDF/arquivo enviado."""
+    head = f"=== Arquivo: {item['name']} ==="
+    if item["upload"] is None or item["text"]:
+        head += "\n" + (item["text"] or "(sem texto extraível)")
+    return [head] + ([ref] if ref is not None else [])
+
+
+def _classify_files(
+    names: List[str],
+    parts: List[Any],
+    on_entry: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Tarefas 1–3 só para estes arquivos; uma entrada de `files` por arquivo, na ordem
+    de `names`. `on_entry(posição, entrada)` recebe cada entrada assim que ela chega.
+    """
+    prompt = CLASSIFY_PROMPT.format(names="\n".join(f"{i}) {n}" for i, n in enumerate(names, start=1)))
+    max_tokens = min(MAX_OUTPUT_TOKENS, CLASSIFY_TOKENS_PER_FILE * len(names))
+    arrived = []
+
+    def on_item(entry):
+        if not on_entry or not isinstance(entry, dict):
+            return
+        # casa pelo nome; se o modelo alterou o nome, pela ordem de chegada
+        pos = names.index(entry.get("file_name")) if entry.get("file_name") in names else len(arrived)
+        arrived.append(pos)
+        if pos < len(names):
+            on_entry(pos, entry)
+
+    data = _generate_json([prompt, *parts], FILES_SCHEMA, max_tokens, key="files", on_item=on_item)
+    entries = data.get("files", []) or []
+    by_name = {e.get("file_name"): e for e in entries}
+    out = []
+    for i, name in enumerate(names):
+        # casa pelo nome; se o modelo alterou o nome, pela posição
+        entry = by_name.get(name) or (entries[i] if len(entries) == len(names) else None)
+        out.append(entry)
+    return out
+
+
+def _classify_batch(
+    batch: List[Dict[str, Any]],
+    retry: bool = True,
+    on_entry: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+) -> Tuple[List[Optional[Dict[str, Any]]], List[str]]:
+    """
+    Map: envia em paralelo o que cada arquivo do lote precisa (reaproveitando
+    handles) e classifica todos numa chamada. Se a chamada falhar, reenvia uma vez (o handle
+    pode ter sumido da Files API) e, se falhar de novo, divide o lote ao meio, para
+    que um arquivo problemático não derrube os outros. Roda em thread de trabalho,
+    então não chama st.*: devolve (entradas na ordem do lote, mensagens de erro);
+    `on_entry(posição no lote, entrada)` recebe as entradas parciais do streaming.
+    """
+    entries: List[Optional[Dict[str, Any]]] = [None] * len(batch)
+    errors: List[str] = []
+    sent = []
+    uploads = [k for k, item in enumerate(batch) if item["upload"]]
+    futures = {}
+    if uploads:
+        with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(uploads))) as pool:
+            by_sha = {}  # conteúdo repetido no lote é enviado uma vez só
+            for k in uploads:
+                up = batch[k]["upload"]
+                if up["sha"] not in by_sha:
+                    by_sha[up["sha"]] = pool.submit(_upload_one, batch[k]["name"], up["data"], up["mime"], up["sha"])
+                futures[k] = by_sha[up["sha"]]
+    for k, item in enumerate(batch):
+        try:
+            sent.append((k, futures[k].result() if k in futures else None))
+        except Exception as e:
+            errors.append(f"Não foi possível enviar {item['name']}: {e}")
+    if not sent:
+        return entries, errors
+    try:
+        parts = [part for k, ref in sent for part in _file_parts(batch[k], ref)]
+        result = _classify_files(
+            [batch[k]["name"] for k, _ in sent], parts,
+            (lambda pos, entry: on_entry(sent[pos][0], entry)) if on_entry else None,
+        )
+        for (k, _), entry in zip(sent, result):
+            entries[k] = entry
+        return entries, errors
+    except Exception as e:
+        if retry:
+            for k, _ in sent:
+                if batch[k]["upload"]:
+                    _cache.drop_handle(batch[k]["upload"]["sha"])
+            halves = [[k for k, _ in sent]]
+        elif len(sent) > 1:
+            half = len(sent) // 2
+            halves = [[k for k, _ in sent[:half]], [k for k, _ in sent[half:]]]
+        else:
+            errors.append(f"Não foi possível classificar {batch[sent[0][0]]['name']}: {e}")
+            return entries, errors
+    for part in halves:
+        sub, sub_errors = _classify_batch(
+            [batch[k] for k in part], retry=False,
+            on_entry=(lambda pos, entry, part=part: on_entry(part[pos], entry)) if on_entry else None,
+        )
+        for k, entry in zip(part, sub):
+            entries[k] = entry
+        errors.extend(sub_errors)
+    return entries, errors
+
+
+def _summary(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Resumo compacto de uma entrada de `files` para a consolidação (sem `notes`)."""
+    fields = {
+        k: str(v)[:SUMMARY_VALUE_CHARS]
+        for k, v in (entry.get("key_fields") or {}).items()
+        if v not in (None, "", [], {})
+    }
+    return {
+        "file_name": entry.get("file_name"),
+        "detected_type": entry.get("detected_type"),
+        "confidence": entry.get("confidence"),
+        "relevant_for_reurb": entry.get("relevant_for_reurb"),
+        "key_fields": fields,
+    }
+
+
+def _reduce_analysis(files: List[Dict[str, Any]], on_missing: Optional[Callable[[Dict[str, Any]], None]] = None) -> dict:
+    """
+    Reduce: tarefa 4 sobre o resumo das entradas já classificadas (sem reenviar os
+    arquivos). `on_missing` recebe cada documento faltante assim que ele chega.
+    """
+    summaries = [_summary(f) for f in files]
+    prompt = REDUCE_PROMPT.format(files=json.dumps(summaries, ensure_ascii=False, separators=(",", ":")))
+    return _generate_json([prompt], REDUCE_SCHEMA, MAX_OUTPUT_TOKENS, key="missing_documents", on_item=on_missing)
+
+
+FILES_VIEW_COLUMNS = ["arquivo", "tipo", "confidence_pct", "relevante", "notas"]
+FILES_COLUMN_CONFIG = {
+    "arquivo": st.column_config.TextColumn("Arquivo"),
+    "tipo": st.column_config.TextColumn("Tipo detectado"),
+    "confidence_pct": st.column_config.ProgressColumn(
+        "Confiança (%)", min_value=0, max_value=100, format="%d%%"
+    ),
+    "relevante": st.column_config.CheckboxColumn("Relevante p/ REURB"),
+    "notas": st.column_config.TextColumn("Notas"),
+}
+MISSING_VIEW_COLUMNS = ["Documento", "Prioridade", "Base legal", "Por que necessário"]
+
+
+def _files_frame(files: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Entradas de `files` com as colunas de exibição (arquivo, tipo, confiança %, relevante, notas)."""
+    df = pd.DataFrame(files)
+    for col in ("file_name", "detected_type", "confidence", "relevant_for_reurb", "key_fields", "notes"):
+        if col not in df:
+            df[col] = None
+    df["confidence_pct"] = (pd.to_numeric(df["confidence"], errors="coerce").fillna(0.0) * 100).round(0)
+    df["relevante"] = df["relevant_for_reurb"].fillna(False).astype(bool)
+    df["tipo"] = df["detected_type"].fillna("—")
+    df["arquivo"] = df["file_name"].fillna("—")
+    df["notas"] = df["notes"].fillna("")
+    return df
+
+
+def _missing_frame(missing: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Documentos faltantes com prioridade rotulada e colunas em português."""
+    miss_df = pd.DataFrame(missing)
+    for col in ("name", "why_needed", "legal_basis", "priority"):
+        if col not in miss_df:
+            miss_df[col] = None
+    miss_df["priority"] = (
+        miss_df["priority"]
+        .fillna("")
+        .str.lower()
+        .map({"alta": "Alta 🔴", "média": "Média 🟡", "media": "Média 🟡", "baixa": "Baixa 🟢"})
+        .fillna("—")
+    )
+    miss_df["legal_basis"] = miss_df["legal_basis"].fillna("—")
+    return miss_df.rename(
+        columns={
+            "name": "Documento",
+            "why_needed": "Por que necessário",
+            "legal_basis": "Base legal",
+            "priority": "Prioridade",
+        },
+    )
+
+
+def _render_live(box, files: List[Dict[str, Any]], missing: Optional[List[Dict[str, Any]]] = None):
+    """Tabela de arquivos e checklist parciais, redesenhados a cada entrada que chega do modelo."""
+    with box.container():
+        st.subheader("Arquivos analisados")
+        st.dataframe(
+            _files_frame(files)[FILES_VIEW_COLUMNS],
+            use_container_width=True,
+            hide_index=True,
+            column_config=FILES_COLUMN_CONFIG,
+        )
+        if missing is not None:
+            st.subheader("Checklist de documentos faltantes")
+            if missing:
+                st.dataframe(
+                    _missing_frame(missing)[MISSING_VIEW_COLUMNS],
+                    use_container_width=True,
+                    hide_index=True,
+                )
+
+
+def _analyze(uploaded_files, status, live=None) -> dict:
+    """
+    Classifica (e envia) só os arquivos cujo SHA-256 ainda não tem análise em
+    cache, em lotes paralelos, e monta modalidade/faltantes a partir de todas as
+    entradas. Arquivos que falham são avisados e ficam de fora do dossiê. Se
+    `live` (um st.empty) for passado, as entradas aparecem nele conforme chegam.
+    """
+    files = list(uploaded_files)
+    shas = [_sha256(f) for f in files]
+    cached = _cache.get_analyses(shas, PROMPT_KEY)
+    # o mesmo conteúdo enviado duas vezes só é classificado uma vez
+    new, seen = [], set()
+    for i, sha in enumerate(shas):
+        if sha not in cached and sha not in seen:
+            seen.add(sha)
+            new.append(i)
+
+    def current(streamed=None):
+        streamed = streamed or {}
+        return [
+            {**(cached.get(sha) or streamed[sha]), "file_name": f.name}
+            for f, sha in zip(files, shas) if sha in cached or sha in streamed
+        ]
+
+    if live is not None and cached:
+        _render_live(live, current())
+    if new:
+        status.update(label=f"Extraindo texto de {len(new)} arquivo(s) novo(s)…")
+        items = dict(zip(new, _prepare_files([files[i] for i in new], [shas[i] for i in new])))
+        _show_payload(list(items.values()))
+        batches = [new[k:k + CLASSIFY_BATCH_SIZE] for k in range(0, len(new), CLASSIFY_BATCH_SIZE)]
+        status.update(label=f"Classificando {len(new)} arquivo(s) novo(s) em {len(batches)} lote(s) "
+                            f"({len(files) - len(new)} já analisado(s))…")
+        # as threads dos lotes não podem chamar st.*: as entradas parciais passam pela fila
+        events: "queue.Queue[Tuple[int, Dict[str, Any]]]" = queue.Queue()
+        streamed: Dict[str, Dict[str, Any]] = {}
+        with ThreadPoolExecutor(max_workers=min(CLASSIFY_WORKERS, len(batches))) as pool:
+            futures = {
+                pool.submit(
+                    _classify_batch, [items[i] for i in b], True,
+                    lambda k, entry, b=b: events.put((b[k], entry)),
+                ): b
+                for b in batches
+            }
+            pending, done = set(futures), 0
+            while pending:
+                finished, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                changed = False
+                while not events.empty():
+                    i, entry = events.get_nowait()
+                    streamed[shas[i]] = entry
+                    changed = True
+                for fut in finished:
+                    done += 1
+                    batch = futures[fut]
+                    entries, errors = fut.result()
+                    for i, entry in zip(batch, entries):
+                        streamed.pop(shas[i], None)
+                        if entry:
+                            _cache.put_analysis(shas[i], PROMPT_KEY, entry)
+                            cached[shas[i]] = entry
+                        elif not any(files[i].name in err for err in errors):
+                            errors.append(f"O modelo não retornou a análise de {files[i].name}.")
+                    for err in errors:
+                        st.warning(err)
+                    status.update(label=f"Classificados {done}/{len(batches)} lote(s)…")
+                    changed = True
+                if live is not None and changed:
+                    _render_live(live, current(streamed))
+    merged = current()
+    if not merged:
+        raise RuntimeError("Nenhum arquivo pôde ser analisado.")
+    status.update(label="Consolidando modalidade e documentos faltantes…")
+    missing: List[Dict[str, Any]] = []
+
+    def on_missing(doc):
+        if isinstance(doc, dict):
+            missing.append(doc)
+            if live is not None:
+                _render_live(live, merged, missing=missing)
+
+    summary = _reduce_analysis(merged, on_missing)
+    return {
+        "files": merged,
+        "likely_modality": summary.get("likely_modality"),
+        "missing_documents": summary.get("missing_documents", []) or [],
+    }
+
 
 def _build_dashboard(payload: Dict[str, Any]):
     """Monta o dashboard completo a partir do JSON."""
@@ -257,16 +726,11 @@ def _build_dashboard(payload: Dict[str, Any]):
     # --------- Arquivos analisados ----------
     with tab_files:
         st.subheader("Arquivos analisados")
-        df = pd.DataFrame(files)
+        df = _files_frame(files)
         if df.empty:
             st.info("Sem arquivos para exibir.")
         else:
-            df["confidence_pct"] = (df.get("confidence", 0.0).fillna(0.0) * 100).round(0)
-            df["relevante"] = df.get("relevant_for_reurb", False).fillna(False)
-            df["tipo"] = df.get("detected_type").fillna("—")
-            df["arquivo"] = df.get("file_name").fillna("—")
-            df["notas"] = df.get("notes").fillna("")
-            key_fields_text = df.get("key_fields").apply(
+            key_fields_text = df["key_fields"].apply(
                 lambda x: json.dumps(x, ensure_ascii=False) if isinstance(x, dict) else ""
             ).fillna("")
 
@@ -295,22 +759,14 @@ def _build_dashboard(payload: Dict[str, Any]):
                     | key_fields_text.str.lower().str.contains(t)
                 )
 
-            view = df.loc[mask, ["arquivo", "tipo", "confidence_pct", "relevante", "notas"]].reset_index(drop=True)
+            view = df.loc[mask, FILES_VIEW_COLUMNS].reset_index(drop=True)
 
             # Tabela com barra de progresso de confiança (ProgressColumn) :contentReference[oaicite:3]{index=3}
             st.dataframe(
                 view,
                 use_container_width=True,
                 hide_index=True,
-                column_config={
-                    "arquivo": st.column_config.TextColumn("Arquivo"),
-                    "tipo": st.column_config.TextColumn("Tipo detectado"),
-                    "confidence_pct": st.column_config.ProgressColumn(
-                        "Confiança (%)", min_value=0, max_value=100, format="%d%%"
-                    ),
-                    "relevante": st.column_config.CheckboxColumn("Relevante p/ REURB"),
-                    "notas": st.column_config.TextColumn("Notas"),
-                },
+                column_config=FILES_COLUMN_CONFIG,
             )
 
             # Expanders com key_fields
@@ -341,31 +797,14 @@ def _build_dashboard(payload: Dict[str, Any]):
         if not missing:
             st.success("Nenhum documento faltante listado pelo modelo.")
         else:
-            miss_df = pd.DataFrame(missing)
-            miss_df["priority"] = (
-                miss_df.get("priority", "")
-                .fillna("")
-                .str.lower()
-                .map({"alta": "Alta 🔴", "média": "Média 🟡", "media": "Média 🟡", "baixa": "Baixa 🟢"})
-                .fillna("—")
-            )
-            miss_df["legal_basis"] = miss_df.get("legal_basis").fillna("—")
-            miss_df.rename(
-                columns={
-                    "name": "Documento",
-                    "why_needed": "Por que necessário",
-                    "legal_basis": "Base legal",
-                    "priority": "Prioridade",
-                },
-                inplace=True,
-            )
+            miss_df = _missing_frame(missing)
 
             prioridades = ["Alta 🔴", "Média 🟡", "Baixa 🟢", "—"]
             sel_prior = st.multiselect("Prioridades", prioridades, default=prioridades[:-1])
             miss_view = miss_df[miss_df["Prioridade"].isin(sel_prior)]
 
             st.dataframe(
-                miss_view[["Documento", "Prioridade", "Base legal", "Por que necessário"]],
+                miss_view[MISSING_VIEW_COLUMNS],
                 use_container_width=True,
                 hide_index=True,
             )
@@ -408,20 +847,19 @@ if not ready_to_analyze:
 else:
     # Botão para disparar a análise
     if st.button("Analisar no Gemini", type="primary"):
-        # 1) Upload dos arquivos
-        with st.status("1/2 — Enviando arquivos…", expanded=False) as s1:
-            refs = _upload_files_to_gemini(uploaded_files)
-            s1.update(label="Upload concluído", state="complete")
-
-        # 2) Chamada ao modelo
-        with st.status("2/2 — Gerando análise com Gemini…", expanded=False) as s2:
+        # 1) Upload e classificação só do que mudou; 2) consolidação do dossiê
+        s1 = st.status("Analisando documentos com Gemini…", expanded=False)
+        live = st.empty()  # tabela/checklist parciais enquanto o modelo responde
+        with s1:
             try:
-                payload = _call_gemini(refs)  # generate_content + parse JSON
+                payload = _analyze(uploaded_files, s1, live)
             except Exception as e:
+                s1.update(label="Falha na análise", state="error")
                 st.error("Falha ao obter/interpretar a resposta do modelo.")
                 st.exception(e)
                 st.stop()
-            s2.update(label="Análise concluída", state="complete")
+            s1.update(label="Análise concluída", state="complete")
+        live.empty()  # o dashboard completo abaixo substitui a prévia
 
         # 3) Persistir e renderizar dashboard
         st.session_state["gemini_payload"] = payload
@@ -1,15 +1,15 @@
-from utils import algorithms, worksheets, assertiva
+from utils import algorithms, worksheets, assertiva, campaigns
+from utils.templates import MessageTemplate, TemplateError
 from supabase import create_client
-from utils import whatsapp as wpp
 import streamlit as st
-from io import BytesIO
+from datetime import datetime
 import pandas as pd
-import random
 import time
 import uuid
 
 
 BUCKET = "planilhas"
+SHEETS_PAGE_SIZES = (10, 25, 50, 100)
 
 auth_ok = bool(st.secrets["connections"]["supabase"]["SUPABASE_URL"] and st.secrets["connections"]["supabase"]["SUPABASE_KEY"])
 client = create_client(st.secrets["connections"]["supabase"]["SUPABASE_URL"], st.secrets["connections"]["supabase"]["SUPABASE_KEY"]) if auth_ok else None
@@ -27,6 +27,15 @@ def load_ultramsg_env():
     st.session_state["ultramsg_vars"] = ultramsg_vars
 
 
+def _files_frame(files: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        "Nome": [f["name"] for f in files],
+        "Tamanho (KB)": [f["size"] / 1024 if f.get("size") is not None else None for f in files],
+        "Linhas": pd.array([f.get("rows") for f in files], dtype="Int64"),
+        "Atualização": pd.to_datetime([f.get("updated_at") for f in files], utc=True, format="ISO8601"),
+    })
+
+
 @st.fragment
 def download_button(name: str):
     if f'gen_down_btn_{name}' in st.session_state and st.session_state[f'gen_down_btn_{name}']:
@@ -87,9 +96,11 @@ def wpp_button(name: str):
         help="Disparar para o WhatsApp",
         icon=":material/send:"
     ):
-        df = worksheets.worksheet_to_df(name)
+        df, revision = worksheets.load_worksheet(name)
         st.session_state.show_wpp_view = True
         st.session_state.df_wpp = df
+        st.session_state.df_wpp_base = df
+        st.session_state.df_wpp_revision = revision
         st.session_state.df_name = name
         st.rerun(scope='app')
 
@@ -124,236 +135,349 @@ def show_upload_dialog():
             st.rerun(scope='app')
 
 
+def _detected_columns(df: pd.DataFrame) -> dict:
+    # impressão digital recalculada só quando df_wpp é substituído; a detecção, só quando o conteúdo muda
+    fingerprint = st.session_state.get('df_wpp_fingerprint')
+    if fingerprint is None or fingerprint[0] is not df:
+        fingerprint = (df, algorithms.dataframe_fingerprint(df))
+        st.session_state['df_wpp_fingerprint'] = fingerprint
+    return algorithms.detect_columns_cached(
+        df,
+        kinds=("doc", "phone"),
+        fingerprint=fingerprint[1],
+        memo=st.session_state.setdefault('column_detections', {})
+    )
+
+
 @st.fragment
 def render_whatsapp_fragment():
-    if 'sending_msgs' in st.session_state and st.session_state['sending_msgs']:
-        if st.button(
-            "❌ Cancelar",
-            key=f"cancel_btn_worksheet_{st.session_state['df_name']}",
-            help='Cancelar disparo de mensagens no WhatsApp',
-            type='secondary'
-        ):
-            st.session_state['sending_msgs'] = False
-            st.rerun(scope='fragment')
-        st.subheader("📲 Disparando mensagens no WhatsApp...")
-        len_sending_subset = len(st.session_state['sending_subset'])
-        progress = st.progress(0, f"0% (0/{len_sending_subset})")
-        # placeholder_container = st.empty()
-        for i, row in st.session_state['sending_subset'].iterrows():
-            perfil = random.choice(list(st.secrets["ultramsg"].keys()))
-            token = st.secrets["ultramsg"][perfil]["TOKEN"]
-            response = wpp.send_wpp_msg(row["mensagem"], str(row[st.session_state['sending_col_name_dest']]), token)
-            try:
-                progress.progress((i + 1) / len_sending_subset, f"{(i + 1) / len_sending_subset * 100:.2f}% ({i + 1}/{len_sending_subset})")
-                # with placeholder_container.container():
-                #     if response["sent"] == "true":
-                #         st.success(f"Mensagem enviada para \"{row[st.session_state['sending_col_name_dest']]}\" ✅")
-                #     else:
-                #         st.error(f"Mensagem não enviada para \"{row[st.session_state['sending_col_name_dest']]}\" ❌")
-            except Exception as e:
-                pass
-                # with placeholder_container.container():
-                #     st.write(f"Mensagem não enviada para \"{row[st.session_state['sending_col_name_dest']]}\" ❌")
-                #     st.error(f"Ocorreu o erro: {e}")
-            if i < len_sending_subset - 1:
-                r = random.randint(st.session_state['sending_start_secs_select'], st.session_state['sending_end_secs_select'])
-                # with placeholder_container.container():
-                #    st.info(f"Aguardando {r} segundo(s) para o próximo disparo...")
-                time.sleep(r)
-               # placeholder_container.empty()
-        st.session_state['sending_msgs'] = False
-    else:
-        if st.button(
-            "↩️ Voltar",
-            key=f"back_btn_worksheet_{st.session_state['df_name']}",
-            help='Voltar para gerenciamento de planilhas',
-            type='tertiary'
-        ):
-            st.session_state['show_wpp_view'] = False
-            st.session_state['df_wpp'] = None
-            st.session_state['df_name'] = None
+    if st.button(
+        "↩️ Voltar",
+        key=f"back_btn_worksheet_{st.session_state['df_name']}",
+        help='Voltar para gerenciamento de planilhas',
+        type='tertiary'
+    ):
+        st.session_state['show_wpp_view'] = False
+        st.session_state['df_wpp'] = None
+        st.session_state['df_wpp_base'] = None
+        st.session_state['df_wpp_revision'] = None
+        st.session_state['df_wpp_fingerprint'] = None
+        st.session_state['df_name'] = None
+        st.session_state['assertiva_edited'] = False
+        st.session_state['assertiva_summary'] = None
+        st.rerun(scope='app')
+    if "df_wpp" in st.session_state and type(st.session_state['df_wpp']) is pd.DataFrame:
+        if "assertiva_edited" not in st.session_state:
             st.session_state['assertiva_edited'] = False
-            st.rerun(scope='app')
-        if "df_wpp" in st.session_state and type(st.session_state['df_wpp']) is pd.DataFrame:
-            if "assertiva_edited" not in st.session_state:
-                st.session_state['assertiva_edited'] = False
-            worksheet_tab, message_tab, lines_tab, time_tab, phone_tab, start_tab = st.tabs(['Planilha', 'Mensagem', 'Linhas', 'Intervalo', 'Telefone', 'Iniciar'])
-            with worksheet_tab:
-                with st.container(key='worksheet_container_key', border=True):
-                    st.subheader(f"📊 Planilha {st.session_state['df_name']}")
-                    st.info("Revise a sua planilha antes de disparar. Quando estiver pronto, passe para a próxima aba ➡️.")
-                    cols = st.session_state['df_wpp'].columns.tolist()
-                    may_access, msg = assertiva.check_assertiva_access()
-                    col_name_col, search_assertiva_col = st.columns([3, 1], vertical_alignment="bottom")
-                    detected_doc_col = algorithms.detect_polo_passivo_doc_column(st.session_state['df_wpp'])[0]
-                    with col_name_col:
-                        col_name = st.selectbox(
-                            'Nome da coluna',
-                            options=cols,
-                            index=cols.index(detected_doc_col) if detected_doc_col in cols else 0,
-                            key="col_name_assertiva_key",
-                            help="Selecione a coluna que contém os nomes completos" if may_access else msg,
-                            disabled=not may_access
-                        )
-                    with search_assertiva_col:
-                        search_assertiva = st.button(
-                            "🔍 Buscar Telefone",
-                            key="search_assertiva_btn_key",
-                            help="Buscar telefone mais recente usando Assertiva" if may_access else msg,
-                            disabled=not may_access
-                        )
-                        if search_assertiva:
-                            st.session_state['getting_phones_assertiva'] = True
-                            st.session_state['column_getting_phones_assertiva'] = col_name
-                            st.rerun(scope='fragment')
-                    if 'getting_phones_assertiva' in st.session_state and st.session_state['getting_phones_assertiva']:
-                        with st.status("Consultando Assertiva..."):
-                            phones_list = []
-                            for i, valor_column in enumerate(st.session_state['df_wpp'][st.session_state['column_getting_phones_assertiva']].tolist()):
-                                try:
-                                    result = assertiva.get_best_whatsapp_phone(valor_column)
-                                    phone_e164 = result["e164"] if result else None
-                                except Exception as e:
-                                    with st.container(key=f"getting_assertiva_phones_{i}_{str(valor_column)}", border=True):
-                                        st.write(f"Erro ao buscar telefone de \"{valor_column}\".")
-                                        st.error(e)
-                                        phones_list.append('')
-                                else:
-                                    phones_list.append(phone_e164)
-                            st.session_state["df_wpp"][f"Telefone {st.session_state['column_getting_phones_assertiva']}"] = pd.Series(phones_list)
-                            st.session_state['assertiva_edited'] = True
-                            st.session_state['getting_phones_assertiva'] = False
-                            st.rerun(scope='fragment')
-                    df_edited = st.data_editor(
-                        st.session_state['df_wpp'],
-                        key=f"data_editor_{st.session_state['df_name']}",
-                        use_container_width=True,
-                        hide_index=True,
-                        num_rows="dynamic",
-                        disabled='getting_phones_assertiva' in st.session_state and st.session_state['getting_phones_assertiva']
+        detected = _detected_columns(st.session_state['df_wpp'])
+        worksheet_tab, message_tab, lines_tab, time_tab, phone_tab, start_tab = st.tabs(['Planilha', 'Mensagem', 'Linhas', 'Intervalo', 'Telefone', 'Iniciar'])
+        with worksheet_tab:
+            with st.container(key='worksheet_container_key', border=True):
+                st.subheader(f"📊 Planilha {st.session_state['df_name']}")
+                st.info("Revise a sua planilha antes de disparar. Quando estiver pronto, passe para a próxima aba ➡️.")
+                cols = st.session_state['df_wpp'].columns.tolist()
+                may_access, msg = assertiva.check_assertiva_access()
+                col_name_col, search_assertiva_col = st.columns([3, 1], vertical_alignment="bottom")
+                detected_doc_col = detected["doc"][0]
+                with col_name_col:
+                    col_name = st.selectbox(
+                        'Nome da coluna',
+                        options=cols,
+                        index=cols.index(detected_doc_col) if detected_doc_col in cols else 0,
+                        key="col_name_assertiva_key",
+                        help="Selecione a coluna que contém os nomes completos" if may_access else msg,
+                        disabled=not may_access
                     )
-                    if st.button(
-                        "Salvar Alterações",
-                        key=f"save_button_{st.session_state['df_name']}",
-                        disabled=df_edited.equals(st.session_state['df_wpp']) and not st.session_state['assertiva_edited']
-                    ):
-                        try:
-                            buf = BytesIO()
-                            if st.session_state['df_name'].lower().endswith((".xlsx", ".xls")):
-                                df_edited.to_excel(buf, index=False)
-                            else:
-                                df_edited.to_csv(buf, index=False)
-                            buf.name = st.session_state['df_name']
-                            worksheets.delete_cloud_file(st.session_state['df_name'])
-                            if worksheets.upload_to_cloud(buf):
-                                st.success(f"Alterações salvas em {st.session_state['df_name']}!")
-                                st.session_state['df_wpp'] = df_edited
-                                st.session_state['assertiva_edited'] = False
-                                st.rerun(scope="app")
-                        except Exception as e:
-                            st.error(f"Erro ao salvar alterações: {e}")
-            with message_tab:
-                with st.container(key='message_container_key', border=True):
-                    st.subheader("📝 Modelo de mensagem")
-                    st.info("Monte a sua mensagem usando chaves e os nomes das colunas. Quando estiver pronto, passe para a próxima aba ➡️.")
-                    message_template = st.text_area(
-                        "Mensagem",
-                        placeholder="Use {nome da coluna} para referenciar cada coluna na planilha. O valor será substituído pelo conteúdo da célula correspondente.",
-                        key="message_template_key",
-                        help="Use {nome} para referenciar uma coluna da planilha.",
-                        max_chars=5000
+                with search_assertiva_col:
+                    search_assertiva = st.button(
+                        "🔍 Buscar Telefone",
+                        key="search_assertiva_btn_key",
+                        help="Buscar telefone mais recente usando Assertiva" if may_access else msg,
+                        disabled=not may_access
                     )
-                    st.caption(f"Estas são as colunas disponíveis na planilha: {', '.join(st.session_state['df_wpp'].columns)}")
-            with lines_tab:
-                with st.container(key='special_params_container_key', border=True):
-                    st.subheader("📍 Linhas para disparar")
-                    st.info("Defina quais linhas da planilha devem ser disparadas. Quando estiver pronto, passe para a próxima aba ➡️.")
-                    from_col, to_col = st.columns(2, vertical_alignment="center")
-                    with from_col:
-                        from_col_select = st.number_input(
-                            "Enviar de (linha)",
-                            min_value=1,
-                            max_value=len(st.session_state['df_wpp']),
-                            value=1,
-                            step=1,
-                            key="from_col_select_key"
-                        )
-                    with to_col:
-                        to_col_select = st.number_input(
-                            "Enviar até (linha)",
-                            min_value=from_col_select,
-                            max_value=len(st.session_state['df_wpp']),
-                            value=len(st.session_state['df_wpp']),
-                            step=1,
-                            key="to_col_select_key"
-                        )
-            with time_tab:
-                with st.container(key='time_container_key', border=True):
-                    st.subheader("⏳ Tempo entre cada disparo")
-                    st.info("Configure quantos segundos haverá entre cada disparo. Quando estiver pronto, passe para a próxima aba ➡️.")
-                    start_secs_col, end_secs_col = st.columns(2, vertical_alignment="center")
-                    with start_secs_col:
-                        start_secs_select = st.number_input(
-                            "Aguardar de (segundos)",
-                            min_value=0,
-                            max_value=60,
-                            value=1,
-                            step=1,
-                            key="start_secs_select_key"
+                    if search_assertiva:
+                        st.session_state['getting_phones_assertiva'] = True
+                        st.session_state['column_getting_phones_assertiva'] = col_name
+                        st.rerun(scope='fragment')
+                if 'getting_phones_assertiva' in st.session_state and st.session_state['getting_phones_assertiva']:
+                    with st.status("Consultando Assertiva...") as status:
+                        valores = st.session_state['df_wpp'][st.session_state['column_getting_phones_assertiva']].tolist()
+                        results, summary = assertiva.enrich_documents(
+                            valores,
+                            on_progress=lambda done, total: status.update(label=f"Consultando Assertiva... ({done}/{total} documentos únicos)")
                         )
-                    with end_secs_col:
-                        end_secs_select = st.number_input(
-                            "Aguardar até (segundos)",
-                            min_value=start_secs_select,
-                            max_value=60,
-                            value=30,
-                            step=1,
-                            key="end_secs_select_key"
+                        st.session_state['assertiva_summary'] = summary
+                        phones_list = []
+                        for i, item in enumerate(results):
+                            if item["error"] is not None:
+                                with st.container(key=f"getting_assertiva_phones_{i}_{str(item['documento'])}", border=True):
+                                    st.write(f"Erro ao buscar telefone de \"{item['documento']}\".")
+                                    st.error(item["error"])
+                                    phones_list.append('')
+                            else:
+                                phones_list.append(item["result"]["e164"] if item["result"] else None)
+                        # novo DataFrame (sem alterar o carregado): df_wpp_base é a referência do "Salvar Alterações"
+                        st.session_state["df_wpp"] = st.session_state["df_wpp"].assign(
+                            **{f"Telefone {st.session_state['column_getting_phones_assertiva']}": phones_list}
                         )
-                    st.caption("A cada disparo, será aplicado um atraso aleatório (em segundos) entre Aguardar de e Aguardar até.")
-            with phone_tab:
-                with st.container(key='phones_container_key', border=True):
-                    st.subheader("📱 Telefones")
-                    st.info("Indique quais números de telefone usar nos disparos. Quando estiver pronto, passe para a próxima aba ➡️.")
-                    phone_owner_opts = list(map(lambda val: val.title(), st.secrets["ultramsg"].keys()))
-                    owner_select = st.multiselect(
-                        "📞 Selecione o(s) remetente(s)",
-                        options=phone_owner_opts,
-                        default=phone_owner_opts,
-                        key="phone_number_select",
-                        help="Selecione o(s) remetente(s) para enviar as mensagens."
-                    )
-                    for owner in owner_select:
-                        st.info(st.secrets["ultramsg"][owner.lower()]["PHONE_NUMBER"])
-                    st.caption("Os disparos são feitos alternadamente entre um e outro telefone de forma sequencial.")
-                    detected_col = algorithms.detect_brazil_phone_column(st.session_state['df_wpp'])[0]
-                    col_name_dest = st.selectbox(
-                        '📲 Defina a coluna da planilha com os números de telefone destinatários',
-                        options=cols,
-                        index=cols.index(detected_col) if detected_col in cols else 0,
-                        key="col_name_dest_key",
-                        help="Selecione a coluna que contenha os números de telefone para enviar as mensagens"
+                        st.session_state['assertiva_edited'] = True
+                        st.session_state['getting_phones_assertiva'] = False
+                        st.rerun(scope='fragment')
+                if st.session_state.get('assertiva_summary'):
+                    summary = st.session_state['assertiva_summary']
+                    st.caption(
+                        f"Última consulta: {summary['unique']} documento(s) único(s) consultado(s), "
+                        f"{summary['duplicates']} duplicado(s) sem custo, "
+                        f"{summary['invalid']} inválido(s) e {summary['empty']} vazio(s) ignorado(s)."
                     )
-            with start_tab:
+                df_edited = st.data_editor(
+                    st.session_state['df_wpp'],
+                    key=f"data_editor_{st.session_state['df_name']}",
+                    use_container_width=True,
+                    hide_index=True,
+                    num_rows="dynamic",
+                    disabled='getting_phones_assertiva' in st.session_state and st.session_state['getting_phones_assertiva']
+                )
                 if st.button(
-                    "Enviar mensagens",
-                    help="Enviar mensagens para os contatos da planilha selecionada.",
-                    type="primary",
-                    key="send_msgs_btn_key",
-                    disabled=len(message_template.strip()) == 0 or from_col_select > to_col_select or start_secs_select > end_secs_select,
-                    use_container_width=True
+                    "Salvar Alterações",
+                    key=f"save_button_{st.session_state['df_name']}",
+                    disabled=df_edited.equals(st.session_state['df_wpp']) and not st.session_state['assertiva_edited']
                 ):
-                    df_edited["mensagem"] = df_edited.apply(lambda row: message_template.strip().format(**row.to_dict()), axis=1)
-                    start_1b = int(from_col_select)
-                    end_1b = int(to_col_select)
-                    start = max(0, start_1b - 1)
-                    end = min(len(df_edited) - 1, end_1b - 1)
-                    subset = df_edited.iloc[start:end + 1]
-                    st.session_state['sending_msgs'] = True
-                    st.session_state['sending_subset'] = subset
-                    st.session_state['sending_col_name_dest'] = col_name_dest
-                    st.session_state['sending_start_secs_select'] = start_secs_select
-                    st.session_state['sending_end_secs_select'] = end_secs_select
+                    try:
+                        revision = worksheets.save_changes(
+                            st.session_state['df_name'],
+                            st.session_state['df_wpp_base'],
+                            df_edited,
+                            st.session_state['df_wpp_revision']
+                        )
+                        if revision:
+                            st.success(f"Alterações salvas em {st.session_state['df_name']}!")
+                            saved = df_edited.reset_index(drop=True)
+                            st.session_state['df_wpp'] = saved
+                            st.session_state['df_wpp_base'] = saved
+                            st.session_state['df_wpp_revision'] = revision
+                            st.session_state['assertiva_edited'] = False
+                            st.rerun(scope="app")
+                    except Exception as e:
+                        st.error(f"Erro ao salvar alterações: {e}")
+        with message_tab:
+            with st.container(key='message_container_key', border=True):
+                st.subheader("📝 Modelo de mensagem")
+                st.info("Monte a sua mensagem usando chaves e os nomes das colunas. Quando estiver pronto, passe para a próxima aba ➡️.")
+                message_template = st.text_area(
+                    "Mensagem",
+                    placeholder="Use {nome da coluna} para referenciar cada coluna na planilha. O valor será substituído pelo conteúdo da célula correspondente.",
+                    key="message_template_key",
+                    help="Use {nome} para referenciar uma coluna da planilha.",
+                    max_chars=5000
+                )
+                st.caption(f"Estas são as colunas disponíveis na planilha: {', '.join(map(str, df_edited.columns))}")
+                template, template_error = None, None
+                if message_template.strip():
+                    try:
+                        template = MessageTemplate(message_template.strip(), df_edited.columns, sample=df_edited)
+                    except TemplateError as e:
+                        template_error = str(e)
+                        st.error(template_error)
+                    else:
+                        if len(df_edited):
+                            st.caption("Prévia (1ª linha):")
+                            st.text(template.render(df_edited.head(1)).iloc[0])
+        with lines_tab:
+            with st.container(key='special_params_container_key', border=True):
+                st.subheader("📍 Linhas para disparar")
+                st.info("Defina quais linhas da planilha devem ser disparadas. Quando estiver pronto, passe para a próxima aba ➡️.")
+                from_col, to_col = st.columns(2, vertical_alignment="center")
+                with from_col:
+                    from_col_select = st.number_input(
+                        "Enviar de (linha)",
+                        min_value=1,
+                        max_value=len(st.session_state['df_wpp']),
+                        value=1,
+                        step=1,
+                        key="from_col_select_key"
+                    )
+                with to_col:
+                    to_col_select = st.number_input(
+                        "Enviar até (linha)",
+                        min_value=from_col_select,
+                        max_value=len(st.session_state['df_wpp']),
+                        value=len(st.session_state['df_wpp']),
+                        step=1,
+                        key="to_col_select_key"
+                    )
+        with time_tab:
+            with st.container(key='time_container_key', border=True):
+                st.subheader("⏳ Tempo entre cada disparo")
+                st.info("Configure quantos segundos haverá entre cada disparo. Quando estiver pronto, passe para a próxima aba ➡️.")
+                start_secs_col, end_secs_col = st.columns(2, vertical_alignment="center")
+                with start_secs_col:
+                    start_secs_select = st.number_input(
+                        "Aguardar de (segundos)",
+                        min_value=0,
+                        max_value=60,
+                        value=1,
+                        step=1,
+                        key="start_secs_select_key"
+                    )
+                with end_secs_col:
+                    end_secs_select = st.number_input(
+                        "Aguardar até (segundos)",
+                        min_value=start_secs_select,
+                        max_value=60,
+                        value=30,
+                        step=1,
+                        key="end_secs_select_key"
+                    )
+                st.caption("A cada disparo, será aplicado um atraso aleatório (em segundos) entre Aguardar de e Aguardar até.")
+        with phone_tab:
+            with st.container(key='phones_container_key', border=True):
+                st.subheader("📱 Telefones")
+                st.info("Indique quais números de telefone usar nos disparos. Quando estiver pronto, passe para a próxima aba ➡️.")
+                phone_owner_opts = list(map(lambda val: val.title(), st.secrets["ultramsg"].keys()))
+                owner_select = st.multiselect(
+                    "📞 Selecione o(s) remetente(s)",
+                    options=phone_owner_opts,
+                    default=phone_owner_opts,
+                    key="phone_number_select",
+                    help="Selecione o(s) remetente(s) para enviar as mensagens."
+                )
+                distribution = st.radio(
+                    "Distribuição das linhas entre os remetentes",
+                    options=["Alternada", "Ponderada"],
+                    horizontal=True,
+                    key="lanes_distribution_key",
+                    help="Alternada: cada remetente recebe a mesma quantidade de linhas. Ponderada: proporcional ao peso de cada um."
+                )
+                lanes = []
+                for owner in owner_select:
+                    profile = owner.lower()
+                    with st.expander(f"{owner} — {st.secrets['ultramsg'][profile]['PHONE_NUMBER']}"):
+                        lane_min_col, lane_max_col, lane_rate_col, lane_weight_col = st.columns(4, vertical_alignment="bottom")
+                        with lane_min_col:
+                            lane_min = st.number_input("Aguardar de (s)", min_value=0, max_value=600, value=int(start_secs_select), step=1, key=f"lane_min_{profile}")
+                        with lane_max_col:
+                            lane_max = st.number_input("Aguardar até (s)", min_value=lane_min, max_value=600, value=max(int(end_secs_select), lane_min), step=1, key=f"lane_max_{profile}")
+                        with lane_rate_col:
+                            lane_rate = st.number_input("Máx. mensagens/hora", min_value=0, value=0, step=10, key=f"lane_rate_{profile}", help="0 = sem limite além do intervalo")
+                        with lane_weight_col:
+                            lane_weight = st.number_input("Peso", min_value=1, value=1, step=1, key=f"lane_weight_{profile}", disabled=distribution != "Ponderada")
+                    lanes.append({
+                        "profile": profile,
+                        "weight": lane_weight if distribution == "Ponderada" else 1,
+                        "delay_min": lane_min,
+                        "delay_max": lane_max,
+                        "rate_per_hour": lane_rate or None,
+                    })
+                st.caption("Cada remetente envia em paralelo, com o próprio intervalo entre disparos; quem terminar a sua parte ajuda com as linhas restantes.")
+                detected_col = detected["phone"][0]
+                col_name_dest = st.selectbox(
+                    '📲 Defina a coluna da planilha com os números de telefone destinatários',
+                    options=cols,
+                    index=cols.index(detected_col) if detected_col in cols else 0,
+                    key="col_name_dest_key",
+                    help="Selecione a coluna que contenha os números de telefone para enviar as mensagens"
+                )
+        with start_tab:
+            if st.button(
+                "Enviar mensagens",
+                help="Enviar mensagens para os contatos da planilha selecionada.",
+                type="primary",
+                key="send_msgs_btn_key",
+                disabled=template is None or from_col_select > to_col_select or start_secs_select > end_secs_select or not lanes,
+                use_container_width=True
+            ):
+                start_1b = int(from_col_select)
+                end_1b = int(to_col_select)
+                start = max(0, start_1b - 1)
+                end = min(len(df_edited) - 1, end_1b - 1)
+                subset = df_edited.iloc[start:end + 1]
+                # só o recorte é formatado; o texto de cada mensagem é montado pelo worker no envio
+                try:
+                    fields = template.field_values(subset).to_dict(orient="records")
+                except TemplateError as e:
+                    st.error(str(e))
+                else:
+                    destinos = subset[col_name_dest].astype(str).tolist()
+                    messages = [
+                        {"row_id": start + offset + 1, "to": to, "fields": row_fields}
+                        for offset, (to, row_fields) in enumerate(zip(destinos, fields))
+                    ]
+                    campaigns.get_store().create(
+                        st.session_state['df_name'],
+                        messages,
+                        lanes=lanes,
+                        delay_min=start_secs_select,
+                        delay_max=end_secs_select,
+                        template=template
+                    )
+                    st.success(f"Campanha criada com {len(messages)} mensagem(ns). O envio continua mesmo se você sair desta página.")
+            st.subheader("📋 Campanhas desta planilha")
+            render_campaigns_panel(st.session_state['df_name'])
+
+
+@st.fragment(run_every=3)
+def render_campaigns_panel(sheet: str):
+    store = campaigns.get_store()
+    items = store.list(sheet)
+    if not items:
+        st.caption("Nenhuma campanha criada para esta planilha.")
+        return
+    for c in items:
+        with st.container(border=True, key=f"campaign_{c['id']}"):
+            info_col, actions_col = st.columns([3, 1], vertical_alignment="center")
+            done = c["sent"] + c["failed"]
+            with info_col:
+                st.markdown(
+                    f"**{campaigns.STATUS_LABELS.get(c['status'], c['status'])}** — "
+                    f"criada em {datetime.fromtimestamp(c['created_at']).strftime('%d/%m/%Y %H:%M')}"
+                )
+                st.progress(
+                    done / c["total"] if c["total"] else 1.0,
+                    f"{done}/{c['total']} processada(s) — {c['sent']} enviada(s), {c['failed']} falha(s)"
+                )
+                if c["checkpoint_row"] is not None:
+                    st.caption(f"Checkpoint: tudo processado até a linha {c['checkpoint_row']} da planilha.")
+                if c["status"] == "interrupted":
+                    st.warning("O envio foi interrompido (servidor reiniciado). \"Retomar\" continua do checkpoint, sem reenviar o que já foi enviado.")
+                lanes = store.lanes(c["id"])
+                if lanes:
+                    st.dataframe(
+                        pd.DataFrame([
+                            {
+                                "Remetente": lane["profile"].title(),
+                                "Enviadas": lane["sent"],
+                                "Falhas": lane["failed"],
+                                "Msgs/hora": round(lane["per_hour"]) if lane["per_hour"] else None,
+                                "Próximo envio (s)": max(0, round(lane["next_send_at"] - time.time())) if c["status"] == "running" else None,
+                            }
+                            for lane in lanes
+                        ]),
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                delivery = store.delivery(c["id"])
+                if delivery["latency_avg_ms"] is not None:
+                    st.caption(
+                        f"Latência da UltraMsg: {delivery['latency_avg_ms']:.0f} ms em média, "
+                        f"{delivery['latency_p95_ms']:.0f} ms no p95"
+                        + (f" — {delivery['per_minute']:.1f} msg/min" if delivery["per_minute"] else "")
+                    )
+            with actions_col:
+                if c["status"] == "running" and st.button("⏸️ Pausar", key=f"pause_campaign_{c['id']}", use_container_width=True):
+                    store.pause(c["id"])
+                    st.rerun(scope='fragment')
+                if c["status"] == "paused" and st.button("▶️ Continuar", key=f"resume_campaign_{c['id']}", use_container_width=True):
+                    store.resume(c["id"])
+                    st.rerun(scope='fragment')
+                if c["status"] == "interrupted" and st.button("⏯️ Retomar", key=f"resume_interrupted_campaign_{c['id']}", use_container_width=True):
+                    store.resume(c["id"])
+                    st.rerun(scope='fragment')
+                if c["status"] in ("running", "paused", "interrupted") and st.button("❌ Cancelar", key=f"cancel_campaign_{c['id']}", use_container_width=True):
+                    store.cancel(c["id"])
+                    st.rerun(scope='fragment')
+                if c["status"] == "done" and c["failed"] and st.button("🔁 Reenviar falhas", key=f"retry_campaign_{c['id']}", use_container_width=True):
+                    store.retry_failed(c["id"])
                     st.rerun(scope='fragment')
 
 
@@ -365,47 +489,91 @@ def main():
             "⚠️ Defina SUPABASE_URL e SUPABASE_KEY em variáveis de ambiente ou em st.secrets para habilitar o armazenamento."
         )
         return
-    st.session_state.files = worksheets.list_cloud_files()
+    campaigns.ensure_worker()
     if "show_wpp_view" in st.session_state and st.session_state.show_wpp_view:
         render_whatsapp_fragment()
-    elif st.session_state.files:
-        _, upload_col = st.columns([10, 3], vertical_alignment="center")
-        with upload_col:
-            upload_button()
-        with st.container(border=True):
+        return
+    _, upload_col = st.columns([10, 3], vertical_alignment="center")
+    with upload_col:
+        upload_button()
+    with st.container(border=True):
+        search_col, sort_col, order_col, size_col = st.columns([6, 2, 2, 2], vertical_alignment="bottom")
+        with search_col:
             search_query = st.text_input(
                 "🔍 Pesquisar planilhas",
-                placeholder="Digite o nome da planilha...",
+                placeholder="Digite parte do nome da planilha...",
                 key="search_sheets"
             )
-        searched_files = st.session_state.files
+        with sort_col:
+            sort_by = st.selectbox(
+                "Ordenar por",
+                options=list(worksheets.LIST_SORT_COLUMNS),
+                format_func=worksheets.LIST_SORT_COLUMNS.get,
+                key="sort_sheets"
+            )
+        with order_col:
+            descending = st.toggle("Decrescente", key="sort_sheets_desc")
+        with size_col:
+            page_size = st.selectbox("Por página", options=SHEETS_PAGE_SIZES, index=1, key="sheets_page_size")
+    query = (search_query.strip(), sort_by, descending)
+    if st.session_state.get("sheets_query") != (query, page_size):
+        st.session_state["sheets_query"] = (query, page_size)
+        st.session_state["sheets_page"] = 0
+    page = st.session_state.get("sheets_page", 0)
+    try:
+        files, has_more = worksheets.list_cloud_page(*query, page=page, page_size=page_size)
+    except Exception as e:
+        st.error(f"Erro Supabase: {e}")
+        return
+    if not files and page:
+        # a página ficou vazia (ex.: último arquivo dela excluído): volta para a anterior
+        st.session_state["sheets_page"] = page - 1
+        st.rerun()
+    if not files:
         if search_query:
-            searched_files = [f for f in st.session_state.files if search_query.lower() in f.lower()]
-            if not searched_files:
-                st.warning("Nenhuma planilha encontrada com esse termo.")
-        for i, file in enumerate(searched_files):
-            with st.container(border=True, key=f'worksheet_container_{i}'):
-                file_name_header_col, action_header_col = st.columns([3, 1], vertical_alignment="center")
-                with file_name_header_col:
-                    st.markdown("**Nome**")
-                with action_header_col:
-                    _, action_name_col, _ = st.columns(3, vertical_alignment="center")
-                    with action_name_col:
-                        st.markdown("**Ações**")
-                file_name_col, action_col = st.columns([3, 1], vertical_alignment="center")
-                with file_name_col:
-                    st.markdown(file)
-                with action_col:
-                    whatsapp_col, download_col, del_col = st.columns(3, vertical_alignment="center")
-                    with whatsapp_col:
-                        wpp_button(file)
-                    with download_col:
-                        download_button(file)
-                    with del_col:
-                        del_button(file)
-    else:
-        st.warning("Nenhuma planilha armazenada. Faça upload para começar.")
-        upload_button()
-
+            st.warning("Nenhuma planilha encontrada com esse termo.")
+        else:
+            st.warning("Nenhuma planilha armazenada. Faça upload para começar.")
+        return
+    # uma única tabela por página (em vez de widgets por arquivo) e uma barra de ações para a linha selecionada
+    event = st.dataframe(
+        _files_frame(files),
+        key=f"sheets_table_{page}_{abs(hash((query, page_size)))}",
+        on_select="rerun",
+        selection_mode="single-row",
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Tamanho (KB)": st.column_config.NumberColumn(format="%.0f"),
+            "Atualização": st.column_config.DatetimeColumn(format="DD/MM/YYYY HH:mm"),
+        }
+    )
+    selected = event.selection.rows
+    with st.container(border=True):
+        if not selected:
+            st.caption("Selecione uma planilha na tabela para ver as ações.")
+        else:
+            name = files[selected[0]]["name"]
+            name_col, whatsapp_col, download_col, del_col = st.columns([9, 1, 1, 1], vertical_alignment="center")
+            with name_col:
+                st.markdown(f"**{name}**")
+            with whatsapp_col:
+                wpp_button(name)
+            with download_col:
+                download_button(name)
+            with del_col:
+                del_button(name)
+    if page or has_more:
+        prev_col, page_col, next_col = st.columns([1, 2, 1], vertical_alignment="center")
+        with prev_col:
+            if st.button("⬅️ Anterior", key="sheets_prev_page", disabled=page == 0, use_container_width=True):
+                st.session_state["sheets_page"] = page - 1
+                st.rerun()
+        with page_col:
+            st.caption(f"Página {page + 1}")
+        with next_col:
+            if st.button("Próxima ➡️", key="sheets_next_page", disabled=not has_more, use_container_width=True):
+                st.session_state["sheets_page"] = page + 1
+                st.rerun()
 
 main()
\ No newline at end of file